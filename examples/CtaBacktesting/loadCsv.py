@@ -6,8 +6,12 @@
 
 from vnpy.trader.app.ctaStrategy.ctaBase import MINUTE_DB_NAME
 from vnpy.trader.app.ctaStrategy.ctaHistoryData import loadMcCsv
+from vnpy.trader.app.ctaStrategy.ctaBulkLoader import loadCsvFiles
 
 
 if __name__ == '__main__':
     loadMcCsv('IF0000_1min.csv', MINUTE_DB_NAME, 'IF0000')
+    
+    # 多个文件并行导入（文件名, 代码）
+    #loadCsvFiles([('IF0000_1min.csv', 'IF0000'), ('rb0000_1min.csv', 'RB0000')], 'mc', MINUTE_DB_NAME)
 
@@ -35,8 +35,20 @@ if __name__ == '__main__':
     d = {'atrLength': 11}
     engine.initStrategy(AtrRsiStrategy, d)
     
+    # tick模式下复用同一个tick对象回放，速度更快（策略中需要保存历史tick时调用tick.copy()）
+    #engine.setReuseTick(True)
+    
+    # K线模式下使用K线内部的tick撮合委托（只读取存在活动委托的K线的tick），成交价格接近tick回测
+    #engine.setIntrabarTick('VnTrader_Tick_Db', 'IF0000')
+    
+    # 长时间的tick回测可以设置快照，延长结束日期后再次回测时只回放快照之后的新数据
+    #engine.setSnapshot('AtrRsiStrategy.snapshot', 5)
+    
     # 开始跑回测
     engine.runBacktesting()
     
     # 显示回测结果
-    engine.showBacktestingResult()
\ No newline at end of file
+    engine.showBacktestingResult()
+    
+    # 蒙特卡洛分析：交易顺序重排和每日盈亏分块重抽样，显示最大回撤、收益率、夏普比率的分位数
+    #engine.showMonteCarloResult(10000, blockSize=20)
\ No newline at end of file
@@ -31,6 +31,9 @@ if __name__ == '__main__':
     # 设置使用的历史数据库
     engine.setDatabase(MINUTE_DB_NAME, 'IF0000')
     
+    # 使用回测结果缓存，重复的参数组合直接读取之前的结果
+    #engine.setResultCache()
+    
     # 跑优化
     setting = OptimizationSetting()                 # 新建一个优化任务设置对象
     setting.setOptimizeTarget('capital')            # 设置优化排序的目标是策略净盈利
@@ -47,6 +50,20 @@ if __name__ == '__main__':
     #engine.runOptimization(AtrRsiStrategy, setting)            
     
     # 多进程优化，耗时：89秒
-    engine.runParallelOptimization(AtrRsiStrategy, setting)
+    # 每组参数的结果实时写入结果文件，中断后再次运行会跳过已完成的参数组合
+    engine.runParallelOptimization(AtrRsiStrategy, setting, 'optimizationResult.txt')
+    
+    # 每个进程任务中同时回测多组参数，数据只读取和解析一次
+    #engine.runParallelOptimization(AtrRsiStrategy, setting, 'optimizationResult.txt', batchSize=8)
+    
+    # 参数组合过多时，可以使用启发式搜索只回测其中一部分组合
+    #from vnpy.trader.app.ctaStrategy.ctaBacktesting import RandomSearch, GeneticSearch, HalvingSearch
+    #engine.runSearchOptimization(AtrRsiStrategy, setting, RandomSearch(count=20))
+    #engine.runSearchOptimization(AtrRsiStrategy, setting, GeneticSearch(population=10, generations=5))
+    #engine.runSearchOptimization(AtrRsiStrategy, setting, HalvingSearch(count=27, eta=3))
+    
+    # 滚动优化：样本内120天优化参数，样本外30天回测，所有窗口共享同一份历史数据缓存
+    #from vnpy.trader.app.ctaStrategy.ctaWalkForward import WalkForwardEngine
+    #WalkForwardEngine(engine, 120, 30).showWalkForwardResult(AtrRsiStrategy, setting)
     
     print u'耗时：%s' %(time.time()-start)
\ No newline at end of file
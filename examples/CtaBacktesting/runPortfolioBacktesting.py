@@ -0,0 +1,46 @@
+# encoding: UTF-8
+
+"""
+展示如何执行多品种组合回测。
+"""
+
+from __future__ import division
+
+
+from vnpy.trader.app.ctaStrategy.ctaBacktesting import MINUTE_DB_NAME
+from vnpy.trader.app.ctaStrategy.ctaPortfolioBacktesting import PortfolioBacktestingEngine
+
+
+if __name__ == '__main__':
+    from vnpy.trader.app.ctaStrategy.strategy.strategyAtrRsi import AtrRsiStrategy
+    from vnpy.trader.app.ctaStrategy.strategy.strategyKingKeltner import KkStrategy
+    
+    # 创建组合回测引擎
+    engine = PortfolioBacktestingEngine()
+    
+    # 设置引擎的回测模式为K线
+    engine.setBacktestingMode(engine.BAR_MODE)
+
+    # 设置回测用的数据起始日期
+    engine.setStartDate('20120101')
+    
+    # 设置组合的起始资金
+    engine.setCapital(3000000)
+    
+    # 设置使用的历史数据库
+    engine.setDatabase(MINUTE_DB_NAME, '')
+    
+    # 添加品种，设置合约大小、价格最小变动、手续费率、滑点
+    engine.addSymbol('IF0000', size=300, priceTick=0.2, rate=0.3/10000, slippage=0.2)
+    engine.addSymbol('rb0000', size=10, priceTick=1, rate=1/10000, slippage=1)
+    
+    # 添加策略，每个策略交易一个品种
+    engine.addStrategy(AtrRsiStrategy, {'name': 'atrrsi IF', 'vtSymbol': 'IF0000'})
+    engine.addStrategy(KkStrategy, {'name': 'kk IF', 'vtSymbol': 'IF0000'})
+    engine.addStrategy(AtrRsiStrategy, {'name': 'atrrsi rb', 'vtSymbol': 'rb0000'})
+    
+    # 开始跑回测，所有品种的数据按时间顺序合并回放
+    engine.runBacktesting()
+    
+    # 显示组合按日统计的结果
+    engine.showDailyResult()
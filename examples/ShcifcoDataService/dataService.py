@@ -5,7 +5,7 @@ import time
 import datetime
 import random
 
-from pymongo import MongoClient, ASCENDING
+from pymongo import MongoClient, ASCENDING, ReplaceOne
 
 from vnpy.data.shcifco.vnshcifco import ShcifcoApi, PERIOD_1MIN
 from vnpy.trader.vtObject import VtBarData
@@ -48,29 +48,40 @@ def generateVtBar(d):
     return bar
 
 #----------------------------------------------------------------------
-def downMinuteBarBySymbol(symbol, num):
-    """下载某一合约的分钟线数据"""
-    start = time.time()
-    
+def saveMinuteBar(symbol, l):
+    """把下载的分钟线数据批量写入数据库"""
     cl = db[symbol]                                                 # 集合
     cl.ensure_index([('datetime', ASCENDING)], unique=True)         # 添加索引
     
-    l = api.getHisBar(symbol, num, period=PERIOD_1MIN)
+    requestList = []
+    for d in l:
+        bar = generateVtBar(d)
+        requestList.append(ReplaceOne({'datetime': bar.datetime}, bar.__dict__, upsert=True))
+    cl.bulk_write(requestList, ordered=False)
+
+#----------------------------------------------------------------------
+def downMinuteBarBySymbol(symbol, num, l=None):
+    """下载某一合约的分钟线数据，l为已经下载的数据（多合约同时下载时传入）"""
+    start = time.time()
+    
+    # 传入已下载的数据时，耗时只包含写入数据库的时间
+    if l is None:
+        l = api.getHisBar(symbol, num, period=PERIOD_1MIN)
+        costName = u'下载和写入耗时'
+    else:
+        costName = u'写入耗时'
+    
     if not l:
         print u'%s数据下载失败' %symbol
         return
     
-    for d in l:
-        bar = generateVtBar(d)
-        d = bar.__dict__
-        flt = {'datetime': bar.datetime}
-        cl.replace_one(flt, d, True)
+    saveMinuteBar(symbol, l)
 
     end = time.time()
     cost = (end - start) * 1000
 
-    print u'合约%s数据下载完成%s - %s，耗时%s毫秒' %(symbol, generateVtBar(l[0]).datetime,
-                                                  generateVtBar(l[-1]).datetime, cost)
+    print u'合约%s数据下载完成%s - %s，%s%s毫秒' %(symbol, generateVtBar(l[0]).datetime,
+                                               generateVtBar(l[-1]).datetime, costName, cost)
 
 #----------------------------------------------------------------------
 def downloadAllMinuteBar(num):
@@ -79,9 +90,14 @@ def downloadAllMinuteBar(num):
     print u'开始下载合约分钟线数据'
     print '-' * 50
     
+    # 使用连接池同时下载所有合约，再逐个写入数据库
+    start = time.time()
+    resultDict = api.getMultiHisBar(SYMBOLS, num, period=PERIOD_1MIN)
+    cost = (time.time() - start) * 1000
+    print u'%s个合约数据同时下载完成，耗时%s毫秒' %(len(SYMBOLS), cost)
+    
     for symbol in SYMBOLS:
-        downMinuteBarBySymbol(symbol, num)
-        time.sleep(1)
+        downMinuteBarBySymbol(symbol, num, resultDict[symbol])
 
     print '-' * 50
     print u'合约分钟线数据下载完成'
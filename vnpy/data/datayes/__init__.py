@@ -1 +1 @@
-from vndatayes import DatayesApi
\ No newline at end of file
+from vndatayes import DatayesApi, DATAYES_DOMAIN
\ No newline at end of file
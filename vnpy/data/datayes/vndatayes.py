@@ -9,6 +9,8 @@ import json
 
 HTTP_OK = 200
 
+DATAYES_DOMAIN = "http://api.wmcloud.com/data"     # 通联数据的主域名
+
 
 ########################################################################
 class DatayesApi(object):
@@ -16,22 +18,40 @@ class DatayesApi(object):
 
     #----------------------------------------------------------------------
     def __init__(self, token, 
-                 domain="http://api.wmcloud.com/data",
-                 version="v1"):
-        """Constructor"""
+                 domain=DATAYES_DOMAIN,
+                 version="v1",
+                 poolSize=10,
+                 timeout=30):
+        """
+        Constructor
+        poolSize：连接池大小，多线程同时下载时每个线程可以复用一个连接
+        timeout：请求超时秒数
+        """
         self.domain = domain        # 主域名
         self.version = version      # API版本
         self.token = token          # 授权码
+        self.timeout = timeout      # 请求超时
         
         self.header = {}            # http请求头部
         self.header['Connection'] = 'keep_alive'
         self.header['Authorization'] = 'Bearer ' + self.token                
+        
+        # 所有请求共享同一个会话，复用TCP连接
+        self.session = requests.Session()
+        self.session.headers.update(self.header)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
     
     #----------------------------------------------------------------------
     def downloadData(self, path, params):
         """下载数据"""
         url = '/'.join([self.domain, self.version, path])
-        r = requests.get(url=url, headers=self.header, params=params)
+        try:
+            r = self.session.get(url=url, params=params, timeout=self.timeout)
+        except requests.RequestException as e:
+            print u'http请求失败，错误信息%s' %e
+            return None
         
         if r.status_code != HTTP_OK:
             print u'http请求失败，状态代码%s' %r.status_code
@@ -24,4 +24,10 @@ if __name__ == "__main__":
     # 获取历史分钟线
     print api.getHisBar(symbol, 500, period=PERIOD_1MIN)
     
+    # 按列解析历史分钟线（返回字段名和numpy数组的字典）
+    print api.getHisBar(symbol, 500, period=PERIOD_1MIN, columns=True)
+    
+    # 同时获取多个合约的最新tick
+    print api.getMultiLastTick([symbol, 'rb1710'])
+    
     
\ No newline at end of file
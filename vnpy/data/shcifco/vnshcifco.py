@@ -1,7 +1,12 @@
 # encoding: UTF-8
 
 
+import time
+import threading
+from multiprocessing.pool import ThreadPool
+
 import requests
+import numpy as np
 
 HTTP_OK = 200
 
@@ -11,27 +16,110 @@ PERIOD_15MIN = '15m'
 PERIOD_60MIN = '60m'
 PERIOD_1DAY = '1d'
 
+# 历史K线数据中每一行的字段，tradingDay为交易日，date为自然日（和数据字典中的date一致）
+HISBAR_FIELD_LIST = ['symbol', 'tradingDay', 'time', 'open', 'high', 'low', 'close', 'volume', 'openInterest', 'date']
+
+
+########################################################################
+class TtlCache(object):
+    """有过期时间的缓存，用于合并短时间内对同一数据的重复查询（线程安全）"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, ttl, maxSize=10000):
+        """
+        Constructor
+        ttl：数据的有效秒数，为0时不缓存
+        maxSize：最多缓存的数据数量，超出时清除过期数据
+        """
+        self.ttl = ttl
+        self.maxSize = maxSize
+
+        self.dataDict = {}      # key: (过期时间, 数据)
+        self.lock = threading.Lock()
+
+    #----------------------------------------------------------------------
+    def get(self, key):
+        """获取未过期的数据，没有则返回None"""
+        with self.lock:
+            item = self.dataDict.get(key, None)
+
+        if item is None or item[0] < time.time():
+            return None
+        return item[1]
+
+    #----------------------------------------------------------------------
+    def put(self, key, value):
+        """保存数据"""
+        if not self.ttl or value is None:
+            return
+
+        now = time.time()
+        with self.lock:
+            if len(self.dataDict) >= self.maxSize:
+                self.dataDict = dict([(k, v) for k, v in self.dataDict.items() if v[0] >= now])
+
+                # 全部没有过期时清空
+                if len(self.dataDict) >= self.maxSize:
+                    self.dataDict.clear()
+
+            self.dataDict[key] = (now + self.ttl, value)
+
+    #----------------------------------------------------------------------
+    def clear(self):
+        """清空缓存"""
+        with self.lock:
+            self.dataDict.clear()
+
 
 ########################################################################
 class ShcifcoApi(object):
     """数据接口"""
 
     #----------------------------------------------------------------------
-    def __init__(self, ip, port, token):
-        """Constructor"""
+    def __init__(self, ip, port, token, poolSize=10, timeout=10, cacheTtl=0):
+        """
+        Constructor
+        poolSize：HTTP连接池大小，也是多合约查询时同时请求的线程数量
+        timeout：请求超时秒数
+        cacheTtl：最新tick、最新价格、最新K线查询结果的缓存秒数，为0时不缓存
+        """
         self.ip = ip
         self.port = port
         self.token = token
+        self.poolSize = poolSize
+        self.timeout = timeout
         
         self.service = 'ShcifcoApi'
         self.domain = 'http://' + ':'.join([self.ip, self.port])
+
+        # 所有请求共享同一个会话，保持连接不断开
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+        self.session.mount('http://', adapter)
+
+        self.cache = TtlCache(cacheTtl)
+        self.pool = None            # 多合约查询用的线程池，首次使用时创建
+
+    #----------------------------------------------------------------------
+    def close(self):
+        """关闭线程池和连接"""
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.session.close()
     
     #----------------------------------------------------------------------
     def getData(self, path, params):
         """下载数据"""
         url = '/'.join([self.domain, self.service, path])
         params['token'] = self.token
-        r = requests.get(url=url, params=params)
+
+        try:
+            r = self.session.get(url=url, params=params, timeout=self.timeout)
+        except requests.RequestException as e:
+            print u'http请求失败，错误信息%s' %e
+            return None
         
         if r.status_code != HTTP_OK:
             print u'http请求失败，状态代码%s' %r.status_code
@@ -39,13 +127,39 @@ class ShcifcoApi(object):
         else:
             return r.text
     
+    #----------------------------------------------------------------------
+    def getCachedData(self, path, params):
+        """下载数据，有效期内的重复查询直接使用缓存的结果"""
+        key = (path, tuple(sorted(params.items())))
+
+        data = self.cache.get(key)
+        if data is None:
+            data = self.getData(path, params)
+            self.cache.put(key, data)
+        return data
+
+    #----------------------------------------------------------------------
+    def getMultiData(self, func, symbolList, *args, **kwargs):
+        """
+        使用线程池同时查询多个合约，func为单个合约的查询函数（第一个参数为合约代码）
+        返回合约代码和查询结果的字典
+        """
+        if self.pool is None:
+            self.pool = ThreadPool(self.poolSize)
+
+        def task(symbol):
+            return func(symbol, *args, **kwargs)
+
+        resultList = self.pool.map(task, symbolList)
+        return dict(zip(symbolList, resultList))
+
     #----------------------------------------------------------------------
     def getLastTick(self, symbol):
         """获取最新Tick"""
         path = 'lasttick'
         params = {'ids': symbol}
         
-        data = self.getData(path, params)
+        data = self.getCachedData(path, params)
         if not data or data == ';':
             return None
         
@@ -69,7 +183,7 @@ class ShcifcoApi(object):
         path = 'lastprice'
         params = {'ids': symbol}
         
-        data = self.getData(path, params)
+        data = self.getCachedData(path, params)
         if not data:
             return None
         
@@ -83,7 +197,7 @@ class ShcifcoApi(object):
         path = 'lastbar'
         params = {'id': symbol}
         
-        data = self.getData(path, params)
+        data = self.getCachedData(path, params)
         if not data:
             return None
         
@@ -102,8 +216,12 @@ class ShcifcoApi(object):
         return d
     
     #----------------------------------------------------------------------
-    def getHisBar(self, symbol, num, date='', period=''):
-        """获取历史K线数据"""
+    def getHisBar(self, symbol, num, date='', period='', columns=False):
+        """
+        获取历史K线数据
+        columns：为True时返回字段名和numpy数组的字典（按列解析，数据量大时更快），
+                 否则返回数据字典的列表
+        """
         path = 'hisbar'
         
         # 默认参数
@@ -120,6 +238,9 @@ class ShcifcoApi(object):
         data = self.getData(path, params)
         if not data:
             return None
+
+        if columns:
+            return parseHisBarColumns(data)
         
         barList = []        
         l = data.split(';')
@@ -146,3 +267,60 @@ class ShcifcoApi(object):
             
         return barList
 
+    #----------------------------------------------------------------------
+    def getHisBarFrame(self, symbol, num, date='', period=''):
+        """获取历史K线数据，返回pandas的DataFrame"""
+        import pandas as pd
+
+        columnDict = self.getHisBar(symbol, num, date, period, columns=True)
+        if columnDict is None:
+            return None
+        return pd.DataFrame(columnDict, columns=HISBAR_FIELD_LIST)
+
+    #----------------------------------------------------------------------
+    def getMultiLastTick(self, symbolList):
+        """同时获取多个合约的最新Tick，返回合约代码和Tick数据的字典"""
+        return self.getMultiData(self.getLastTick, symbolList)
+
+    #----------------------------------------------------------------------
+    def getMultiLastPrice(self, symbolList):
+        """同时获取多个合约的最新成交价"""
+        return self.getMultiData(self.getLastPrice, symbolList)
+
+    #----------------------------------------------------------------------
+    def getMultiLastBar(self, symbolList):
+        """同时获取多个合约的最新一分钟K线数据"""
+        return self.getMultiData(self.getLastBar, symbolList)
+
+    #----------------------------------------------------------------------
+    def getMultiHisBar(self, symbolList, num, date='', period='', columns=False):
+        """同时获取多个合约的历史K线数据，返回合约代码和历史K线数据的字典"""
+        return self.getMultiData(self.getHisBar, symbolList, num, date, period, columns)
+
+
+#----------------------------------------------------------------------
+def parseHisBarColumns(data):
+    """
+    把历史K线数据的文本按列解析为numpy数组的字典
+    各行拼接后一次切分，按步长切片得到各列，数值列由numpy整列转换，不逐行创建字典
+    数值为空或者无法解析时抛出ValueError（和逐行解析一致）
+    """
+    fieldCount = len(HISBAR_FIELD_LIST)
+
+    # 过滤某些空数据和字段数量不对的数据
+    rowList = [barStr for barStr in data.split(';') if barStr.count(',') == fieldCount - 1]
+    valueList = ','.join(rowList).split(',') if rowList else []
+
+    columnDict = {}
+    for i, field in enumerate(HISBAR_FIELD_LIST):
+        column = valueList[i::fieldCount]
+
+        if field in ('open', 'high', 'low', 'close'):
+            array = np.array(column, dtype=np.float64)
+        elif field in ('volume', 'openInterest'):
+            array = np.array(column, dtype=np.int64)
+        else:
+            array = np.array(column)
+
+        columnDict[field] = array
+    return columnDict
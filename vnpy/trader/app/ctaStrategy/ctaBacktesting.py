@@ -9,27 +9,49 @@ from __future__ import division
 from datetime import datetime, timedelta
 from collections import OrderedDict
 from itertools import product
+from bisect import bisect_left, bisect_right, insort
 import multiprocessing
-import copy
+import random
+import shutil
+import tempfile
+import json
+import os
 
-import pymongo
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-
-# 如果安装了seaborn则设置为白色风格
-try:
-    import seaborn as sns       
-    sns.set_style('whitegrid')  
-except ImportError:
-    pass
 
 from vnpy.trader.vtGlobal import globalSetting
-from vnpy.trader.vtObject import VtTickData, VtBarData
+from vnpy.trader.vtObject import VtTickData, VtBarData, VtOrderData, VtTradeData
 from vnpy.trader.vtConstant import *
-from vnpy.trader.vtGateway import VtOrderData, VtTradeData
+from vnpy.trader.vtArchive import ArchiveDict
+from vnpy.trader.vtFunction import LazyModule
 
 from .ctaBase import *
+from .ctaHistoryCache import saveHistoryCache, HistoryCache
+from .ctaResultCache import BacktestResultCache
+from .ctaSnapshot import saveSnapshot, loadSnapshot
+from .ctaMonteCarlo import shuffleTrades, bootstrapDaily, calculatePercentiles
+from .ctaTickReplay import createTickViewClass, DictTickView
+from .ctaIntrabarTick import IntrabarTickStore
+from .ctaParamSearch import RandomSearch, GeneticSearch, HalvingSearch
+from .ctaVectorBacktesting import (BarFrame, calculateVectorPnl, calculateVectorResult,
+                                   calculateVectorStatistics)
+
+
+#----------------------------------------------------------------------
+def setPlotStyle(plt):
+    """载入matplotlib后，如果安装了seaborn则设置为白色风格"""
+    try:
+        import seaborn as sns       
+        sns.set_style('whitegrid')  
+    except ImportError:
+        pass
+
+
+# 数据库、按日统计和绘图用的模块在首次使用时才载入，
+# 多进程优化的子进程和不需要绘图的脚本不用付出这些模块的import开销
+pymongo = LazyModule('pymongo')
+pd = LazyModule('pandas')
+plt = LazyModule('matplotlib.pyplot', setPlotStyle)
 
 
 ########################################################################
@@ -42,6 +64,14 @@ class BacktestingEngine(object):
     
     TICK_MODE = 'tick'
     BAR_MODE = 'bar'
+    
+    stopOrderRetention = 10000      # 已结束停止单的保留数量
+    
+    # 回测快照中保存的引擎状态（另外还保存策略对象）
+    snapshotFieldList = ['stopOrderCount', 'stopOrderDict', 'workingStopOrderDict',
+                         'limitOrderCount', 'limitOrderDict', 'workingLimitOrderDict',
+                         'tradeCount', 'tradeDict', 'dailyResultDict', 'logList',
+                         'tick', 'bar', 'dt']
 
     #----------------------------------------------------------------------
     def __init__(self):
@@ -50,8 +80,8 @@ class BacktestingEngine(object):
         self.stopOrderCount = 0     # 编号计数：stopOrderID = STOPORDERPREFIX + str(stopOrderCount)
         
         # 本地停止单字典, key为stopOrderID，value为stopOrder对象
-        self.stopOrderDict = {}             # 停止单撤销后不会从本字典中删除
-        self.workingStopOrderDict = {}      # 停止单撤销后会从本字典中删除
+        self.stopOrderDict = ArchiveDict(self.stopOrderRetention)  # 停止单撤销后不会从本字典中删除（只保留最近的数据）
+        self.workingStopOrderDict = PriceIndexedOrderDict()     # 停止单撤销后会从本字典中删除
         
         self.engineType = ENGINETYPE_BACKTESTING    # 引擎类型为回测
         
@@ -75,13 +105,28 @@ class BacktestingEngine(object):
         self.dbName = ''            # 回测数据库名
         self.symbol = ''            # 回测集合名
         
+        self.historyCachePath = ''  # 历史数据缓存目录，设置后从缓存而不是数据库读取数据
+        self.searchCount = 0        # 启发式搜索优化时累计回测的参数组合数量
+        self.resultCache = None     # 回测结果缓存，设置后优化时重复的回测直接从缓存读取结果
+        
+        self.snapshotFile = ''      # 回测快照文件，设置后回放时定期保存快照，下次回测从快照恢复
+        self.snapshotDays = 0       # 保存快照的间隔天数
+        self.resumeDatetime = None  # 从快照恢复时，快照中最后一个数据的时间
+        
+        self.reuseTick = False          # tick模式下是否复用同一个tick视图对象回放
+        self.historyCacheRange = None   # 从缓存回放的数据范围(缓存对象, 开始位置, 结束位置)
+        
+        self.intrabarTickStore = None   # K线模式下K线内部的tick数据，设置后存在活动委托的K线按tick撮合
+        self.intrabarCrossing = False   # 当前是否正在基于K线内部的tick撮合
+        self.intrabarTick = None        # K线内部撮合时复用的tick视图对象
+        
         self.dataStartDate = None       # 回测数据开始日期，datetime对象
         self.dataEndDate = None         # 回测数据结束日期，datetime对象
         self.strategyStartDate = None   # 策略启动日期（即前面的数据用于初始化），datetime对象
         
         self.limitOrderCount = 0                    # 限价单编号
         self.limitOrderDict = OrderedDict()         # 限价单字典
-        self.workingLimitOrderDict = OrderedDict()  # 活动限价单字典，用于进行撮合用
+        self.workingLimitOrderDict = PriceIndexedOrderDict(True)    # 活动限价单字典，用于进行撮合用
         
         self.tradeCount = 0             # 成交编号
         self.tradeDict = OrderedDict()  # 成交字典
@@ -151,6 +196,55 @@ class BacktestingEngine(object):
         self.dbName = dbName
         self.symbol = symbol
     
+    #----------------------------------------------------------------------
+    def setHistoryCache(self, path):
+        """设置历史数据缓存目录（由createHistoryCache生成）"""
+        self.historyCachePath = path
+    
+    #----------------------------------------------------------------------
+    def setResultCache(self, path='', maxSize=10000):
+        """设置回测结果缓存，path为缓存目录（为空则使用默认目录），maxSize为最多缓存的结果数量"""
+        self.resultCache = BacktestResultCache(path, maxSize)
+        
+    #----------------------------------------------------------------------
+    def setReuseTick(self, reuseTick=True):
+        """
+        设置tick模式下复用同一个tick视图对象回放，不为每个tick创建新的对象
+        策略如果需要保存历史tick，必须调用tick.copy()
+        """
+        self.reuseTick = reuseTick
+        
+    #----------------------------------------------------------------------
+    def setIntrabarTick(self, dbName='', symbol='', cachePath='', barMinutes=1,
+                        closeLabel=False, cacheSize=10000):
+        """
+        设置K线模式下使用K线内部的tick撮合委托，策略逻辑仍然基于K线运行
+        dbName, symbol：tick数据所在的数据库和集合（需要datetime索引）
+        cachePath：tick历史数据缓存目录（由tick模式的createHistoryCache生成），设置后不读取数据库
+        barMinutes：K线周期分钟数
+        closeLabel：K线时间是否为收盘时间，默认为开盘时间
+        cacheSize：最多缓存的K线数量，为0时不缓存
+        """
+        self.intrabarTickStore = IntrabarTickStore(dbName, symbol, cachePath, barMinutes,
+                                                   closeLabel, cacheSize)
+        
+    #----------------------------------------------------------------------
+    def getIntrabarSetting(self):
+        """K线内部tick数据的设置，没有设置时返回None"""
+        if self.intrabarTickStore is None:
+            return None
+        return self.intrabarTickStore.getSetting()
+        
+    #----------------------------------------------------------------------
+    def setSnapshot(self, fileName, snapshotDays=5):
+        """
+        设置回测快照
+        fileName：快照文件路径，只保存最新的快照
+        snapshotDays：回放数据时每隔多少天保存一次快照，回放结束时总会保存一次
+        """
+        self.snapshotFile = fileName
+        self.snapshotDays = snapshotDays
+        
     #----------------------------------------------------------------------
     def setCapital(self, capital):
         """设置资本金"""
@@ -183,6 +277,10 @@ class BacktestingEngine(object):
     #----------------------------------------------------------------------
     def loadHistoryData(self):
         """载入历史数据"""
+        if self.historyCachePath:
+            self.loadHistoryCache()
+            return
+        
         self.dbClient = pymongo.MongoClient(globalSetting['mongoHost'], globalSetting['mongoPort'])
         collection = self.dbClient[self.dbName][self.symbol]          
 
@@ -196,6 +294,17 @@ class BacktestingEngine(object):
             dataClass = VtTickData
             func = self.newTick
 
+        # 从快照恢复时策略已经完成初始化，只需要载入快照之后的数据
+        if self.resumeDatetime:
+            self.initData = []
+            flt = {'datetime':{'$gt':self.resumeDatetime}}
+            if self.dataEndDate:
+                flt['datetime']['$lte'] = self.dataEndDate
+            self.dbCursor = collection.find(flt).sort('datetime')
+            
+            self.output(u'载入完成，数据量：%s' %self.dbCursor.count())
+            return
+
         # 载入初始化需要用的数据
         flt = {'datetime':{'$gte':self.dataStartDate,
                            '$lt':self.strategyStartDate}}        
@@ -218,9 +327,73 @@ class BacktestingEngine(object):
         
         self.output(u'载入完成，数据量：%s' %(initCursor.count() + self.dbCursor.count()))
         
+    #----------------------------------------------------------------------
+    def loadHistoryCache(self):
+        """从历史数据缓存中载入数据"""
+        if self.mode == self.BAR_MODE:
+            dataClass = VtBarData
+        else:
+            dataClass = VtTickData
+        
+        cache = HistoryCache(self.historyCachePath)
+        
+        # 按照回测日期从缓存中截取数据，同一个缓存可以用于其中任意时间段的回测（如滚动优化的各个窗口）
+        initStart = cache.getIndex(self.dataStartDate)
+        if initStart is None:
+            initStart, start = 0, cache.initCount
+        else:
+            start = cache.getIndex(self.strategyStartDate)
+            
+            # 从快照恢复时跳过初始化数据和快照之前的数据
+            if self.resumeDatetime:
+                initStart = start = max(start, cache.getIndex(self.resumeDatetime, 'right'))
+        end = max(start, cache.getEndIndex(self.dataEndDate))
+        
+        self.initData = []
+        for d in cache.iterData(initStart, start):
+            data = dataClass()
+            data.__dict__ = d
+            self.initData.append(data)
+        
+        # 缓存的迭代器返回的数据字典和数据库指针一致，回放代码不需要修改
+        self.dbCursor = cache.iterData(start, end)
+        self.historyCacheRange = (cache, start, end)
+        
+        self.output(u'从缓存载入完成，数据量：%s' %cache.count)
+    
+    #----------------------------------------------------------------------
+    def createHistoryCache(self, path=''):
+        """从数据库读取一次历史数据并保存为缓存，返回缓存目录"""
+        if not path:
+            path = tempfile.mkdtemp(prefix='vnpyHistoryCache')
+        
+        dbClient = pymongo.MongoClient(globalSetting['mongoHost'], globalSetting['mongoPort'])
+        collection = dbClient[self.dbName][self.symbol]
+        
+        flt = {'datetime':{'$gte':self.dataStartDate,
+                           '$lt':self.strategyStartDate}}        
+        initData = list(collection.find(flt).sort('datetime'))
+        
+        if not self.dataEndDate:
+            flt = {'datetime':{'$gte':self.strategyStartDate}}
+        else:
+            flt = {'datetime':{'$gte':self.strategyStartDate,
+                               '$lte':self.dataEndDate}}  
+        backtestData = list(collection.find(flt).sort('datetime'))
+        
+        saveHistoryCache(path, initData, backtestData)
+        self.output(u'历史数据缓存生成完成，数据量：%s' %(len(initData) + len(backtestData)))
+        
+        return path
+    
     #----------------------------------------------------------------------
     def runBacktesting(self):
         """运行回测"""
+        # 设置了快照时，先尝试从快照恢复
+        self.resumeDatetime = None
+        if self.snapshotFile:
+            self.resumeFromSnapshot()
+        
         # 载入历史数据
         self.loadHistoryData()
         
@@ -234,31 +407,210 @@ class BacktestingEngine(object):
 
         self.output(u'开始回测')
         
-        self.strategy.inited = True
-        self.strategy.onInit()
-        self.output(u'策略初始化完成')
-        
-        self.strategy.trading = True
-        self.strategy.onStart()
-        self.output(u'策略启动完成')
+        if self.resumeDatetime:
+            self.output(u'从快照恢复，跳过策略初始化')
+        else:
+            self.strategy.inited = True
+            self.strategy.onInit()
+            self.output(u'策略初始化完成')
+            
+            self.strategy.trading = True
+            self.strategy.onStart()
+            self.output(u'策略启动完成')
         
         self.output(u'开始回放数据')
 
+        if self.snapshotFile:
+            self.replayWithSnapshot(dataClass, func)
+        elif self.reuseTick and self.mode == self.TICK_MODE:
+            self.replayTickView()
+        else:
+            for d in self.dbCursor:
+                data = dataClass()
+                data.__dict__ = d
+                func(data)     
+            
+        self.output(u'数据回放结束')
+        
+    #----------------------------------------------------------------------
+    def replayTickView(self):
+        """复用同一个tick视图对象回放数据（快照中不能保存视图对象，因此设置了快照时不使用）"""
+        func = self.newTick
+        
+        if self.historyCachePath:
+            # 从缓存回放时不生成数据字典，视图直接读取行元组
+            cache, start, end = self.historyCacheRange
+            tick = createTickViewClass(cache.fieldList)()
+            for row in cache.iterRows(start, end):
+                tick._row = row
+                func(tick)
+        else:
+            tick = DictTickView()
+            for d in self.dbCursor:
+                tick.__dict__ = d
+                func(tick)
+        
+    #----------------------------------------------------------------------
+    def replayWithSnapshot(self, dataClass, func):
+        """回放数据，每隔snapshotDays天在新一天的第一个数据之前保存快照，结束时再保存一次"""
+        snapshotDate = None
+        lastDate = None
+        
         for d in self.dbCursor:
             data = dataClass()
             data.__dict__ = d
-            func(data)     
             
+            date = data.datetime.date()
+            if date != lastDate:
+                if snapshotDate is None:
+                    snapshotDate = date
+                elif (date - snapshotDate).days >= self.snapshotDays:
+                    self.takeSnapshot()
+                    snapshotDate = date
+                lastDate = date
+            
+            func(data)
+        
+        self.takeSnapshot()
+        
+    #----------------------------------------------------------------------
+    def getSnapshotKey(self):
+        """快照的匹配条件，策略参数和回测设置都相同时才能从快照恢复"""
+        strategy = self.strategy
+        param = dict([(name, getattr(strategy, name, None)) for name in strategy.paramList])
+        
+        key = {'className': strategy.className,
+               'param': param,
+               'mode': self.mode,
+               'startDate': self.startDate,
+               'initDays': self.initDays,
+               'dbName': self.dbName,
+               'symbol': self.symbol,
+               'slippage': self.slippage,
+               'rate': self.rate,
+               'size': self.size,
+               'priceTick': self.priceTick}
+        
+        # 使用K线内部tick撮合时结果不同
+        if self.intrabarTickStore is not None:
+            key['intrabarTick'] = self.getIntrabarSetting()
+        return key
+        
+    #----------------------------------------------------------------------
+    def takeSnapshot(self):
+        """保存当前的回测状态到快照文件"""
+        state = dict([(name, getattr(self, name)) for name in self.snapshotFieldList])
+        state['key'] = self.getSnapshotKey()
+        state['strategy'] = self.strategy
+        
+        # 策略对回测引擎的引用不保存，恢复时重新关联
+        self.strategy.ctaEngine = None
+        try:
+            size = saveSnapshot(self.snapshotFile, state)
+        finally:
+            self.strategy.ctaEngine = self
+        
+        self.output(u'快照保存完成，时间：%s，大小：%s字节' %(self.dt, size))
+        
+    #----------------------------------------------------------------------
+    def resumeFromSnapshot(self):
+        """从快照文件恢复回测状态，返回是否成功"""
+        state = loadSnapshot(self.snapshotFile)
+        if state is None:
+            return False
+        
+        if state['key'] != self.getSnapshotKey():
+            self.output(u'快照和当前的回测设置不一致，重新回测')
+            return False
+        
+        # 快照晚于回测结束日期时无法使用
+        dt = state['dt']
+        if dt is None or (self.dataEndDate and dt > self.dataEndDate):
+            self.output(u'快照时间晚于回测结束日期，重新回测')
+            return False
+        
+        for name in self.snapshotFieldList:
+            setattr(self, name, state[name])
+        
+        self.strategy = state['strategy']
+        self.strategy.ctaEngine = self
+        
+        self.resumeDatetime = dt
+        self.output(u'从快照恢复，快照时间：%s' %dt)
+        return True
+        
+    #----------------------------------------------------------------------
+    def createSubEngine(self):
+        """创建回测设置相同的子引擎，用于多实例回测"""
+        engine = BacktestingEngine()
+        engine.setBacktestingMode(self.mode)
+        engine.setStartDate(self.startDate, self.initDays)
+        engine.setEndDate(self.endDate)
+        engine.setCapital(self.capital)
+        engine.setSlippage(self.slippage)
+        engine.setRate(self.rate)
+        engine.setSize(self.size)
+        engine.setPriceTick(self.priceTick)
+        engine.setDatabase(self.dbName, self.symbol)
+        engine.intrabarTickStore = self.intrabarTickStore   # 子引擎共享K线内部tick的缓存
+        engine.output = self.output
+        return engine
+    
+    #----------------------------------------------------------------------
+    def runBatchBacktesting(self, strategyClass, settingList):
+        """
+        多实例回测：只回放一次数据，同时推送给多个不同参数的策略实例
+        每个策略实例使用独立的子引擎（委托、停止单、成交相互独立），返回子引擎列表
+        注意：同一个数据对象会推送给所有策略，策略中不能修改收到的数据
+        """
+        # 载入历史数据
+        self.loadHistoryData()
+        
+        if self.mode == self.BAR_MODE:
+            dataClass = VtBarData
+        else:
+            dataClass = VtTickData
+        
+        engineList = []
+        for setting in settingList:
+            engine = self.createSubEngine()
+            engine.initData = self.initData
+            engine.initStrategy(strategyClass, setting)
+            engineList.append(engine)
+        
+        self.output(u'开始多实例回测，策略实例数量：%s' %len(engineList))
+        
+        for engine in engineList:
+            engine.strategy.inited = True
+            engine.strategy.onInit()
+            engine.strategy.trading = True
+            engine.strategy.onStart()
+        
+        # 数据只解析一次
+        if self.mode == self.BAR_MODE:
+            funcList = [engine.newBar for engine in engineList]
+        else:
+            funcList = [engine.newTick for engine in engineList]
+        
+        for d in self.dbCursor:
+            data = dataClass()
+            data.__dict__ = d
+            for func in funcList:
+                func(data)
+        
         self.output(u'数据回放结束')
         
+        return engineList
+        
     #----------------------------------------------------------------------
     def newBar(self, bar):
         """新的K线"""
         self.bar = bar
         self.dt = bar.datetime
         
-        self.crossLimitOrder()      # 先撮合限价单
-        self.crossStopOrder()       # 再撮合停止单
+        if not self.crossIntrabarTick(bar):
+            self.crossLimitOrder()      # 先撮合限价单
+            self.crossStopOrder()       # 再撮合停止单
         self.strategy.onBar(bar)    # 推送K线到策略中
         
         self.updateDailyClose(bar.datetime, bar.close)
@@ -275,6 +627,48 @@ class BacktestingEngine(object):
         
         self.updateDailyClose(tick.datetime, tick.lastPrice)
         
+    #----------------------------------------------------------------------
+    def crossIntrabarTick(self, bar):
+        """
+        基于K线内部的tick撮合委托，返回是否完成撮合
+        没有设置K线内部tick数据、没有活动委托或者K线内没有tick时返回False，由K线撮合
+        """
+        if self.intrabarTickStore is None:
+            return False
+        
+        # 大部分K线上没有活动委托，不需要读取tick
+        if not self.workingLimitOrderDict and not self.workingStopOrderDict:
+            return False
+        
+        rowList = self.intrabarTickStore.getTickRows(bar.datetime)
+        if not rowList:
+            return False
+        
+        if self.intrabarTick is None:
+            self.intrabarTick = self.intrabarTickStore.createTickView()
+        tick = self.intrabarTick
+        
+        self.tick = tick
+        self.intrabarCrossing = True
+        try:
+            for row in rowList:
+                tick._row = row
+                self.dt = tick.datetime
+                
+                self.crossLimitOrder()
+                self.crossStopOrder()
+                
+                # 委托全部成交或撤销后，K线内剩余的tick不需要处理
+                if not self.workingLimitOrderDict and not self.workingStopOrderDict:
+                    break
+        finally:
+            # 复用的tick视图对象不能保存到快照中
+            self.intrabarCrossing = False
+            self.tick = None
+            self.dt = bar.datetime
+        
+        return True
+        
     #----------------------------------------------------------------------
     def initStrategy(self, strategyClass, setting=None):
         """
@@ -287,8 +681,13 @@ class BacktestingEngine(object):
     #----------------------------------------------------------------------
     def crossLimitOrder(self):
         """基于最新数据撮合限价单"""
+        # 没有活动限价单时不需要撮合（插入后在撮合前已经撤销的委托也不需要推送）
+        if not self.workingLimitOrderDict:
+            self.workingLimitOrderDict.popAddedKeys()
+            return
+        
         # 先确定会撮合成交的价格
-        if self.mode == self.BAR_MODE:
+        if self.mode == self.BAR_MODE and not self.intrabarCrossing:
             buyCrossPrice = self.bar.low        # 若买入方向限价单价格高于该价格，则会成交
             sellCrossPrice = self.bar.high      # 若卖出方向限价单价格低于该价格，则会成交
             buyBestCrossPrice = self.bar.open   # 在当前时间点前发出的买入委托可能的最优成交价
@@ -299,8 +698,15 @@ class BacktestingEngine(object):
             buyBestCrossPrice = self.tick.askPrice1
             sellBestCrossPrice = self.tick.bidPrice1
         
-        # 遍历限价单字典中的所有限价单
-        for orderID, order in self.workingLimitOrderDict.items():
+        # 只需要处理新的限价单（推送未成交状态）和价格满足成交条件的限价单，
+        # 按照发单顺序处理，和遍历全部限价单的结果一致
+        keyList = self.workingLimitOrderDict.popAddedKeys()
+        if buyCrossPrice > 0:
+            keyList.extend(self.workingLimitOrderDict.getKeysByPrice(DIRECTION_LONG, low=buyCrossPrice))
+        if sellCrossPrice > 0:
+            keyList.extend(self.workingLimitOrderDict.getKeysByPrice(DIRECTION_SHORT, high=sellCrossPrice))
+        
+        for orderID, order in self.workingLimitOrderDict.getSortedItems(keyList):
             # 推送委托进入队列（未成交）的状态更新
             if not order.status:
                 order.status = STATUS_NOTTRADED
@@ -358,8 +764,11 @@ class BacktestingEngine(object):
     #----------------------------------------------------------------------
     def crossStopOrder(self):
         """基于最新数据撮合停止单"""
+        if not self.workingStopOrderDict:
+            return
+        
         # 先确定会撮合成交的价格，这里和限价单规则相反
-        if self.mode == self.BAR_MODE:
+        if self.mode == self.BAR_MODE and not self.intrabarCrossing:
             buyCrossPrice = self.bar.high    # 若买入方向停止单价格低于该价格，则会成交
             sellCrossPrice = self.bar.low    # 若卖出方向限价单价格高于该价格，则会成交
             bestCrossPrice = self.bar.open   # 最优成交价，买入停止单不能低于，卖出停止单不能高于
@@ -368,8 +777,11 @@ class BacktestingEngine(object):
             sellCrossPrice = self.tick.lastPrice
             bestCrossPrice = self.tick.lastPrice
         
-        # 遍历停止单字典中的所有停止单
-        for stopOrderID, so in self.workingStopOrderDict.items():
+        # 只处理价格满足触发条件的停止单，按照发单顺序处理
+        keyList = self.workingStopOrderDict.getKeysByPrice(DIRECTION_LONG, high=buyCrossPrice)
+        keyList.extend(self.workingStopOrderDict.getKeysByPrice(DIRECTION_SHORT, low=sellCrossPrice))
+        
+        for stopOrderID, so in self.workingStopOrderDict.getSortedItems(keyList):
             # 判断是否会成交
             buyCross = so.direction==DIRECTION_LONG and so.price<=buyCrossPrice
             sellCross = so.direction==DIRECTION_SHORT and so.price>=sellCrossPrice
@@ -554,177 +966,88 @@ class BacktestingEngine(object):
     #------------------------------------------------      
     
     #----------------------------------------------------------------------
-    def calculateBacktestingResult(self):
+    def calculateBacktestingResult(self, metricsOnly=False):
         """
         计算回测结果
+        metricsOnly：只计算统计指标，不生成绘图用的时间序列（用于参数优化）
         """
         self.output(u'计算回测结果')
         
-        # 首先基于回测后的成交记录，计算每笔交易的盈亏
-        resultList = []             # 交易结果列表
+        # 首先基于回测后的成交记录，按照先开先平的规则对开平仓交易配对，计算每笔交易的盈亏
+        tradeList = self.tradeDict.values()
         
-        longTrade = []              # 未平仓的多头交易
-        shortTrade = []             # 未平仓的空头交易
+        # 检查是否有交易
+        if not tradeList:
+            self.output(u'无交易结果')
+            return {}
         
-        tradeTimeList = []          # 每笔成交时间戳
-        posList = [0]               # 每笔成交后的持仓情况        
-
-        for trade in self.tradeDict.values():
-            # 复制成交对象，因为下面的开平仓交易配对涉及到对成交数量的修改
-            # 若不进行复制直接操作，则计算完后所有成交的数量会变成0
-            trade = copy.copy(trade)
-            
-            # 多头交易
-            if trade.direction == DIRECTION_LONG:
-                # 如果尚无空头交易
-                if not shortTrade:
-                    longTrade.append(trade)
-                # 当前多头交易为平空
-                else:
-                    while True:
-                        entryTrade = shortTrade[0]
-                        exitTrade = trade
-                        
-                        # 清算开平仓交易
-                        closedVolume = min(exitTrade.volume, entryTrade.volume)
-                        result = TradingResult(entryTrade.price, entryTrade.dt, 
-                                               exitTrade.price, exitTrade.dt,
-                                               -closedVolume, self.rate, self.slippage, self.size)
-                        resultList.append(result)
-                        
-                        posList.extend([-1,0])
-                        tradeTimeList.extend([result.entryDt, result.exitDt])
-                        
-                        # 计算未清算部分
-                        entryTrade.volume -= closedVolume
-                        exitTrade.volume -= closedVolume
-                        
-                        # 如果开仓交易已经全部清算，则从列表中移除
-                        if not entryTrade.volume:
-                            shortTrade.pop(0)
-                        
-                        # 如果平仓交易已经全部清算，则退出循环
-                        if not exitTrade.volume:
-                            break
-                        
-                        # 如果平仓交易未全部清算，
-                        if exitTrade.volume:
-                            # 且开仓交易已经全部清算完，则平仓交易剩余的部分
-                            # 等于新的反向开仓交易，添加到队列中
-                            if not shortTrade:
-                                longTrade.append(exitTrade)
-                                break
-                            # 如果开仓交易还有剩余，则进入下一轮循环
-                            else:
-                                pass
-                        
-            # 空头交易        
-            else:
-                # 如果尚无多头交易
-                if not longTrade:
-                    shortTrade.append(trade)
-                # 当前空头交易为平多
-                else:                    
-                    while True:
-                        entryTrade = longTrade[0]
-                        exitTrade = trade
-                        
-                        # 清算开平仓交易
-                        closedVolume = min(exitTrade.volume, entryTrade.volume)
-                        result = TradingResult(entryTrade.price, entryTrade.dt, 
-                                               exitTrade.price, exitTrade.dt,
-                                               closedVolume, self.rate, self.slippage, self.size)
-                        resultList.append(result)
-                        
-                        posList.extend([1,0])
-                        tradeTimeList.extend([result.entryDt, result.exitDt])
-
-                        # 计算未清算部分
-                        entryTrade.volume -= closedVolume
-                        exitTrade.volume -= closedVolume
-                        
-                        # 如果开仓交易已经全部清算，则从列表中移除
-                        if not entryTrade.volume:
-                            longTrade.pop(0)
-                        
-                        # 如果平仓交易已经全部清算，则退出循环
-                        if not exitTrade.volume:
-                            break
-                        
-                        # 如果平仓交易未全部清算，
-                        if exitTrade.volume:
-                            # 且开仓交易已经全部清算完，则平仓交易剩余的部分
-                            # 等于新的反向开仓交易，添加到队列中
-                            if not longTrade:
-                                shortTrade.append(exitTrade)
-                                break
-                            # 如果开仓交易还有剩余，则进入下一轮循环
-                            else:
-                                pass                    
+        priceArray = np.array([trade.price for trade in tradeList], dtype=np.float64)
+        volumeArray = np.array([trade.volume for trade in tradeList], dtype=np.float64)
+        longArray = np.array([trade.direction == DIRECTION_LONG for trade in tradeList])
+        dtArray = np.empty(len(tradeList), dtype=object)
+        dtArray[:] = [trade.dt for trade in tradeList]
+        
+        # 每笔成交前的持仓，以及成交中平仓和开仓的数量（反手成交的剩余部分为反向开仓）
+        posArray = np.cumsum(np.where(longArray, volumeArray, -volumeArray))
+        prePosArray = np.concatenate([[0], posArray[:-1]])
+        
+        closeArray = np.where(longArray,
+                              np.minimum(volumeArray, np.maximum(-prePosArray, 0)),
+                              np.minimum(volumeArray, np.maximum(prePosArray, 0)))
+        openArray = volumeArray - closeArray
+        
+        # 多头持仓由多头成交开仓、空头成交平仓，空头持仓相反
+        longEntry, longExit, longVolume, longLeft, longLeftVolume = matchTrades(
+            np.where(longArray, openArray, 0), np.where(longArray, 0, closeArray))
+        shortEntry, shortExit, shortVolume, shortLeft, shortLeftVolume = matchTrades(
+            np.where(longArray, 0, openArray), np.where(longArray, closeArray, 0))
+        
+        # 已平仓的交易按照平仓成交的顺序排列，同一笔平仓成交按照开仓成交的顺序排列
+        entryIndex = np.concatenate([longEntry, shortEntry])
+        exitIndex = np.concatenate([longExit, shortExit])
+        closedVolume = np.concatenate([longVolume, -shortVolume])
+        
+        order = np.lexsort((entryIndex, exitIndex))
+        entryIndex = entryIndex[order]
+        exitIndex = exitIndex[order]
+        closedVolume = closedVolume[order]
+        closedCount = len(closedVolume)
         
         # 到最后交易日尚未平仓的交易，则以最后价格平仓
         if self.mode == self.BAR_MODE:
             endPrice = self.bar.close
         else:
             endPrice = self.tick.lastPrice
-            
-        for trade in longTrade:
-            result = TradingResult(trade.price, trade.dt, endPrice, self.dt, 
-                                   trade.volume, self.rate, self.slippage, self.size)
-            resultList.append(result)
-            
-        for trade in shortTrade:
-            result = TradingResult(trade.price, trade.dt, endPrice, self.dt, 
-                                   -trade.volume, self.rate, self.slippage, self.size)
-            resultList.append(result)            
         
-        # 检查是否有交易
-        if not resultList:
-            self.output(u'无交易结果')
-            return {}
+        leftIndex = np.concatenate([longLeft, shortLeft])
+        leftVolume = np.concatenate([longLeftVolume, -shortLeftVolume])
         
-        # 然后基于每笔交易的结果，我们可以计算具体的盈亏曲线和最大回撤等        
-        capital = 0             # 资金
-        maxCapital = 0          # 资金最高净值
-        drawdown = 0            # 回撤
+        entryPrice = np.concatenate([priceArray[entryIndex], priceArray[leftIndex]])
+        exitPrice = np.concatenate([priceArray[exitIndex], np.full(len(leftIndex), endPrice, dtype=np.float64)])
+        resultVolume = np.concatenate([closedVolume, leftVolume])
         
-        totalResult = 0         # 总成交数量
-        totalTurnover = 0       # 总成交金额（合约面值）
-        totalCommission = 0     # 总手续费
-        totalSlippage = 0       # 总滑点
+        # 每笔交易的结果，计算方法和TradingResult一致
+        turnover = (entryPrice + exitPrice) * self.size * np.abs(resultVolume)
+        commission = turnover * self.rate
+        slippage = self.slippage * 2 * self.size * np.abs(resultVolume)
+        pnl = (exitPrice - entryPrice) * resultVolume * self.size - commission - slippage
         
-        timeList = []           # 时间序列
-        pnlList = []            # 每笔盈亏序列
-        capitalList = []        # 盈亏汇总的时间序列
-        drawdownList = []       # 回撤的时间序列
+        # 然后基于每笔交易的结果，我们可以计算具体的盈亏曲线和最大回撤等
+        capitalArray = np.cumsum(pnl)                                           # 盈亏汇总的序列
+        maxCapitalArray = np.maximum.accumulate(np.maximum(capitalArray, 0))    # 资金最高净值的序列
+        drawdownArray = capitalArray - maxCapitalArray                          # 回撤的序列
         
-        winningResult = 0       # 盈利次数
-        losingResult = 0        # 亏损次数		
-        totalWinning = 0        # 总盈利金额		
-        totalLosing = 0         # 总亏损金额        
+        totalResult = len(pnl)                      # 总成交数量
+        totalTurnover = sumInOrder(turnover)        # 总成交金额（合约面值）
+        totalCommission = sumInOrder(commission)    # 总手续费
+        totalSlippage = sumInOrder(slippage)        # 总滑点
+        
+        winningMask = pnl >= 0
+        winningResult = int(winningMask.sum())     # 盈利次数
+        losingResult = totalResult - winningResult  # 亏损次数
+        totalWinning = sumInOrder(pnl[winningMask])     # 总盈利金额
+        totalLosing = sumInOrder(pnl[~winningMask])     # 总亏损金额
         
-        for result in resultList:
-            capital += result.pnl
-            maxCapital = max(capital, maxCapital)
-            drawdown = capital - maxCapital
-            
-            pnlList.append(result.pnl)
-            timeList.append(result.exitDt)      # 交易的时间戳使用平仓时间
-            capitalList.append(capital)
-            drawdownList.append(drawdown)
-            
-            totalResult += 1
-            totalTurnover += result.turnover
-            totalCommission += result.commission
-            totalSlippage += result.slippage
-            
-            if result.pnl >= 0:
-                winningResult += 1
-                totalWinning += result.pnl
-            else:
-                losingResult += 1
-                totalLosing += result.pnl
-                
         # 计算盈亏相关数据
         winningRate = winningResult/totalResult*100         # 胜率
         
@@ -741,23 +1064,38 @@ class BacktestingEngine(object):
 
         # 返回回测结果
         d = {}
-        d['capital'] = capital
-        d['maxCapital'] = maxCapital
-        d['drawdown'] = drawdown
+        d['capital'] = float(capitalArray[-1])
+        d['maxCapital'] = float(maxCapitalArray[-1])
+        d['drawdown'] = float(drawdownArray[-1])
         d['totalResult'] = totalResult
         d['totalTurnover'] = totalTurnover
         d['totalCommission'] = totalCommission
         d['totalSlippage'] = totalSlippage
-        d['timeList'] = timeList
-        d['pnlList'] = pnlList
-        d['capitalList'] = capitalList
-        d['drawdownList'] = drawdownList
         d['winningRate'] = winningRate
         d['averageWinning'] = averageWinning
         d['averageLosing'] = averageLosing
         d['profitLossRatio'] = profitLossRatio
-        d['posList'] = posList
-        d['tradeTimeList'] = tradeTimeList
+        
+        if metricsOnly:
+            return d
+        
+        # 绘图用的时间序列，交易的时间戳使用平仓时间
+        exitDt = np.concatenate([dtArray[exitIndex], np.array([self.dt] * len(leftIndex), dtype=object)])
+        d['timeList'] = exitDt.tolist()
+        d['pnlList'] = pnl.tolist()
+        d['capitalList'] = capitalArray.tolist()
+        d['drawdownList'] = drawdownArray.tolist()
+        
+        # 每笔已平仓交易的开平仓时间戳，以及对应的持仓情况
+        tradeTimeArray = np.empty(closedCount * 2, dtype=object)
+        tradeTimeArray[0::2] = dtArray[entryIndex]
+        tradeTimeArray[1::2] = dtArray[exitIndex]
+        
+        closedPosArray = np.zeros(closedCount * 2 + 1, dtype=np.int64)
+        closedPosArray[1::2] = np.sign(closedVolume)
+        
+        d['posList'] = closedPosArray.tolist()
+        d['tradeTimeList'] = tradeTimeArray.tolist()
         
         return d
         
@@ -845,17 +1183,30 @@ class BacktestingEngine(object):
         # 遍历优化
         resultList = []
         for setting in settingList:
-            self.clearBacktestingResult()
             self.output('-' * 30)
             self.output('setting: %s' %str(setting))
+            
+            # 先从回测结果缓存中读取
+            key = None
+            if self.resultCache:
+                key = self.resultCache.getKey(self, strategyClass, setting)
+                targetValue = self.resultCache.getTarget(key, targetName)
+                if targetValue is not None:
+                    resultList.append(([str(setting)], targetValue))
+                    continue
+            
+            self.clearBacktestingResult()
             self.initStrategy(strategyClass, setting)
             self.runBacktesting()
-            d = self.calculateBacktestingResult()
+            d = self.calculateBacktestingResult(metricsOnly=True)
             try:
                 targetValue = d[targetName]
             except KeyError:
                 targetValue = 0
             resultList.append(([str(setting)], targetValue))
+            
+            if self.resultCache:
+                self.resultCache.put(key, d)
         
         # 显示结果
         resultList.sort(reverse=True, key=lambda result:result[1])
@@ -866,8 +1217,27 @@ class BacktestingEngine(object):
         return result
             
     #----------------------------------------------------------------------
-    def runParallelOptimization(self, strategyClass, optimizationSetting):
-        """并行优化参数"""
+    def runParallelOptimization(self, strategyClass, optimizationSetting, resultFile='', batchSize=1):
+        """并行优化参数，参数说明见calculateParallelOptimization，返回按优化目标排序的(参数字符串, 目标值)列表"""
+        resultDict = self.calculateParallelOptimization(strategyClass, optimizationSetting, resultFile, batchSize)
+        
+        # 显示结果
+        resultList = resultDict.values()
+        resultList.sort(reverse=True, key=lambda result:result[1])
+        self.output('-' * 30)
+        self.output(u'优化结果：')
+        for result in resultList:
+            self.output(u'%s: %s' %(result[0], result[1]))    
+        return resultList
+    
+    #----------------------------------------------------------------------
+    def calculateParallelOptimization(self, strategyClass, optimizationSetting, resultFile='', batchSize=1):
+        """
+        并行优化参数，返回字典，key为参数组合的getSettingKey，value为(参数字符串, 目标值)
+        resultFile：结果文件路径，第一行为回测设置，之后每完成一组参数就写入一行结果；
+                    回测设置相同时文件中已有的参数组合不会重复回测，用于恢复中断的优化
+        batchSize：每个进程任务中通过多实例回测同时运行的参数数量，大于1时数据解析和回放循环由多组参数共享
+        """
         # 获取优化设置        
         settingList = optimizationSetting.generateSetting()
         targetName = optimizationSetting.optimizeTarget
@@ -876,26 +1246,268 @@ class BacktestingEngine(object):
         if not settingList or not targetName:
             self.output(u'优化设置有问题，请检查')
         
-        # 多进程优化，启动一个对应CPU核心数量的进程池
-        pool = multiprocessing.Pool(multiprocessing.cpu_count())
-        l = []
-
-        for setting in settingList:
-            l.append(pool.apply_async(optimize, (strategyClass, setting,
-                                                 targetName, self.mode, 
-                                                 self.startDate, self.initDays, self.endDate,
-                                                 self.slippage, self.rate, self.size, self.priceTick,
-                                                 self.dbName, self.symbol)))
-        pool.close()
-        pool.join()
+        # 读取已经完成的结果，过滤掉对应的参数组合
+        header = self.getOptimizationHeader(strategyClass, targetName)
+        resultDict = self.loadOptimizationResult(resultFile, header)
+        taskSettingList = [setting for setting in settingList
+                           if getSettingKey(setting) not in resultDict]
+        if resultDict:
+            self.output(u'已完成参数组合：%s，剩余：%s' %(len(settingList)-len(taskSettingList), 
+                                                   len(taskSettingList)))
+        
+        # 从回测结果缓存中读取回测过的参数组合
+        cacheKeyDict = {}
+        if self.resultCache:
+            missList = []
+            for setting in taskSettingList:
+                key = getSettingKey(setting)
+                cacheKey = self.resultCache.getKey(self, strategyClass, setting)
+                targetValue = self.resultCache.getTarget(cacheKey, targetName)
+                if targetValue is None:
+                    cacheKeyDict[key] = cacheKey
+                    missList.append(setting)
+                else:
+                    resultDict[key] = (str(setting), targetValue)
+            
+            self.output(u'回测结果缓存命中：%s，需要回测：%s' %(len(taskSettingList)-len(missList), len(missList)))
+            taskSettingList = missList
+        
+        if taskSettingList:
+            # 历史数据只从数据库读取一次，各个进程通过内存映射共享
+            historyCachePath = self.historyCachePath
+            if not historyCachePath:
+                historyCachePath = self.createHistoryCache()
+            
+            # 多进程优化，启动一个对应CPU核心数量的进程池
+            processes = multiprocessing.cpu_count()
+            pool = multiprocessing.Pool(processes)
+            
+            if batchSize > 1:
+                # 多组参数打包为一个任务，任务返回结果列表
+                batchList = [taskSettingList[i:i+batchSize] for i in range(0, len(taskSettingList), batchSize)]
+                batchTaskList = [self.createOptimizationTask(strategyClass, batch, targetName, historyCachePath)
+                                 for batch in batchList]
+                resultIterator = (result for resultList in pool.imap_unordered(optimizeBatchTask, batchTaskList)
+                                  for result in resultList)
+            else:
+                taskList = [self.createOptimizationTask(strategyClass, setting, targetName, historyCachePath)
+                            for setting in taskSettingList]
+                
+                # 每个进程大约分到4块任务，兼顾调度开销和负载均衡
+                chunksize = max(1, len(taskList) // (processes * 4))
+                resultIterator = pool.imap_unordered(optimizeTask, taskList, chunksize)
+            
+            f = None
+            if resultFile:
+                f = self.openOptimizationResult(resultFile, header)
+            
+            completed = False
+            try:
+                startTime = datetime.now()
+                count = 0
+                
+                for setting, (settingStr, targetValue) in resultIterator:
+                    key = getSettingKey(setting)
+                    resultDict[key] = (settingStr, targetValue)
+                    
+                    if self.resultCache:
+                        self.resultCache.put(cacheKeyDict.get(key), {targetName: targetValue})
+                    
+                    # 每完成一组参数立即写入结果文件
+                    if f:
+                        f.write(json.dumps({'key': key, 'setting': settingStr, 'target': targetValue}) + '\n')
+                        f.flush()
+                    
+                    # 输出进度和预计剩余时间
+                    count += 1
+                    costTime = (datetime.now() - startTime).total_seconds()
+                    leftTime = costTime / count * (len(taskSettingList) - count)
+                    self.output(u'优化进度：%s/%s，%s: %s，预计剩余时间：%d秒' %(count, len(taskSettingList),
+                                                                     settingStr, targetValue, leftTime))
+                completed = True
+            finally:
+                if f:
+                    f.close()
+                
+                # 中断或出错时立即结束子进程，已完成的结果保存在结果文件中
+                if completed:
+                    pool.close()
+                else:
+                    pool.terminate()
+                pool.join()
+                
+                # 删除本次优化生成的临时缓存
+                if historyCachePath != self.historyCachePath:
+                    shutil.rmtree(historyCachePath, ignore_errors=True)
+        
+        return resultDict
+    
+    #----------------------------------------------------------------------
+    def createOptimizationTask(self, strategyClass, setting, targetName, historyCachePath, endDate=None):
+        """生成多进程优化函数optimize的参数"""
+        if endDate is None:
+            endDate = self.endDate
+        
+        # 缓存大小不影响回测结果，不在getIntrabarSetting中，单独传给优化进程
+        intrabarSetting = self.getIntrabarSetting()
+        if intrabarSetting:
+            intrabarSetting['cacheSize'] = self.intrabarTickStore.cacheSize
+        
+        return (strategyClass, setting,
+                targetName, self.mode, 
+                self.startDate, self.initDays, endDate,
+                self.slippage, self.rate, self.size, self.priceTick,
+                self.dbName, self.symbol, historyCachePath,
+                intrabarSetting)
+    
+    #----------------------------------------------------------------------
+    def runSearchOptimization(self, strategyClass, optimizationSetting, searchAlgorithm):
+        """
+        使用启发式搜索算法并行优化参数
+        searchAlgorithm：RandomSearch、GeneticSearch、HalvingSearch等提供search方法的搜索算法对象
+        """
+        targetName = optimizationSetting.optimizeTarget
+        if not optimizationSetting.paramDict or not targetName:
+            self.output(u'优化设置有问题，请检查')
+            return []
+        
+        historyCachePath = self.historyCachePath
+        if not historyCachePath:
+            historyCachePath = self.createHistoryCache()
+        
+        # 回测数据的时间范围，用于按比例截取较短的数据
+        lastDatetime = self.dataEndDate or HistoryCache(historyCachePath).getLastDatetime()
+        
+        processes = multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(processes)
+        self.searchCount = 0
+        
+        #----------------------------------------------------------------------
+        def evaluate(settingList, fraction=1.0):
+            """在进程池中回测参数组合，fraction为使用的回测数据比例"""
+            endDate = None
+            if fraction < 1 and lastDatetime:
+                seconds = (lastDatetime - self.strategyStartDate).total_seconds() * fraction
+                endDate = (self.strategyStartDate + timedelta(seconds=seconds)).strftime('%Y%m%d')
+            
+            # 先从回测结果缓存中读取
+            resultList = []
+            cacheKeyDict = {}
+            taskSettingList = settingList
+            if self.resultCache:
+                taskSettingList = []
+                for setting in settingList:
+                    cacheKey = self.resultCache.getKey(self, strategyClass, setting, endDate)
+                    targetValue = self.resultCache.getTarget(cacheKey, targetName)
+                    if targetValue is None:
+                        cacheKeyDict[getSettingKey(setting)] = cacheKey
+                        taskSettingList.append(setting)
+                    else:
+                        resultList.append((setting, targetValue))
+            
+            taskList = [self.createOptimizationTask(strategyClass, setting, targetName, historyCachePath, endDate)
+                        for setting in taskSettingList]
+            chunksize = max(1, len(taskList) // (processes * 4))
+            
+            for setting, (settingStr, targetValue) in pool.imap_unordered(optimizeTask, taskList, chunksize):
+                resultList.append((setting, targetValue))
+                if self.resultCache:
+                    self.resultCache.put(cacheKeyDict.get(getSettingKey(setting)), {targetName: targetValue})
+            
+            self.searchCount += len(taskList)
+            self.output(u'完成回测：%s组，数据比例：%.2f，累计回测：%s组' %(len(taskList), fraction, self.searchCount))
+            return resultList
+        
+        completed = False
+        try:
+            resultList = searchAlgorithm.search(optimizationSetting, evaluate)
+            completed = True
+        finally:
+            if completed:
+                pool.close()
+            else:
+                pool.terminate()
+            pool.join()
+            
+            if historyCachePath != self.historyCachePath:
+                shutil.rmtree(historyCachePath, ignore_errors=True)
         
         # 显示结果
-        resultList = [res.get() for res in l]
+        resultList = [(str(setting), targetValue) for setting, targetValue in resultList]
         resultList.sort(reverse=True, key=lambda result:result[1])
         self.output('-' * 30)
-        self.output(u'优化结果：')
+        self.output(u'优化结果（回测%s组，全部参数组合%s组）：' %(self.searchCount, optimizationSetting.getGridSize()))
         for result in resultList:
-            self.output(u'%s: %s' %(result[0], result[1]))    
+            self.output(u'%s: %s' %(result[0], result[1]))
+        return resultList
+    
+    #----------------------------------------------------------------------
+    def getOptimizationHeader(self, strategyClass, targetName):
+        """结果文件第一行记录的回测设置，设置不同的结果文件不能用于恢复优化"""
+        return {'header': True,
+                'className': strategyClass.__name__,
+                'dbName': self.dbName,
+                'symbol': self.symbol,
+                'mode': self.mode,
+                'startDate': self.startDate,
+                'initDays': self.initDays,
+                'endDate': self.endDate,
+                'slippage': self.slippage,
+                'rate': self.rate,
+                'size': self.size,
+                'priceTick': self.priceTick,
+                'optimizeTarget': targetName}
+    
+    #----------------------------------------------------------------------
+    def loadOptimizationResult(self, resultFile, header=None):
+        """
+        读取结果文件中已经完成的优化结果，返回字典
+        header不为空时检查文件第一行的回测设置，不一致则抛出异常（避免使用其他回测的结果）
+        """
+        resultDict = OrderedDict()
+        
+        if not resultFile or not os.path.exists(resultFile) or not os.path.getsize(resultFile):
+            return resultDict
+        
+        with open(resultFile) as f:
+            for n, line in enumerate(f):
+                # 中断时最后一行可能不完整，直接忽略
+                try:
+                    d = json.loads(line)
+                except ValueError:
+                    d = None
+                
+                if n == 0:
+                    if header is not None and d != json.loads(json.dumps(header)):
+                        raise ValueError(u'结果文件%s的回测设置和本次优化不一致，无法恢复，'
+                                         u'请更换结果文件：%s' %(resultFile, d))
+                    if d and d.get('header'):
+                        continue
+                
+                if d is not None:
+                    resultDict[d['key']] = (d['setting'], d['target'])
+        
+        return resultDict
+    
+    #----------------------------------------------------------------------
+    def openOptimizationResult(self, resultFile, header):
+        """打开结果文件用于追加写入，新文件先写入回测设置"""
+        lastChar = ''
+        if os.path.exists(resultFile) and os.path.getsize(resultFile):
+            with open(resultFile, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                lastChar = f.read(1)
+        
+        f = open(resultFile, 'a')
+        
+        if not lastChar:
+            f.write(json.dumps(header) + '\n')
+        elif lastChar != '\n':
+            # 中断时写了一半的行先结束，避免新的结果写到同一行中
+            f.write('\n')
+        f.flush()
+        
+        return f
 
     #----------------------------------------------------------------------
     def updateDailyClose(self, dt, price):
@@ -942,11 +1554,22 @@ class BacktestingEngine(object):
         return resultDf
     
     #----------------------------------------------------------------------
-    def showDailyResult(self, df=None):
-        """显示按日统计的交易结果"""
-        if not df:
-            df = self.calculateDailyResult()
-
+    def calculateDailyStatistics(self, df):
+        """根据按日统计的交易结果计算统计指标，返回添加了资金曲线等数据的DataFrame和统计结果字典"""
+        # 没有按日结果时，统计结果全部为0
+        if df.empty:
+            df = df.reindex(columns=list(df.columns) + ['balance', 'return', 'highlevel', 'drawdown'])
+            
+            d = dict.fromkeys(['totalDays', 'profitDays', 'lossDays', 'maxDrawdown',
+                               'totalNetPnl', 'dailyNetPnl', 'totalCommission', 'dailyCommission',
+                               'totalSlippage', 'dailySlippage', 'totalTurnover', 'dailyTurnover',
+                               'totalTradeCount', 'dailyTradeCount', 'totalReturn', 'dailyReturn',
+                               'returnStd', 'sharpeRatio'], 0)
+            d['startDate'] = ''
+            d['endDate'] = ''
+            d['endBalance'] = self.capital
+            return df, d
+        
         df['balance'] = df['netPnl'].cumsum() + self.capital
         df['return'] = (np.log(df['balance']) - np.log(df['balance'].shift(1))).fillna(0)
         df['highlevel'] = df['balance'].rolling(min_periods=1,window=len(df),center=False).max()
@@ -987,36 +1610,72 @@ class BacktestingEngine(object):
         else:
             sharpeRatio = 0
         
+        d = {}
+        d['startDate'] = startDate
+        d['endDate'] = endDate
+        d['totalDays'] = totalDays
+        d['profitDays'] = profitDays
+        d['lossDays'] = lossDays
+        d['endBalance'] = endBalance
+        d['maxDrawdown'] = maxDrawdown
+        d['totalNetPnl'] = totalNetPnl
+        d['dailyNetPnl'] = dailyNetPnl
+        d['totalCommission'] = totalCommission
+        d['dailyCommission'] = dailyCommission
+        d['totalSlippage'] = totalSlippage
+        d['dailySlippage'] = dailySlippage
+        d['totalTurnover'] = totalTurnover
+        d['dailyTurnover'] = dailyTurnover
+        d['totalTradeCount'] = totalTradeCount
+        d['dailyTradeCount'] = dailyTradeCount
+        d['totalReturn'] = totalReturn
+        d['dailyReturn'] = dailyReturn
+        d['returnStd'] = returnStd
+        d['sharpeRatio'] = sharpeRatio
+        
+        return df, d
+    
+    #----------------------------------------------------------------------
+    def showDailyResult(self, df=None):
+        """显示按日统计的交易结果"""
+        if df is None:
+            df = self.calculateDailyResult()
+        
+        df, d = self.calculateDailyStatistics(df)
+        
         # 输出统计结果
         self.output('-' * 30)
-        self.output(u'首个交易日：\t%s' % startDate)
-        self.output(u'最后交易日：\t%s' % endDate)
+        self.output(u'首个交易日：\t%s' % d['startDate'])
+        self.output(u'最后交易日：\t%s' % d['endDate'])
         
-        self.output(u'总交易日：\t%s' % totalDays)
-        self.output(u'盈利交易日\t%s' % profitDays)
-        self.output(u'亏损交易日：\t%s' % lossDays)
+        self.output(u'总交易日：\t%s' % d['totalDays'])
+        self.output(u'盈利交易日\t%s' % d['profitDays'])
+        self.output(u'亏损交易日：\t%s' % d['lossDays'])
         
         self.output(u'起始资金：\t%s' % self.capital)
-        self.output(u'结束资金：\t%s' % formatNumber(endBalance))
+        self.output(u'结束资金：\t%s' % formatNumber(d['endBalance']))
     
-        self.output(u'总收益率：\t%s' % formatNumber(totalReturn))
-        self.output(u'总盈亏：\t%s' % formatNumber(totalNetPnl))
-        self.output(u'最大回撤: \t%s' % formatNumber(maxDrawdown))      
-        
-        self.output(u'总手续费：\t%s' % formatNumber(totalCommission))
-        self.output(u'总滑点：\t%s' % formatNumber(totalSlippage))
-        self.output(u'总成交金额：\t%s' % formatNumber(totalTurnover))
-        self.output(u'总成交笔数：\t%s' % formatNumber(totalTradeCount))
-        
-        self.output(u'日均盈亏：\t%s' % formatNumber(dailyNetPnl))
-        self.output(u'日均手续费：\t%s' % formatNumber(dailyCommission))
-        self.output(u'日均滑点：\t%s' % formatNumber(dailySlippage))
-        self.output(u'日均成交金额：\t%s' % formatNumber(dailyTurnover))
-        self.output(u'日均成交笔数：\t%s' % formatNumber(dailyTradeCount))
-        
-        self.output(u'日均收益率：\t%s%%' % formatNumber(dailyReturn))
-        self.output(u'收益标准差：\t%s%%' % formatNumber(returnStd))
-        self.output(u'Sharpe Ratio：\t%s' % formatNumber(sharpeRatio))
+        self.output(u'总收益率：\t%s' % formatNumber(d['totalReturn']))
+        self.output(u'总盈亏：\t%s' % formatNumber(d['totalNetPnl']))
+        self.output(u'最大回撤: \t%s' % formatNumber(d['maxDrawdown']))      
+        
+        self.output(u'总手续费：\t%s' % formatNumber(d['totalCommission']))
+        self.output(u'总滑点：\t%s' % formatNumber(d['totalSlippage']))
+        self.output(u'总成交金额：\t%s' % formatNumber(d['totalTurnover']))
+        self.output(u'总成交笔数：\t%s' % formatNumber(d['totalTradeCount']))
+        
+        self.output(u'日均盈亏：\t%s' % formatNumber(d['dailyNetPnl']))
+        self.output(u'日均手续费：\t%s' % formatNumber(d['dailyCommission']))
+        self.output(u'日均滑点：\t%s' % formatNumber(d['dailySlippage']))
+        self.output(u'日均成交金额：\t%s' % formatNumber(d['dailyTurnover']))
+        self.output(u'日均成交笔数：\t%s' % formatNumber(d['dailyTradeCount']))
+        
+        self.output(u'日均收益率：\t%s%%' % formatNumber(d['dailyReturn']))
+        self.output(u'收益标准差：\t%s%%' % formatNumber(d['returnStd']))
+        self.output(u'Sharpe Ratio：\t%s' % formatNumber(d['sharpeRatio']))
+        
+        if df.empty:
+            return
         
         # 绘图
         fig = plt.figure(figsize=(10, 16))
@@ -1038,8 +1697,212 @@ class BacktestingEngine(object):
         df['netPnl'].hist(bins=50)
         
         plt.show()
+    
+    #------------------------------------------------
+    # 蒙特卡洛分析
+    #------------------------------------------------
+    
+    #----------------------------------------------------------------------
+    def runMonteCarloAnalysis(self, count=10000, blockSize=20, seed=None, processes=None):
+        """
+        对回测结果进行蒙特卡洛分析
+        count：重抽样的数量
+        blockSize：每日净盈亏分块重抽样时区块的天数
+        返回交易顺序重排和分块重抽样的分布字典{指标名: 数组}
+        """
+        shuffleDict = {}
+        d = self.calculateBacktestingResult()
+        if d:
+            shuffleDict = shuffleTrades(d['pnlList'], self.capital, count, seed, processes)
+        
+        bootstrapDict = {}
+        if self.dailyResultDict:
+            df = self.calculateDailyResult()
+            bootstrapDict = bootstrapDaily(df['netPnl'].values, self.capital, count, blockSize,
+                                           seed, processes)
+        
+        return shuffleDict, bootstrapDict
+    
+    #----------------------------------------------------------------------
+    def showMonteCarloResult(self, count=10000, blockSize=20, seed=None, processes=None):
+        """显示蒙特卡洛分析的分位数"""
+        shuffleDict, bootstrapDict = self.runMonteCarloAnalysis(count, blockSize, seed, processes)
+        
+        self.output('-' * 30)
+        self.output(u'交易顺序重排（%s次）：' %count)
+        self.output(calculatePercentiles(shuffleDict).to_string())
+        
+        self.output('-' * 30)
+        self.output(u'每日盈亏分块重抽样（%s次，区块%s天）：' %(count, blockSize))
+        self.output(calculatePercentiles(bootstrapDict).to_string())
+        
+        return shuffleDict, bootstrapDict
+    
+    #------------------------------------------------
+    # 向量化信号回测
+    #------------------------------------------------
+    
+    #----------------------------------------------------------------------
+    def loadBarFrame(self):
+        """载入回测用的K线数据（不包括初始化数据），返回BarFrame"""
+        if self.historyCachePath:
+            return BarFrame.fromHistoryCache(self.historyCachePath, self.dataEndDate)
+        
+        dbClient = pymongo.MongoClient(globalSetting['mongoHost'], globalSetting['mongoPort'])
+        collection = dbClient[self.dbName][self.symbol]
+        
+        if not self.dataEndDate:
+            flt = {'datetime':{'$gte':self.strategyStartDate}}
+        else:
+            flt = {'datetime':{'$gte':self.strategyStartDate,
+                               '$lte':self.dataEndDate}}
+        fields = dict([(field, True) for field in ['datetime'] + BarFrame.fieldList])
+        dataList = list(collection.find(flt, fields).sort('datetime'))
+        
+        self.output(u'K线数据载入完成，数据量：%s' %len(dataList))
+        return BarFrame.fromDataList(dataList)
+    
+    #----------------------------------------------------------------------
+    def runVectorBacktesting(self, position, barFrame=None):
+        """
+        向量化信号回测
+        position：每根K线收盘后的目标仓位数组，在下一根K线开盘价成交
+        返回按日统计结果的DataFrame（格式和calculateDailyResult一致）和统计结果字典
+        """
+        if barFrame is None:
+            barFrame = self.loadBarFrame()
+        
+        df = calculateVectorResult(barFrame, position, self.size, self.rate, self.slippage)
+        return self.calculateDailyStatistics(df)
+    
+    #----------------------------------------------------------------------
+    def runVectorScreening(self, positionMatrix, barFrame=None, targetName='sharpeRatio'):
+        """
+        向量化批量筛选信号
+        positionMatrix：二维目标仓位数组（K线数量 x 信号数量），也可以是仓位数组的列表
+        返回[(信号序号, 目标值)]列表，按目标值从大到小排序
+        """
+        if barFrame is None:
+            barFrame = self.loadBarFrame()
+        
+        positionMatrix = np.asarray(positionMatrix, dtype=np.float64)
+        if positionMatrix.ndim == 2 and positionMatrix.shape[0] != len(barFrame):
+            positionMatrix = positionMatrix.T
+        
+        d = calculateVectorPnl(barFrame, positionMatrix, self.size, self.rate, self.slippage)
+        statistics = calculateVectorStatistics(d['netPnl'], self.capital)
+        
+        # totalDays等指标对全部信号相同，返回的是标量，需要扩展到信号数量；
+        # 单个信号时各指标也都是标量，统一转换为一维数组
+        signalShape = np.shape(statistics['totalNetPnl'])
+        targetArray = np.atleast_1d(np.broadcast_to(statistics[targetName], signalShape))
+        
+        resultList = list(enumerate(targetArray.tolist()))
+        resultList.sort(reverse=True, key=lambda result:result[1])
+        return resultList
         
         
+########################################################################
+class PriceIndexedOrderDict(OrderedDict):
+    """
+    按方向和价格索引的活动委托字典（限价单或者停止单）
+    撮合时只需要二分查找出价格满足条件的委托，而不用遍历全部委托
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, trackAdded=False):
+        """
+        Constructor
+        trackAdded：是否记录新插入的委托编号（通过popAddedKeys获取）
+        """
+        self.seq = 0                # 插入顺序编号
+        self.seqDict = {}           # key为委托编号，value为插入顺序编号
+        self.trackAdded = trackAdded
+        self.addedKeyList = []      # 上次调用popAddedKeys后新插入的委托编号
+        
+        # 每个方向按(价格, 插入顺序编号, 委托编号)排序的列表
+        self.indexDict = {DIRECTION_LONG: [],
+                          DIRECTION_SHORT: []}
+        
+        OrderedDict.__init__(self)
+        
+    #----------------------------------------------------------------------
+    def __setitem__(self, key, order):
+        """插入委托"""
+        if key in self:
+            del self[key]
+        
+        OrderedDict.__setitem__(self, key, order)
+        
+        self.seq += 1
+        self.seqDict[key] = self.seq
+        if self.trackAdded:
+            self.addedKeyList.append(key)
+        
+        index = self.indexDict.get(order.direction, None)
+        if index is not None:
+            insort(index, (order.price, self.seq, key))
+        
+    #----------------------------------------------------------------------
+    def __delitem__(self, key):
+        """删除委托"""
+        order = self[key]
+        OrderedDict.__delitem__(self, key)
+        
+        seq = self.seqDict.pop(key)
+        index = self.indexDict.get(order.direction, None)
+        if index is not None:
+            i = bisect_left(index, (order.price, seq))
+            del index[i]
+        
+    #----------------------------------------------------------------------
+    def clear(self):
+        """清空委托"""
+        OrderedDict.clear(self)
+        
+        self.seqDict.clear()
+        self.addedKeyList = []
+        for index in self.indexDict.values():
+            del index[:]
+        
+    #----------------------------------------------------------------------
+    def getKeysByPrice(self, direction, low=None, high=None):
+        """获取某个方向上价格在[low, high]范围内的委托编号列表"""
+        index = self.indexDict[direction]
+        
+        if low is None:
+            start = 0
+        else:
+            start = bisect_left(index, (low,))
+        
+        if high is None:
+            end = len(index)
+        else:
+            end = bisect_right(index, (high, float('inf')))
+        
+        return [key for price, seq, key in index[start:end]]
+    
+    #----------------------------------------------------------------------
+    def popAddedKeys(self):
+        """获取并清空上次调用后新插入的委托编号列表"""
+        keyList = self.addedKeyList
+        self.addedKeyList = []
+        return keyList
+    
+    #----------------------------------------------------------------------
+    def getSortedItems(self, keyList):
+        """获取委托编号列表对应的(委托编号, 委托)列表，去除重复和已删除的委托，按插入顺序排序"""
+        keySet = set([key for key in keyList if key in self.seqDict])
+        sortedKeyList = sorted(keySet, key=self.seqDict.get)
+        return [(key, self[key]) for key in sortedKeyList]
+
+    #----------------------------------------------------------------------
+    def __reduce__(self):
+        """序列化（用于回测快照），恢复时按插入顺序重新插入委托以重建索引"""
+        state = {'addedKeyList': list(self.addedKeyList)}
+        return (self.__class__, (self.trackAdded,), state, None, iter(self.items()))
+
+
 ########################################################################
 class TradingResult(object):
     """每笔交易的结果"""
@@ -1182,6 +2045,42 @@ class OptimizationSetting(object):
     
         return settingList
     
+    #----------------------------------------------------------------------
+    def getParamSizeList(self):
+        """每个参数的取值数量"""
+        return [len(l) for l in self.paramDict.values()]
+    
+    #----------------------------------------------------------------------
+    def getGridSize(self):
+        """全部参数组合的数量"""
+        return reduce(lambda x, y: x*y, self.getParamSizeList(), 1)
+    
+    #----------------------------------------------------------------------
+    def getSettingByIndex(self, indexList):
+        """根据每个参数取值的序号生成参数组合"""
+        nameList = self.paramDict.keys()
+        paramList = self.paramDict.values()
+        return dict([(name, params[i]) for name, params, i in zip(nameList, paramList, indexList)])
+    
+    #----------------------------------------------------------------------
+    def generateRandomSetting(self, count, rnd=random):
+        """随机抽取count个不重复的参数组合（不生成全部组合）"""
+        sizeList = self.getParamSizeList()
+        gridSize = self.getGridSize()
+        
+        settingList = []
+        for n in rnd.sample(xrange(gridSize), min(count, gridSize)):
+            # 把组合序号分解为每个参数的取值序号
+            indexList = []
+            for size in reversed(sizeList):
+                n, i = divmod(n, size)
+                indexList.append(i)
+            indexList.reverse()
+            
+            settingList.append(self.getSettingByIndex(indexList))
+        
+        return settingList
+    
     #----------------------------------------------------------------------
     def setOptimizeTarget(self, target):
         """设置优化目标字段"""
@@ -1195,11 +2094,67 @@ def formatNumber(n):
     return format(rn, ',')  # 加上千分符
     
 
+#----------------------------------------------------------------------
+def matchTrades(openVolume, closeVolume):
+    """
+    按照先开先平的规则对开平仓成交配对
+    openVolume、closeVolume：每笔成交中开仓和平仓的数量（同一个方向的持仓）
+    返回已平仓交易的开仓成交位置、平仓成交位置、数量，以及未平仓部分的开仓成交位置、数量
+    """
+    # 把开仓和平仓数量各自累加，每个区间[开仓累计, 平仓累计]重叠的部分就是一笔配对的交易
+    openCum = np.cumsum(openVolume)
+    closeCum = np.cumsum(closeVolume)
+    totalClosed = closeCum[-1]
+    
+    points = np.union1d(openCum, closeCum)
+    points = np.concatenate([[0], points[(points > 0) & (points <= totalClosed)]])
+    start = points[:-1]
+    volume = points[1:] - start
+    
+    entryIndex = np.searchsorted(openCum, start, side='right')
+    exitIndex = np.searchsorted(closeCum, start, side='right')
+    
+    # 未平仓的部分
+    leftPoints = np.concatenate([[totalClosed], np.unique(openCum[openCum > totalClosed])])
+    leftStart = leftPoints[:-1]
+    leftVolume = leftPoints[1:] - leftStart
+    leftIndex = np.searchsorted(openCum, leftStart, side='right')
+    
+    return entryIndex, exitIndex, volume, leftIndex, leftVolume
+
+
+#----------------------------------------------------------------------
+def sumInOrder(array):
+    """按顺序逐个累加（和Python循环的累加结果完全一致，np.sum使用两两求和会有微小差异）"""
+    if not len(array):
+        return 0
+    return float(np.cumsum(array)[-1])
+
+
+#----------------------------------------------------------------------
+def getSettingKey(setting):
+    """参数组合的唯一标识，用于结果文件中识别已完成的参数"""
+    return json.dumps(setting, sort_keys=True)
+
+
+#----------------------------------------------------------------------
+def optimizeTask(args):
+    """imap_unordered中调用的优化函数（只接受一个参数），返回参数组合和优化结果"""
+    setting = args[1]
+    return setting, optimize(*args)
+
+
+#----------------------------------------------------------------------
+def optimizeBatchTask(args):
+    """imap_unordered中调用的多实例优化函数（只接受一个参数）"""
+    return optimizeBatch(*args)
+
+
 #----------------------------------------------------------------------
 def optimize(strategyClass, setting, targetName,
              mode, startDate, initDays, endDate,
              slippage, rate, size, priceTick,
-             dbName, symbol):
+             dbName, symbol, historyCachePath='', intrabarSetting=None):
     """多进程优化时跑在每个进程中运行的函数"""
     engine = BacktestingEngine()
     engine.setBacktestingMode(mode)
@@ -1210,13 +2165,48 @@ def optimize(strategyClass, setting, targetName,
     engine.setSize(size)
     engine.setPriceTick(priceTick)
     engine.setDatabase(dbName, symbol)
+    engine.setHistoryCache(historyCachePath)
+    if intrabarSetting:
+        engine.setIntrabarTick(**intrabarSetting)
     
     engine.initStrategy(strategyClass, setting)
     engine.runBacktesting()
-    d = engine.calculateBacktestingResult()
+    d = engine.calculateBacktestingResult(metricsOnly=True)
     try:
         targetValue = d[targetName]
     except KeyError:
         targetValue = 0            
     return (str(setting), targetValue)    
-    
\ No newline at end of file
+    
+
+
+#----------------------------------------------------------------------
+def optimizeBatch(strategyClass, settingList, targetName,
+                  mode, startDate, initDays, endDate,
+                  slippage, rate, size, priceTick,
+                  dbName, symbol, historyCachePath='', intrabarSetting=None):
+    """多进程优化时跑在每个进程中运行的函数，一次数据回放同时回测多组参数"""
+    engine = BacktestingEngine()
+    engine.setBacktestingMode(mode)
+    engine.setStartDate(startDate, initDays)
+    engine.setEndDate(endDate)
+    engine.setSlippage(slippage)
+    engine.setRate(rate)
+    engine.setSize(size)
+    engine.setPriceTick(priceTick)
+    engine.setDatabase(dbName, symbol)
+    engine.setHistoryCache(historyCachePath)
+    if intrabarSetting:
+        engine.setIntrabarTick(**intrabarSetting)
+    
+    engineList = engine.runBatchBacktesting(strategyClass, settingList)
+    
+    resultList = []
+    for setting, subEngine in zip(settingList, engineList):
+        d = subEngine.calculateBacktestingResult(metricsOnly=True)
+        try:
+            targetValue = d[targetName]
+        except KeyError:
+            targetValue = 0
+        resultList.append((setting, (str(setting), targetValue)))
+    return resultList
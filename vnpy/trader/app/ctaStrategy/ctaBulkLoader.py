@@ -0,0 +1,238 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了CSV历史数据的批量导入，用于一次导入多年的分钟线数据：
+1. 使用pandas一次读取整个文件，日期时间等字段按列转换，不逐行解析
+2. 写入MongoDB时使用无序的bulk_write批量写入（按datetime覆盖，重复导入不会产生重复数据），
+   也可以写入本地的历史数据缓存目录（和回测引擎的setHistoryCache使用相同的格式）
+3. 多个文件使用进程池并行导入，每个文件完成时输出一行汇总信息
+
+支持的文件格式：
+mc：MultiCharts导出的CSV文件，包含Date、Time、Open、High、Low、Close、TotalVolume列
+tdx：通达信导出的CSV文件，没有表头，列依次为日期、时间、开、高、低、收、成交量、持仓量
+'''
+
+from __future__ import division
+
+import os
+import multiprocessing
+from time import time
+
+import numpy as np
+
+from vnpy.trader.vtGlobal import globalSetting
+from vnpy.trader.vtFunction import LazyModule
+from vnpy.trader.vtObject import VtBarData
+
+from .ctaHistoryCache import saveHistoryCache
+
+
+pd = LazyModule('pandas')
+pymongo = LazyModule('pymongo')
+
+BATCH_SIZE = 10000      # 每次bulk_write写入的数据数量
+
+TDX_COLUMN_LIST = ['date', 'time', 'open', 'high', 'low', 'close', 'volume', 'openInterest']
+
+
+#----------------------------------------------------------------------
+def readMcCsv(fileName):
+    """读取MultiCharts导出的CSV文件，返回包含datetime和OHLC等列的DataFrame"""
+    df = pd.read_csv(fileName, dtype={'Date': str, 'Time': str})
+    df.columns = [column.strip() for column in df.columns]
+
+    frame = pd.DataFrame()
+    frame['datetime'] = pd.to_datetime(df['Date'] + ' ' + df['Time'], format='%Y-%m-%d %H:%M:%S')
+    frame['open'] = df['Open'].astype(float)
+    frame['high'] = df['High'].astype(float)
+    frame['low'] = df['Low'].astype(float)
+    frame['close'] = df['Close'].astype(float)
+    frame['volume'] = df['TotalVolume'].astype(float)
+
+    if 'OpenInterest' in df.columns:
+        frame['openInterest'] = df['OpenInterest'].astype(float)
+    else:
+        frame['openInterest'] = 0
+
+    return frame
+
+
+#----------------------------------------------------------------------
+def readTdxCsv(fileName):
+    """读取通达信导出的CSV文件，文件首尾的说明文字等无法解析的行会被忽略"""
+    df = pd.read_csv(fileName, header=None, names=TDX_COLUMN_LIST, usecols=range(len(TDX_COLUMN_LIST)),
+                     dtype=str, skipinitialspace=True)
+
+    # 时间为HHMM格式，如0931
+    text = df['date'].str.strip() + ' ' + df['time'].str.strip().str.zfill(4)
+    dt = pd.to_datetime(text, format='%Y/%m/%d %H%M', errors='coerce')
+
+    df = df[dt.notnull()]
+    frame = pd.DataFrame({'datetime': dt[dt.notnull()]})
+    # 统一转换为浮点数，整数价格不会变为int64（避免策略中的整数除法）
+    for column in TDX_COLUMN_LIST[2:]:
+        frame[column] = pd.to_numeric(df[column], errors='coerce').fillna(0).astype(float)
+
+    return frame
+
+
+# 文件格式和读取函数的映射
+READER_DICT = {
+    'mc': readMcCsv,
+    'tdx': readTdxCsv
+}
+
+
+#----------------------------------------------------------------------
+def formatDatetime(values):
+    """
+    把datetime64数组转换为日期（YYYYMMDD）和时间（HH:MM:SS）字符串列表
+    按字节截取字符数组，避免逐个调用strftime
+    """
+    text = np.datetime_as_string(values, unit='s').astype('S19')      # YYYY-MM-DDTHH:MM:SS
+    charArray = text.view('S1').reshape(len(text), 19)
+
+    dateArray = np.ascontiguousarray(charArray[:, [0, 1, 2, 3, 5, 6, 8, 9]]).view('S8').ravel()
+    timeArray = np.ascontiguousarray(charArray[:, 11:19]).view('S8').ravel()
+    return dateArray.tolist(), timeArray.tolist()
+
+
+#----------------------------------------------------------------------
+def createBarList(frame, symbol):
+    """把DataFrame转换为VtBarData格式的数据字典列表（按时间排序，重复时间只保留最后一个）"""
+    frame = frame.drop_duplicates('datetime', keep='last').sort_values('datetime')
+
+    dtList = frame['datetime'].dt.to_pydatetime().tolist()
+    dateList, timeList = formatDatetime(frame['datetime'].values)
+
+    fieldList = ['datetime', 'date', 'time', 'open', 'high', 'low', 'close', 'volume', 'openInterest']
+    columnList = [dtList, dateList, timeList] + [frame[field].tolist() for field in fieldList[3:]]
+
+    # 其他字段使用VtBarData的默认值
+    template = VtBarData().__dict__
+    template['vtSymbol'] = symbol
+    template['symbol'] = symbol
+
+    barList = []
+    for row in zip(*columnList):
+        d = template.copy()
+        d.update(zip(fieldList, row))
+        barList.append(d)
+    return barList
+
+
+#----------------------------------------------------------------------
+def bulkUpsert(collection, barList, batchSize=BATCH_SIZE):
+    """按datetime批量覆盖写入集合（无序写入，每批一次请求）"""
+    collection.ensure_index([('datetime', pymongo.ASCENDING)], unique=True)
+
+    for i in range(0, len(barList), batchSize):
+        requestList = [pymongo.UpdateOne({'datetime': d['datetime']}, {'$set': d}, upsert=True)
+                       for d in barList[i:i+batchSize]]
+        collection.bulk_write(requestList, ordered=False)
+
+
+#----------------------------------------------------------------------
+def writeToDb(barList, dbName, symbol, batchSize=BATCH_SIZE):
+    """批量写入数据库，按datetime覆盖已有的数据"""
+    client = pymongo.MongoClient(globalSetting['mongoHost'], globalSetting['mongoPort'])
+    bulkUpsert(client[dbName][symbol], barList, batchSize)
+    client.close()
+
+
+#----------------------------------------------------------------------
+def loadCsv(fileNameList, symbol, fileType, dbName='', cachePath=''):
+    """
+    导入一个代码的CSV文件，返回导入的数据量，出错时直接抛出异常
+    cachePath不为空时写入历史数据缓存目录，否则写入数据库
+    """
+    reader = READER_DICT[fileType]
+    frameList = [reader(fileName) for fileName in fileNameList]
+    barList = createBarList(pd.concat(frameList, ignore_index=True), symbol)
+
+    if cachePath:
+        saveHistoryCache(cachePath, [], barList)
+    else:
+        writeToDb(barList, dbName, symbol)
+
+    return len(barList)
+
+
+#----------------------------------------------------------------------
+def loadCsvTask(args):
+    """
+    进程池中调用的导入函数（只接受一个参数），返回(文件名列表, 代码, 数据量, 耗时, 错误信息)
+    出错时不抛出异常，其他任务继续导入
+    """
+    fileNameList, symbol, fileType, dbName, cachePath = args
+    start = time()
+
+    try:
+        count = loadCsv(fileNameList, symbol, fileType, dbName, cachePath)
+    except Exception as e:
+        return fileNameList, symbol, 0, time()-start, repr(e)
+
+    return fileNameList, symbol, count, time()-start, ''
+
+
+#----------------------------------------------------------------------
+def loadCsvFiles(fileList, fileType, dbName='', cacheRoot='', processes=None):
+    """
+    批量导入CSV文件
+    fileList：(文件名, 代码)的列表
+    fileType：文件格式，mc或者tdx
+    dbName：写入的数据库名
+    cacheRoot：设置后写入cacheRoot/代码的历史数据缓存目录，不写入数据库，
+               同一个代码的多个文件合并为一个缓存
+    processes：并行的进程数，默认为CPU核心数
+    返回导入的数据总量
+    """
+    if fileType not in READER_DICT:
+        raise ValueError(u'不支持的文件格式：%s' %fileType)
+
+    # 写入缓存时同一个代码的文件在一个任务中合并，写入数据库时每个文件一个任务
+    if cacheRoot:
+        symbolDict = {}
+        for fileName, symbol in fileList:
+            symbolDict.setdefault(symbol, []).append(fileName)
+        taskList = [(sorted(nameList), symbol, fileType, dbName, os.path.join(cacheRoot, symbol))
+                    for symbol, nameList in sorted(symbolDict.items())]
+    else:
+        taskList = [([fileName], symbol, fileType, dbName, '') for fileName, symbol in fileList]
+
+    start = time()
+    print u'开始导入%s个文件，任务数量：%s' %(len(fileList), len(taskList))
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(taskList)))
+
+    pool = None
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        resultIterator = pool.imap_unordered(loadCsvTask, taskList)
+    else:
+        resultIterator = (loadCsvTask(task) for task in taskList)
+
+    totalCount = 0
+    errorCount = 0
+    try:
+        for n, result in enumerate(resultIterator):
+            fileNameList, symbol, count, cost, error = result
+            name = ', '.join([os.path.basename(fileName) for fileName in fileNameList])
+
+            if error:
+                errorCount += 1
+                print u'[%s/%s] %s %s 导入失败：%s' %(n+1, len(taskList), symbol, name, error)
+            else:
+                totalCount += count
+                print u'[%s/%s] %s %s 数据量：%s，耗时：%.1f秒' %(n+1, len(taskList), symbol, name, count, cost)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    cost = time() - start
+    print u'导入完成，数据总量：%s，失败任务：%s，耗时：%.1f秒，每秒%.0f条' %(totalCount, errorCount, cost,
+                                                           totalCount / max(cost, 1e-6))
+    return totalCount
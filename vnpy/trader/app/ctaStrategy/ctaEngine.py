@@ -23,6 +23,10 @@ import os
 import traceback
 from collections import OrderedDict
 from datetime import datetime, timedelta
+from functools import partial
+from threading import RLock, Lock
+from multiprocessing.pool import ThreadPool
+from time import time
 
 from vnpy.event import Event
 from vnpy.trader.vtEvent import *
@@ -30,8 +34,13 @@ from vnpy.trader.vtConstant import *
 from vnpy.trader.vtObject import VtTickData, VtBarData
 from vnpy.trader.vtGateway import VtSubscribeReq, VtOrderReq, VtCancelOrderReq, VtLogData
 from vnpy.trader.vtFunction import todayDate, getJsonPath
+from vnpy.trader.vtGlobal import globalSetting
+from vnpy.trader.vtArchive import ArchiveDict, ArchiveSet
+from vnpy.trader.vtLatency import (latencyTracer, STAGE_DISPATCH,
+                                   STAGE_ORDER_REQ)
 
 from .ctaBase import *
+from .ctaScheduler import StrategyScheduler
 from .strategy import STRATEGY_CLASS
 
 
@@ -42,6 +51,14 @@ class CtaEngine(object):
     """CTA策略引擎"""
     settingFileName = 'CTA_setting.json'
     settingfilePath = getJsonPath(settingFileName, __file__)   
+    
+    initPoolSize = 10           # 并发初始化策略的线程数量
+    barCacheSize = 50           # 缓存的K线查询结果数量
+    barCacheExpire = 60         # K线查询结果的缓存有效时间（秒）
+    
+    orderRetention = 10000      # 已结束委托和策略映射关系的保留数量
+    stopOrderRetention = 10000  # 已结束停止单的保留数量
+    tradeRetention = 100000     # 用于过滤重复推送的成交号保留数量
 
     #----------------------------------------------------------------------
     def __init__(self, mainEngine, eventEngine):
@@ -65,13 +82,16 @@ class CtaEngine(object):
         # key为vtOrderID，value为strategy对象
         self.orderStrategyDict = {}     
         
+        # 委托结束后映射关系移入归档字典，保证结束后的成交推送仍然可以找到策略
+        self.finishedOrderStrategyDict = ArchiveDict(self.orderRetention)
+        
         # 本地停止单编号计数
         self.stopOrderCount = 0
         # stopOrderID = STOPORDERPREFIX + str(stopOrderCount)
         
         # 本地停止单字典
         # key为stopOrderID，value为stopOrder对象
-        self.stopOrderDict = {}             # 停止单撤销后不会从本字典中删除
+        self.stopOrderDict = ArchiveDict(self.stopOrderRetention)   # 停止单撤销后不会从本字典中删除（只保留最近的数据）
         self.workingStopOrderDict = {}      # 停止单撤销后会从本字典中删除
         
         # 持仓缓存字典
@@ -79,17 +99,40 @@ class CtaEngine(object):
         self.posBufferDict = {}
         
         # 成交号集合，用来过滤已经收到过的成交推送
-        self.tradeSet = set()
+        self.tradeSet = ArchiveSet(self.tradeRetention)
         
         # 引擎类型为实盘
         self.engineType = ENGINETYPE_TRADING
         
+        # 策略调度器，工作线程数量为0时策略回调直接在事件引擎线程中执行
+        self.scheduler = None
+        workerCount = globalSetting.get('ctaWorkerCount', 0)
+        if workerCount > 0:
+            self.scheduler = StrategyScheduler(self, workerCount)
+            self.scheduler.start()
+        
+        # 委托相关操作的锁（策略在工作线程中运行时，发单撤单可能来自多个线程，
+        # 事件线程查询委托对应的策略时也要获取该锁，等待正在进行的发单保存映射关系）
+        self.orderLock = RLock()
+        
+        # K线查询结果缓存，交易相同合约的多个策略初始化时共享数据
+        # key为(dbName, collectionName, days)，value为(查询时间, 数据字典列表)
+        self.barCacheDict = OrderedDict()
+        self.barCacheLock = Lock()
+        self.barLoadLockDict = {}       # 正在查询中的key对应的锁，避免重复查询
+        
         # 注册事件监听
         self.registerEvent()
  
     #----------------------------------------------------------------------
     def sendOrder(self, vtSymbol, orderType, price, volume, strategy):
         """发单"""
+        with self.orderLock:
+            return self.__sendOrder(vtSymbol, orderType, price, volume, strategy)
+    
+    #----------------------------------------------------------------------
+    def __sendOrder(self, vtSymbol, orderType, price, volume, strategy):
+        """发单的具体实现"""
         contract = self.mainEngine.getContract(vtSymbol)
         
         req = VtOrderReq()
@@ -103,6 +146,7 @@ class CtaEngine(object):
         
         # 设计为CTA引擎发出的委托只允许使用限价单
         req.priceType = PRICETYPE_LIMITPRICE    
+        latencyTracer.stampOrder(STAGE_ORDER_REQ)
         
         # CTA委托类型映射
         if orderType == CTAORDER_BUY:
@@ -176,21 +220,19 @@ class CtaEngine(object):
                 req.frontID = order.frontID
                 req.sessionID = order.sessionID
                 req.orderID = order.orderID
-                self.mainEngine.cancelOrder(req, order.gatewayName)    
+                
+                with self.orderLock:
+                    self.mainEngine.cancelOrder(req, order.gatewayName)    
 
     #----------------------------------------------------------------------
     def sendStopOrder(self, vtSymbol, orderType, price, volume, strategy):
         """发停止单（本地实现）"""
-        self.stopOrderCount += 1
-        stopOrderID = STOPORDERPREFIX + str(self.stopOrderCount)
-        
         so = StopOrder()
         so.vtSymbol = vtSymbol
         so.orderType = orderType
         so.price = price
         so.volume = volume
         so.strategy = strategy
-        so.stopOrderID = stopOrderID
         so.status = STOPORDER_WAITING
         
         if orderType == CTAORDER_BUY:
@@ -206,9 +248,14 @@ class CtaEngine(object):
             so.direction = DIRECTION_LONG
             so.offset = OFFSET_CLOSE           
         
-        # 保存stopOrder对象到字典中
-        self.stopOrderDict[stopOrderID] = so
-        self.workingStopOrderDict[stopOrderID] = so
+        # 生成停止单编号并保存stopOrder对象到字典中（多个工作线程同时发单时编号不会重复）
+        with self.orderLock:
+            self.stopOrderCount += 1
+            stopOrderID = STOPORDERPREFIX + str(self.stopOrderCount)
+            so.stopOrderID = stopOrderID
+            
+            self.stopOrderDict[stopOrderID] = so
+            self.workingStopOrderDict[stopOrderID] = so
         
         # 推送停止单状态
         strategy.onStopOrder(so)
@@ -219,11 +266,12 @@ class CtaEngine(object):
     def cancelStopOrder(self, stopOrderID):
         """撤销停止单"""
         # 检查停止单是否存在
-        if stopOrderID in self.workingStopOrderDict:
-            so = self.workingStopOrderDict[stopOrderID]
+        with self.orderLock:
+            so = self.workingStopOrderDict.pop(stopOrderID, None)
+            
+        if so:
             so.status = STOPORDER_CANCELLED
-            del self.workingStopOrderDict[stopOrderID]
-            so.strategy.onStopOrder(so)
+            self.callStrategyFunc(so.strategy, so.strategy.onStopOrder, so)
 
     #----------------------------------------------------------------------
     def processStopOrder(self, tick):
@@ -233,7 +281,10 @@ class CtaEngine(object):
         # 首先检查是否有策略交易该合约
         if vtSymbol in self.tickStrategyDict:
             # 遍历等待中的停止单，检查是否会被触发
-            for so in self.workingStopOrderDict.values():
+            with self.orderLock:
+                soList = self.workingStopOrderDict.values()
+            
+            for so in soList:
                 if so.vtSymbol == vtSymbol:
                     longTriggered = so.direction==DIRECTION_LONG and tick.lastPrice>=so.price        # 多头停止单被触发
                     shortTriggered = so.direction==DIRECTION_SHORT and tick.lastPrice<=so.price     # 空头停止单被触发
@@ -245,15 +296,22 @@ class CtaEngine(object):
                         else:
                             price = tick.lowerLimit
                         
-                        so.status = STOPORDER_TRIGGERED
-                        self.sendOrder(so.vtSymbol, so.orderType, price, so.volume, so.strategy)
-                        del self.workingStopOrderDict[so.stopOrderID]
-                        so.strategy.onStopOrder(so)
+                        # 停止单可能已经在工作线程中被撤销
+                        with self.orderLock:
+                            if self.workingStopOrderDict.pop(so.stopOrderID, None) is None:
+                                continue
+                            
+                            so.status = STOPORDER_TRIGGERED
+                            self.sendOrder(so.vtSymbol, so.orderType, price, so.volume, so.strategy)
+                            
+                        self.callStrategyFunc(so.strategy, so.strategy.onStopOrder, so)
 
     #----------------------------------------------------------------------
     def processTickEvent(self, event):
         """处理行情推送"""
         tick = event.dict_['data']
+        latencyTracer.stampTick(tick, STAGE_DISPATCH)
+        
         # 收到tick行情后，先处理本地停止单（检查是否要立即发出）
         self.processStopOrder(tick)
         
@@ -278,8 +336,14 @@ class CtaEngine(object):
         """处理委托推送"""
         order = event.dict_['data']
         
-        if order.vtOrderID in self.orderStrategyDict:
-            strategy = self.orderStrategyDict[order.vtOrderID]            
+        strategy = self.getOrderStrategy(order.vtOrderID)
+        if strategy:
+            # 委托结束后，把映射关系移入归档字典
+            if order.status in [STATUS_ALLTRADED, STATUS_REJECTED, STATUS_CANCELLED]:
+                with self.orderLock:
+                    if self.orderStrategyDict.pop(order.vtOrderID, None):
+                        self.finishedOrderStrategyDict[order.vtOrderID] = strategy
+            
             self.callStrategyFunc(strategy, strategy.onOrder, order)
     
     #----------------------------------------------------------------------
@@ -293,16 +357,10 @@ class CtaEngine(object):
         self.tradeSet.add(trade.vtTradeID)
         
         # 将成交推送到策略对象中
-        if trade.vtOrderID in self.orderStrategyDict:
-            strategy = self.orderStrategyDict[trade.vtOrderID]
-            
-            # 计算策略持仓
-            if trade.direction == DIRECTION_LONG:
-                strategy.pos += trade.volume
-            else:
-                strategy.pos -= trade.volume
-            
-            self.callStrategyFunc(strategy, strategy.onTrade, trade)
+        strategy = self.getOrderStrategy(trade.vtOrderID)
+        if strategy:
+            # 持仓计算和onTrade作为一次调用放入策略的工作线程，避免策略回调执行中持仓被修改
+            self.callStrategyFunc(strategy, partial(self.processStrategyTrade, strategy), trade)
             
         # 更新持仓缓存数据
         if trade.vtSymbol in self.tickStrategyDict:
@@ -313,6 +371,16 @@ class CtaEngine(object):
                 self.posBufferDict[trade.vtSymbol] = posBuffer
             posBuffer.updateTradeData(trade)            
             
+    #----------------------------------------------------------------------
+    def processStrategyTrade(self, strategy, trade):
+        """计算策略持仓后推送成交"""
+        if trade.direction == DIRECTION_LONG:
+            strategy.pos += trade.volume
+        else:
+            strategy.pos -= trade.volume
+        
+        strategy.onTrade(trade)
+            
     #----------------------------------------------------------------------
     def processPositionEvent(self, event):
         """处理持仓推送"""
@@ -327,6 +395,28 @@ class CtaEngine(object):
                 self.posBufferDict[pos.vtSymbol] = posBuffer
             posBuffer.updatePositionData(pos)
     
+    #----------------------------------------------------------------------
+    def getOrderStrategy(self, vtOrderID):
+        """
+        查询委托对应的策略，活动委托优先
+        sendOrder在持有orderLock时发单并保存映射，这里同样获取orderLock，
+        保证工作线程发单时，事件线程先收到的委托和成交推送能找到对应的策略
+        """
+        with self.orderLock:
+            strategy = self.orderStrategyDict.get(vtOrderID, None)
+            if strategy:
+                return strategy
+            return self.finishedOrderStrategyDict.get(vtOrderID, None)
+    
+    #----------------------------------------------------------------------
+    def getMemoryStats(self):
+        """获取委托和成交相关数据的内存使用统计"""
+        return {'orderStrategyDict': {'size': len(self.orderStrategyDict)},
+                'finishedOrderStrategyDict': self.finishedOrderStrategyDict.getStats(),
+                'stopOrderDict': self.stopOrderDict.getStats(),
+                'workingStopOrderDict': {'size': len(self.workingStopOrderDict)},
+                'tradeSet': self.tradeSet.getStats()}
+    
     #----------------------------------------------------------------------
     def registerEvent(self):
         """注册事件监听"""
@@ -343,18 +433,67 @@ class CtaEngine(object):
     #----------------------------------------------------------------------
     def loadBar(self, dbName, collectionName, days):
         """从数据库中读取Bar数据，startDate是datetime对象"""
-        startDate = self.today - timedelta(days)
-        
-        d = {'datetime':{'$gte':startDate}}
-        barData = self.mainEngine.dbQuery(dbName, collectionName, d, 'datetime')
+        barData = self.loadBarData(dbName, collectionName, days)
         
         l = []
         for d in barData:
             bar = VtBarData()
-            bar.__dict__ = d
+            bar.__dict__ = d.copy()     # 数据字典在策略间共享，因此需要复制
             l.append(bar)
         return l
     
+    #----------------------------------------------------------------------
+    def loadBarData(self, dbName, collectionName, days):
+        """读取Bar数据字典列表，缓存有效期内相同的查询只访问一次数据库"""
+        key = (dbName, collectionName, days)
+        
+        barData = self.getBarCache(key)
+        if barData is not None:
+            return barData
+        
+        with self.barCacheLock:
+            loadLock = self.barLoadLockDict.setdefault(key, Lock())
+        
+        # 同一个key只允许一个线程查询，其他线程等待后直接读取缓存
+        with loadLock:
+            barData = self.getBarCache(key)
+            if barData is not None:
+                return barData
+            
+            startDate = self.today - timedelta(days)
+            
+            d = {'datetime':{'$gte':startDate}}
+            try:
+                barData = self.mainEngine.dbQuery(dbName, collectionName, d, 'datetime')
+                
+                with self.barCacheLock:
+                    self.barCacheDict[key] = (time(), barData)
+                    
+                    # 超出缓存数量时，移除最久未使用的数据
+                    while len(self.barCacheDict) > self.barCacheSize:
+                        self.barCacheDict.popitem(last=False)
+            finally:
+                # 查询失败时也要移除锁，否则该key的锁会一直保留
+                with self.barCacheLock:
+                    self.barLoadLockDict.pop(key, None)
+        
+        return barData
+    
+    #----------------------------------------------------------------------
+    def getBarCache(self, key):
+        """获取缓存的Bar数据，不存在或者已过期则返回None"""
+        with self.barCacheLock:
+            if key not in self.barCacheDict:
+                return None
+            
+            loadTime, barData = self.barCacheDict.pop(key)
+            if time() - loadTime > self.barCacheExpire:
+                return None
+            
+            # 重新插入到末尾，标记为最近使用
+            self.barCacheDict[key] = (loadTime, barData)
+            return barData
+    
     #----------------------------------------------------------------------
     def loadTick(self, dbName, collectionName, days):
         """从数据库中读取Tick数据，startDate是datetime对象"""
@@ -411,6 +550,10 @@ class CtaEngine(object):
                 self.tickStrategyDict[strategy.vtSymbol] = l
             l.append(strategy)
             
+            # 分配策略运行的工作线程
+            if self.scheduler:
+                self.scheduler.getWorker(strategy)
+            
             # 订阅合约
             contract = self.mainEngine.getContract(strategy.vtSymbol)
             if contract:
@@ -477,8 +620,19 @@ class CtaEngine(object):
     #----------------------------------------------------------------------
     def initAll(self):
         """全部初始化"""
-        for name in self.strategyDict.keys():
-            self.initStrategy(name)    
+        nameList = self.strategyDict.keys()
+        
+        # 启用调度器时，策略的初始化已经在各自的工作线程中执行
+        if self.scheduler or not nameList:
+            for name in nameList:
+                self.initStrategy(name)
+            return
+        
+        # 否则使用线程池并发初始化，历史数据的读取可以同时进行
+        pool = ThreadPool(min(self.initPoolSize, len(nameList)))
+        pool.map(self.initStrategy, nameList)
+        pool.close()
+        pool.join()
             
     #----------------------------------------------------------------------
     def startAll(self):
@@ -556,7 +710,17 @@ class CtaEngine(object):
         
     #----------------------------------------------------------------------
     def callStrategyFunc(self, strategy, func, params=None):
-        """调用策略的函数，若触发异常则捕捉"""
+        """调用策略的函数，启用调度器时放入策略对应的工作线程中执行"""
+        if self.scheduler:
+            self.scheduler.put(strategy, func, params)
+        else:
+            self.runStrategyFunc(strategy, func, params)
+            
+    #----------------------------------------------------------------------
+    def runStrategyFunc(self, strategy, func, params=None):
+        """执行策略的函数，若触发异常则捕捉"""
+        traced = latencyTracer.enterStrategy(params)
+        
         try:
             if params:
                 func(params)
@@ -572,6 +736,14 @@ class CtaEngine(object):
                                 traceback.format_exc()])
             self.writeCtaLog(content)
             
+        if traced:
+            latencyTracer.exitStrategy(strategy.name)
+            
+    #----------------------------------------------------------------------
+    def dumpLatency(self):
+        """输出各策略的行情到委托延时统计"""
+        self.writeCtaLog(latencyTracer.dump())
+            
     #----------------------------------------------------------------------
     def savePosition(self):
         """保存所有策略的持仓情况到数据库"""
@@ -612,7 +784,8 @@ class CtaEngine(object):
     #----------------------------------------------------------------------
     def stop(self):
         """停止"""
-        pass
+        if self.scheduler:
+            self.scheduler.stop()
 
 
 ########################################################################
@@ -0,0 +1,171 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了回测历史数据的列式缓存，用于多进程优化时在进程间共享历史数据。
+
+1. 主进程从MongoDB读取一次数据，按字段保存为numpy的.npy文件
+2. 各个优化进程以只读的内存映射方式打开文件，操作系统在进程间共享同一份页缓存
+3. 回放时按块把列数据转换为字典，和从MongoDB游标中读出的数据格式一致
+'''
+
+import os
+import json
+from datetime import datetime
+
+import numpy as np
+
+
+CACHE_META_FILE = 'meta.json'   # 缓存描述文件名
+CHUNK_SIZE = 10000              # 回放时每次转换的数据数量
+
+
+#----------------------------------------------------------------------
+def getColumnDtype(values):
+    """根据字段的全部数据确定列的类型，无法确定的返回object"""
+    typeSet = set([type(v) for v in values])
+
+    if typeSet <= set([int, long]):
+        return np.int64
+    if typeSet <= set([int, long, float]):
+        return np.float64
+    if typeSet == set([datetime]):
+        return 'datetime64[us]'
+    if typeSet == set([unicode]):
+        return np.unicode_
+    if typeSet == set([str]):
+        return np.string_
+    return object
+
+
+#----------------------------------------------------------------------
+def saveHistoryCache(path, initData, backtestData):
+    """
+    保存历史数据到缓存目录
+    initData和backtestData为MongoDB读出的数据字典列表
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    dataList = list(initData) + list(backtestData)
+
+    # 所有数据中出现过的字段（数据库主键不需要保存）
+    fieldSet = set()
+    for d in dataList:
+        fieldSet.update(d.keys())
+    fieldSet.discard('_id')
+
+    objectFieldList = []
+    for field in fieldSet:
+        values = [d.get(field, None) for d in dataList]
+        dtype = getColumnDtype(values)
+
+        if dtype is object:
+            objectFieldList.append(field)
+
+            # 逐个赋值，避免numpy把list等类型的数据展开为多维数组
+            array = np.empty(len(values), dtype=object)
+            for i, v in enumerate(values):
+                array[i] = v
+        else:
+            array = np.array(values, dtype=dtype)
+
+        np.save(os.path.join(path, field + '.npy'), array)
+
+    meta = {'fieldList': sorted(fieldSet),
+            'objectFieldList': objectFieldList,         # 无法内存映射的字段
+            'initCount': len(initData),
+            'count': len(dataList)}
+
+    with open(os.path.join(path, CACHE_META_FILE), 'w') as f:
+        json.dump(meta, f)
+
+
+########################################################################
+class HistoryCache(object):
+    """只读的历史数据缓存"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, path):
+        """Constructor"""
+        self.path = path
+
+        with open(os.path.join(path, CACHE_META_FILE)) as f:
+            meta = json.load(f)
+
+        self.initCount = meta['initCount']
+        self.count = meta['count']
+
+        # 字段名和列数据的字典
+        self.columnDict = {}
+        for field in meta['fieldList']:
+            fileName = os.path.join(path, field + '.npy')
+            if field in meta['objectFieldList']:
+                self.columnDict[str(field)] = np.load(fileName, allow_pickle=True)
+            else:
+                self.columnDict[str(field)] = np.load(fileName, mmap_mode='r')
+
+        self.fieldList = self.columnDict.keys()     # 数据行中的字段顺序
+
+    #----------------------------------------------------------------------
+    def iterRows(self, start, end):
+        """按顺序返回[start, end)范围内的数据行元组，元组中字段的顺序和fieldList一致"""
+        for chunkStart in range(start, end, CHUNK_SIZE):
+            chunkEnd = min(chunkStart + CHUNK_SIZE, end)
+
+            columnList = [self.columnDict[field][chunkStart:chunkEnd].tolist()
+                          for field in self.fieldList]
+
+            for row in zip(*columnList):
+                yield row
+
+    #----------------------------------------------------------------------
+    def iterData(self, start, end):
+        """按顺序返回[start, end)范围内的数据字典"""
+        fieldList = self.fieldList
+        for row in self.iterRows(start, end):
+            yield dict(zip(fieldList, row))
+
+    #----------------------------------------------------------------------
+    def getInitData(self):
+        """获取初始化用的数据字典列表"""
+        return list(self.iterData(0, self.initCount))
+
+    #----------------------------------------------------------------------
+    def iterBacktestData(self, endDate=None):
+        """获取回测用数据字典的迭代器，endDate为结束时间（包含），为空则返回全部数据"""
+        return self.iterData(self.initCount, self.getEndIndex(endDate))
+
+    #----------------------------------------------------------------------
+    def getIndex(self, dt, side='left'):
+        """
+        获取时间在数据中的位置，side为left时返回第一个不早于dt的数据位置，为right时返回第一个晚于dt的数据位置
+        没有时间字段时返回None
+        """
+        column = self.columnDict.get('datetime', None)
+        if column is None or column.dtype.kind != 'M':
+            return None
+
+        return int(np.searchsorted(column, np.datetime64(dt, 'us'), side=side))
+
+    #----------------------------------------------------------------------
+    def getEndIndex(self, endDate):
+        """获取结束时间对应的数据位置（不包含）"""
+        column = self.columnDict.get('datetime', None)
+        if not endDate or column is None or column.dtype.kind != 'M':
+            return self.count
+
+        # 数据按时间排序保存，可以直接二分查找
+        n = np.searchsorted(column[self.initCount:], np.datetime64(endDate, 'us'), side='right')
+        return self.initCount + int(n)
+
+    #----------------------------------------------------------------------
+    def getLastDatetime(self):
+        """获取最后一个数据的时间"""
+        if not self.count:
+            return None
+        return self.columnDict['datetime'][self.count-1:].tolist()[0]
+
+    #----------------------------------------------------------------------
+    def getBacktestCount(self):
+        """回测用数据的数量"""
+        return self.count - self.initCount
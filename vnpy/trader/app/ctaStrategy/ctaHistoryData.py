@@ -10,14 +10,16 @@
 from datetime import datetime, timedelta
 from time import time
 from multiprocessing.pool import ThreadPool
+import _strptime     # datetime.strptime首次调用时才载入该模块，多线程同时首次调用会出错，这里提前载入
 
 import pymongo
 
-from vnpy.data.datayes import DatayesApi
+from vnpy.data.datayes import DatayesApi, DATAYES_DOMAIN
 from vnpy.trader.vtGlobal import globalSetting
 from vnpy.trader.vtConstant import *
 from vnpy.trader.vtObject import VtBarData
-from .ctaBase import SETTING_DB_NAME, TICK_DB_NAME, MINUTE_DB_NAME
+from .ctaBase import SETTING_DB_NAME, TICK_DB_NAME, MINUTE_DB_NAME, DAILY_DB_NAME
+from .ctaBulkLoader import loadCsv, bulkUpsert
 
 
 # 以下为vn.trader和通联数据规定的交易所代码映射 
@@ -34,10 +36,15 @@ class HistoryDataEngine(object):
     """CTA模块用的历史数据引擎"""
 
     #----------------------------------------------------------------------
-    def __init__(self, token):
-        """Constructor"""
+    def __init__(self, token, domain=DATAYES_DOMAIN, poolSize=10):
+        """
+        Constructor
+        domain：通联数据的主域名（测试时可以指向本地的服务器）
+        poolSize：同时下载的线程数量，也是HTTP连接池的大小
+        """
         self.dbClient = pymongo.MongoClient(globalSetting['mongoHost'], globalSetting['mongoPort'])
-        self.datayesClient = DatayesApi(token)
+        self.datayesClient = DatayesApi(token, domain, poolSize=poolSize)
+        self.poolSize = poolSize
         
     #----------------------------------------------------------------------
     def lastTradeDate(self):
@@ -95,20 +102,42 @@ class HistoryDataEngine(object):
             print u'期货合约代码下载失败'
         
     #----------------------------------------------------------------------
-    def downloadFuturesDailyBar(self, symbol):
+    def getStartDate(self, dbName, symbol):
         """
-        下载期货合约的日行情，symbol是合约代码，
-        若最后四位为0000（如IF0000），代表下载连续合约。
+        查询数据库中已有数据的最后日期，返回增量下载的开始日期（最后日期的下一天）
+        没有数据时返回空字符串，即下载全部历史数据
         """
-        print u'开始下载%s日行情' %symbol
-        
-        # 查询数据库中已有数据的最后日期
-        cl = self.dbClient[DAILY_DB_NAME][symbol]
-        cx = cl.find(sort=[('datetime', pymongo.DESCENDING)])
-        if cx.count():
-            last = cx[0]
-        else:
-            last = ''
+        d = self.dbClient[dbName][symbol].find_one(sort=[('datetime', pymongo.DESCENDING)],
+                                                   projection={'datetime': True})
+        if not d:
+            return ''
+        return (d['datetime'] + timedelta(1)).strftime('%Y%m%d')
+    
+    #----------------------------------------------------------------------
+    def createDailyBar(self, symbol, d):
+        """把通联数据的日行情转换为K线数据字典"""
+        bar = VtBarData()
+        bar.vtSymbol = symbol
+        bar.symbol = symbol
+        bar.exchange = DATAYES_TO_VT_EXCHANGE.get(d.get('exchangeCD', ''), '')
+        bar.open = d.get('openPrice', 0)
+        bar.high = d.get('highestPrice', 0)
+        bar.low = d.get('lowestPrice', 0)
+        bar.close = d.get('closePrice', 0)
+        bar.date = d.get('tradeDate', '').replace('-', '')
+        bar.time = ''
+        bar.datetime = datetime.strptime(bar.date, '%Y%m%d')
+        bar.volume = d.get('turnoverVol', 0)
+        bar.openInterest = d.get('openInt', 0)
+        return bar.__dict__
+    
+    #----------------------------------------------------------------------
+    def updateFuturesDailyBar(self, symbol):
+        """增量下载期货合约的日行情并批量写入数据库，返回新增的数据数量，下载失败或者没有数据时返回None"""
+        # 只下载数据库中最后日期之后的数据
+        startDate = self.getStartDate(DAILY_DB_NAME, symbol)
+        if startDate and startDate > self.lastTradeDate():
+            return 0
         
         # 主力合约
         if '0000' in symbol:
@@ -117,49 +146,70 @@ class HistoryDataEngine(object):
             params = {}
             params['contractObject'] = symbol.replace('0000', '')
             params['mainCon'] = 1
-            if last:
-                params['startDate'] = last['date']
         # 交易合约
         else:
             path = 'api/market/getMktFutd.json'
             
             params = {}
             params['ticker'] = symbol
-            if last:
-                params['startDate'] = last['date']
+        
+        if startDate:
+            params['startDate'] = startDate
         
         # 开始下载数据
         data = self.datayesClient.downloadData(path, params)
+        if not data:
+            return None
         
-        if data:
-            # 创建datetime索引
-            self.dbClient[DAILY_DB_NAME][symbol].ensure_index([('datetime', pymongo.ASCENDING)], 
-                                                                      unique=True)                
-
-            for d in data:
-                bar = VtBarData()
-                bar.vtSymbol = symbol
-                bar.symbol = symbol
-                try:
-                    bar.exchange = DATAYES_TO_VT_EXCHANGE.get(d.get('exchangeCD', ''), '')
-                    bar.open = d.get('openPrice', 0)
-                    bar.high = d.get('highestPrice', 0)
-                    bar.low = d.get('lowestPrice', 0)
-                    bar.close = d.get('closePrice', 0)
-                    bar.date = d.get('tradeDate', '').replace('-', '')
-                    bar.time = ''
-                    bar.datetime = datetime.strptime(bar.date, '%Y%m%d')
-                    bar.volume = d.get('turnoverVol', 0)
-                    bar.openInterest = d.get('openInt', 0)
-                except KeyError:
-                    print d
-                
-                flt = {'datetime': bar.datetime}
-                self.dbClient[DAILY_DB_NAME][symbol].update_one(flt, {'$set':bar.__dict__}, upsert=True)            
-            
-                print u'%s下载完成' %symbol
+        barList = [self.createDailyBar(symbol, d) for d in data]
+        bulkUpsert(self.dbClient[DAILY_DB_NAME][symbol], barList)
+        return len(barList)
+    
+    #----------------------------------------------------------------------
+    def downloadFuturesDailyBar(self, symbol):
+        """
+        下载期货合约的日行情，symbol是合约代码，
+        若最后四位为0000（如IF0000），代表下载连续合约。
+        """
+        print u'开始下载%s日行情' %symbol
+        
+        count = self.updateFuturesDailyBar(symbol)
+        if count is None:
+            print u'找不到合约%s或者没有新数据' %symbol
         else:
-            print u'找不到合约%s' %symbol
+            print u'%s下载完成，新增数据：%s' %(symbol, count)
+            
+    #----------------------------------------------------------------------
+    def downloadConcurrently(self, func, symbolList):
+        """
+        使用线程池同时下载多个代码的数据，func为单个代码的增量下载函数（返回新增数据数量）
+        下载主要是等待HTTP请求，线程之间共享数据库连接和HTTP连接池
+        返回代码和新增数据数量的字典（下载失败的为None）
+        """
+        def task(symbol):
+            try:
+                return symbol, func(symbol), ''
+            except Exception as e:
+                return symbol, None, repr(e)
+        
+        resultDict = {}
+        pool = ThreadPool(min(self.poolSize, max(len(symbolList), 1)))
+        try:
+            for n, result in enumerate(pool.imap_unordered(task, symbolList)):
+                symbol, count, error = result
+                resultDict[symbol] = count
+                
+                if error:
+                    print u'[%s/%s] %s下载失败：%s' %(n+1, len(symbolList), symbol, error)
+                elif count is None:
+                    print u'[%s/%s] 找不到合约%s或者没有新数据' %(n+1, len(symbolList), symbol)
+                else:
+                    print u'[%s/%s] %s下载完成，新增数据：%s' %(n+1, len(symbolList), symbol, count)
+        finally:
+            pool.close()
+            pool.join()
+        
+        return resultDict
             
     #----------------------------------------------------------------------
     def downloadAllFuturesDailyBar(self):
@@ -171,17 +221,12 @@ class HistoryDataEngine(object):
         
         print u'代码列表读取成功，产品代码：%s' %productSymbolSet
         
-        # 这里也测试了线程池，但可能由于下载函数中涉及较多的数据格
-        # 式转换，CPU开销较大，多线程效率并无显著改变。
-        #p = ThreadPool(10)
-        #p.map(self.downloadFuturesDailyBar, productSymbolSet)
-        #p.close()
-        #p.join()
+        # 每个合约只下载数据库中最后日期之后的数据并批量写入，主要开销是等待HTTP请求，使用线程池同时下载
+        symbolList = [productSymbol+'0000' for productSymbol in sorted(productSymbolSet)]
+        resultDict = self.downloadConcurrently(self.updateFuturesDailyBar, symbolList)
         
-        for productSymbol in productSymbolSet:
-            self.downloadFuturesDailyBar(productSymbol+'0000')
-
-        print u'所有期货的主力合约日行情已经全部下载完成, 耗时%s秒' %(time()-start)
+        totalCount = sum([count for count in resultDict.values() if count])
+        print u'所有期货的主力合约日行情已经全部下载完成, 新增数据%s, 耗时%s秒' %(totalCount, time()-start)
         
     #----------------------------------------------------------------------
     def downloadFuturesIntradayBar(self, symbol):
@@ -200,10 +245,7 @@ class HistoryDataEngine(object):
         if data:
             today = datetime.now().strftime('%Y%m%d')
             
-            # 创建datetime索引
-            self.dbClient[MINUTE_DB_NAME][symbol].ensure_index([('datetime', pymongo.ASCENDING)], 
-                                                                      unique=True)                
-
+            barList = []
             for d in data:
                 bar = VtBarData()
                 bar.vtSymbol = symbol
@@ -222,8 +264,10 @@ class HistoryDataEngine(object):
                 except KeyError:
                     print d
                 
-                flt = {'datetime': bar.datetime}
-                self.dbClient[MINUTE_DB_NAME][symbol].update_one(flt, {'$set':bar.__dict__}, upsert=True)            
+                barList.append(bar.__dict__)
+            
+            # 批量写入（同时创建datetime索引）
+            bulkUpsert(self.dbClient[MINUTE_DB_NAME][symbol], barList)
             
             print u'%s下载完成' %symbol
         else:
@@ -259,58 +303,58 @@ class HistoryDataEngine(object):
             print u'股票代码下载失败'
         
     #----------------------------------------------------------------------
-    def downloadEquityDailyBar(self, symbol):
-        """
-        下载股票的日行情，symbol是股票代码
-        """
-        print u'开始下载%s日行情' %symbol
+    def readEquitySymbol(self):
+        """查询所有股票代码"""
+        cx = self.dbClient[SETTING_DB_NAME]['EquitySymbol'].find()
+        return [d['symbol'] for d in cx]
         
-        # 查询数据库中已有数据的最后日期
-        cl = self.dbClient[DAILY_DB_NAME][symbol]
-        cx = cl.find(sort=[('datetime', pymongo.DESCENDING)])
-        if cx.count():
-            last = cx[0]
-        else:
-            last = ''
+    #----------------------------------------------------------------------
+    def updateEquityDailyBar(self, symbol):
+        """增量下载股票的日行情并批量写入数据库，返回新增的数据数量，下载失败或者没有数据时返回None"""
+        # 只下载数据库中最后日期之后的数据
+        startDate = self.getStartDate(DAILY_DB_NAME, symbol)
+        if startDate and startDate > self.lastTradeDate():
+            return 0
         
-        # 开始下载数据
         path = 'api/market/getMktEqud.json'
             
         params = {}
         params['ticker'] = symbol
-        if last:
-            params['beginDate'] = last['date']
+        if startDate:
+            params['beginDate'] = startDate
         
         data = self.datayesClient.downloadData(path, params)
+        if not data:
+            return None
         
-        if data:
-            # 创建datetime索引
-            self.dbClient[DAILY_DB_NAME][symbol].ensure_index([('datetime', pymongo.ASCENDING)], 
-                                                                unique=True)                
-
-            for d in data:
-                bar = VtBarData()
-                bar.vtSymbol = symbol
-                bar.symbol = symbol
-                try:
-                    bar.exchange = DATAYES_TO_VT_EXCHANGE.get(d.get('exchangeCD', ''), '')
-                    bar.open = d.get('openPrice', 0)
-                    bar.high = d.get('highestPrice', 0)
-                    bar.low = d.get('lowestPrice', 0)
-                    bar.close = d.get('closePrice', 0)
-                    bar.date = d.get('tradeDate', '').replace('-', '')
-                    bar.time = ''
-                    bar.datetime = datetime.strptime(bar.date, '%Y%m%d')
-                    bar.volume = d.get('turnoverVol', 0)
-                except KeyError:
-                    print d
-                
-                flt = {'datetime': bar.datetime}
-                self.dbClient[DAILY_DB_NAME][symbol].update_one(flt, {'$set':bar.__dict__}, upsert=True)            
-            
-            print u'%s下载完成' %symbol
+        barList = [self.createDailyBar(symbol, d) for d in data]
+        bulkUpsert(self.dbClient[DAILY_DB_NAME][symbol], barList)
+        return len(barList)
+        
+    #----------------------------------------------------------------------
+    def downloadEquityDailyBar(self, symbol):
+        """
+        下载股票的日行情，symbol是股票代码
+        """
+        print u'开始下载%s日行情' %symbol
+        
+        count = self.updateEquityDailyBar(symbol)
+        if count is None:
+            print u'找不到合约%s或者没有新数据' %symbol
         else:
-            print u'找不到合约%s' %symbol    
+            print u'%s下载完成，新增数据：%s' %(symbol, count)
+            
+    #----------------------------------------------------------------------
+    def downloadAllEquityDailyBar(self):
+        """下载所有股票的日行情"""
+        start = time()
+        print u'开始下载所有股票的日行情'
+        
+        symbolList = sorted(self.readEquitySymbol())
+        resultDict = self.downloadConcurrently(self.updateEquityDailyBar, symbolList)
+        
+        totalCount = sum([count for count in resultDict.values() if count])
+        print u'所有股票的日行情已经全部下载完成, 新增数据%s, 耗时%s秒' %(totalCount, time()-start)
 
 #----------------------------------------------------------------------
 def downloadEquityDailyBarts(self, symbol):
@@ -364,71 +408,20 @@ def downloadEquityDailyBarts(self, symbol):
 
 #----------------------------------------------------------------------
 def loadMcCsv(fileName, dbName, symbol):
-    """将Multicharts导出的csv格式的历史数据插入到Mongo数据库中"""
-    import csv
-    
+    """将Multicharts导出的csv格式的历史数据插入到Mongo数据库中（多个文件使用ctaBulkLoader.loadCsvFiles）"""
     start = time()
     print u'开始读取CSV文件%s中的数据插入到%s的%s中' %(fileName, dbName, symbol)
     
-    # 锁定集合，并创建索引
-    client = pymongo.MongoClient(globalSetting['mongoHost'], globalSetting['mongoPort']) 
-    collection = client[dbName][symbol]
-    collection.ensure_index([('datetime', pymongo.ASCENDING)], unique=True)   
-    
-    # 读取数据和插入到数据库
-    reader = csv.DictReader(file(fileName, 'r'))
-    for d in reader:
-        bar = VtBarData()
-        bar.vtSymbol = symbol
-        bar.symbol = symbol
-        bar.open = float(d['Open'])
-        bar.high = float(d['High'])
-        bar.low = float(d['Low'])
-        bar.close = float(d['Close'])
-        bar.date = datetime.strptime(d['Date'], '%Y-%m-%d').strftime('%Y%m%d')
-        bar.time = d['Time']
-        bar.datetime = datetime.strptime(bar.date + ' ' + bar.time, '%Y%m%d %H:%M:%S')
-        bar.volume = d['TotalVolume']
-
-        flt = {'datetime': bar.datetime}
-        collection.update_one(flt, {'$set':bar.__dict__}, upsert=True)  
-        print bar.date, bar.time
-    
-    print u'插入完毕，耗时：%s' % (time()-start)
+    count = loadCsv([fileName], symbol, 'mc', dbName)
+    print u'插入完毕，数据量：%s，耗时：%s' %(count, time()-start)
 
 #----------------------------------------------------------------------
 def loadTdxCsv(fileName, dbName, symbol):
     """将通达信导出的csv格式的历史分钟数据插入到Mongo数据库中"""
-    import csv
-    
     start = time()
     print u'开始读取CSV文件%s中的数据插入到%s的%s中' %(fileName, dbName, symbol)
     
-    # 锁定集合，并创建索引
-    client = pymongo.MongoClient(globalSetting['mongoHost'], globalSetting['mongoPort'])
-    collection = client[dbName][symbol]
-    collection.ensure_index([('datetime', pymongo.ASCENDING)], unique=True)   
-    
-    # 读取数据和插入到数据库
-    reader = csv.reader(file(fileName, 'r'))
-    for d in reader:
-        bar = VtBarData()
-        bar.vtSymbol = symbol
-        bar.symbol = symbol
-        bar.open = float(d[2])
-        bar.high = float(d[3])
-        bar.low = float(d[4])
-        bar.close = float(d[5])
-        bar.date = datetime.strptime(d[0], '%Y/%m/%d').strftime('%Y%m%d')
-        bar.time = d[1][:2]+':'+d[1][2:4]+':00'
-        bar.datetime = datetime.strptime(bar.date + ' ' + bar.time, '%Y%m%d %H:%M:%S')
-        bar.volume = d[6]
-        bar.openInterest = d[7]
-
-        flt = {'datetime': bar.datetime}
-        collection.update_one(flt, {'$set':bar.__dict__}, upsert=True)  
-        print bar.date, bar.time
-    
-    print u'插入完毕，耗时：%s' % (time()-start)
+    count = loadCsv([fileName], symbol, 'tdx', dbName)
+    print u'插入完毕，数据量：%s，耗时：%s' %(count, time()-start)
 
     
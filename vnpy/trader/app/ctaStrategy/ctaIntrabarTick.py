@@ -0,0 +1,152 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了K线回测时的K线内部tick数据，用于K线模式下按照真实的tick撮合委托。
+
+K线模式撮合时假设[最低价, 最高价]范围内的价格都可以成交，tick模式准确但是速度慢很多。
+混合模式下策略逻辑仍然基于K线运行，只有存在活动委托的K线才读取K线内部的tick进行撮合：
+1. tick数据按K线时间段从带有datetime索引的MongoDB集合，或者tick历史数据缓存（由tick模式的
+   createHistoryCache生成，各个优化进程通过内存映射共享）中读取
+2. 读取的tick只保留撮合需要的字段，保存为行元组，按K线时间在LRU缓存中保存，
+   多实例回测和同一进程中的重复回测可以直接使用
+'''
+
+from datetime import timedelta
+from collections import OrderedDict
+
+from vnpy.trader.vtGlobal import globalSetting
+from vnpy.trader.vtFunction import LazyModule
+
+from .ctaHistoryCache import HistoryCache
+from .ctaTickReplay import createTickViewClass
+
+
+pymongo = LazyModule('pymongo')
+
+# 撮合需要的tick字段，也是行元组中字段的顺序
+TICK_FIELD_LIST = ['datetime', 'lastPrice', 'bidPrice1', 'askPrice1']
+
+
+########################################################################
+class IntrabarTickStore(object):
+    """按K线读取和缓存K线内部的tick数据"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, dbName='', symbol='', cachePath='', barMinutes=1,
+                 closeLabel=False, cacheSize=10000):
+        """
+        Constructor
+        dbName, symbol：tick数据所在的数据库和集合
+        cachePath：tick历史数据缓存目录，设置后从缓存而不是数据库读取
+        barMinutes：K线周期分钟数
+        closeLabel：K线时间是否为收盘时间（如Multicharts导出的数据），默认为开盘时间
+        cacheSize：最多缓存的K线数量，为0时不缓存
+        """
+        self.dbName = dbName
+        self.symbol = symbol
+        self.cachePath = cachePath
+        self.barMinutes = barMinutes
+        self.closeLabel = closeLabel
+        self.cacheSize = cacheSize
+
+        self.barInterval = timedelta(minutes=barMinutes)
+
+        self.collection = None      # 数据库集合，首次读取时连接
+        self.historyCache = None    # tick历史数据缓存，首次读取时打开
+
+        self.rowDict = OrderedDict()    # K线时间和tick行元组列表的LRU缓存
+        self.loadCount = 0              # 从数据库或者缓存读取的次数
+        self.hitCount = 0               # 缓存命中的次数
+
+    #----------------------------------------------------------------------
+    def getSetting(self):
+        """
+        获取影响回测结果的设置（用于回测缓存和快照的匹配，以及在优化进程中重新创建）
+        缓存大小只影响内存占用，不包含在内
+        """
+        return {'dbName': self.dbName,
+                'symbol': self.symbol,
+                'cachePath': self.cachePath,
+                'barMinutes': self.barMinutes,
+                'closeLabel': self.closeLabel}
+
+    #----------------------------------------------------------------------
+    def createTickView(self):
+        """创建读取行元组的tick视图对象"""
+        return createTickViewClass(TICK_FIELD_LIST)()
+
+    #----------------------------------------------------------------------
+    def getTickRows(self, barDatetime):
+        """获取K线内部的tick行元组列表（按时间排序）"""
+        rowList = self.rowDict.pop(barDatetime, None)
+
+        if rowList is None:
+            rowList = self.loadTickRows(barDatetime)
+            self.loadCount += 1
+
+            # 缓存大小为0时不缓存
+            if self.cacheSize <= 0:
+                return rowList
+
+            if len(self.rowDict) >= self.cacheSize:
+                self.rowDict.popitem(last=False)
+        else:
+            self.hitCount += 1
+
+        # 重新插入到最后，作为最近使用的数据
+        self.rowDict[barDatetime] = rowList
+        return rowList
+
+    #----------------------------------------------------------------------
+    def loadTickRows(self, barDatetime):
+        """从数据库或者缓存读取K线内部的tick行元组列表"""
+        # 开盘时间标记的K线包含[start, end)范围内的tick，收盘时间标记的K线包含(start, end]
+        if self.closeLabel:
+            start, end = barDatetime - self.barInterval, barDatetime
+        else:
+            start, end = barDatetime, barDatetime + self.barInterval
+
+        if self.cachePath:
+            return self.loadFromCache(start, end)
+        return self.loadFromDb(start, end)
+
+    #----------------------------------------------------------------------
+    def loadFromDb(self, start, end):
+        """从数据库读取tick，依赖datetime字段上的索引"""
+        if self.collection is None:
+            dbClient = pymongo.MongoClient(globalSetting['mongoHost'], globalSetting['mongoPort'])
+            self.collection = dbClient[self.dbName][self.symbol]
+
+        if self.closeLabel:
+            flt = {'datetime': {'$gt': start, '$lte': end}}
+        else:
+            flt = {'datetime': {'$gte': start, '$lt': end}}
+
+        projection = dict([(field, True) for field in TICK_FIELD_LIST])
+        projection['_id'] = False
+
+        cursor = self.collection.find(flt, projection).sort('datetime')
+        return [tuple([d.get(field, 0) for field in TICK_FIELD_LIST]) for d in cursor]
+
+    #----------------------------------------------------------------------
+    def loadFromCache(self, start, end):
+        """从tick历史数据缓存读取tick，缓存数据按时间排序，直接二分查找位置"""
+        if self.historyCache is None:
+            self.historyCache = HistoryCache(self.cachePath)
+        cache = self.historyCache
+
+        side = 'right' if self.closeLabel else 'left'
+        startIndex = cache.getIndex(start, side)
+        endIndex = cache.getIndex(end, side)
+        if startIndex is None or startIndex >= endIndex:
+            return []
+
+        columnList = []
+        for field in TICK_FIELD_LIST:
+            column = cache.columnDict.get(field, None)
+            if column is None:
+                columnList.append([0] * (endIndex - startIndex))
+            else:
+                columnList.append(column[startIndex:endIndex].tolist())
+
+        return zip(*columnList)
@@ -0,0 +1,133 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了回测结果的蒙特卡洛分析，用于估计统计指标的置信区间。
+
+1. 交易顺序重排：随机打乱逐笔交易盈亏的顺序，得到最大回撤的分布（总盈亏和顺序无关）
+2. 分块自助法（circular block bootstrap）：按固定长度的连续区块有放回地重抽每日净盈亏，
+   保留了短期的自相关性，得到总收益率、最大回撤、夏普比率的分布
+
+重抽样按批次生成二维数组（数据长度 x 重抽样数量），统计指标用向量化计算，
+数量较多时各批次分配到多个进程中计算。每个批次使用独立的随机种子，结果和进程数量无关。
+'''
+
+from __future__ import division
+
+import multiprocessing
+
+import numpy as np
+
+from vnpy.trader.vtFunction import LazyModule
+
+from .ctaVectorBacktesting import calculateVectorStatistics
+
+
+pd = LazyModule('pandas')       # 只在计算分位数时使用，首次使用时才载入
+
+
+SHUFFLE_METRICS = ['maxDrawdown']
+BOOTSTRAP_METRICS = ['totalReturn', 'maxDrawdown', 'sharpeRatio']
+
+DEFAULT_PERCENTILES = [1, 5, 25, 50, 75, 95, 99]
+
+
+#----------------------------------------------------------------------
+def generateShuffle(pnl, count, rnd):
+    """生成count组交易顺序重排后的盈亏，返回二维数组（交易数量 x count）"""
+    matrix = np.empty((len(pnl), count))
+    for i in range(count):
+        matrix[:, i] = rnd.permutation(pnl)
+    return matrix
+
+
+#----------------------------------------------------------------------
+def generateBlockBootstrap(pnl, count, blockSize, rnd):
+    """生成count组循环分块重抽样的盈亏，返回二维数组（数据长度 x count）"""
+    n = len(pnl)
+    blockSize = max(1, min(blockSize, n))
+    blockCount = -(-n // blockSize)     # 向上取整
+
+    start = rnd.randint(0, n, size=(count, blockCount, 1))
+    index = (start + np.arange(blockSize)) % n
+    index = index.reshape(count, blockCount * blockSize)[:, :n]
+    return pnl[index].T
+
+
+#----------------------------------------------------------------------
+def resampleTask(args):
+    """计算一个批次的重抽样统计指标（多进程任务），返回{指标名: 数组}"""
+    method, pnl, count, blockSize, capital, seed, metricList = args
+    rnd = np.random.RandomState(seed)
+
+    if method == 'shuffle':
+        matrix = generateShuffle(pnl, count, rnd)
+    else:
+        matrix = generateBlockBootstrap(pnl, count, blockSize, rnd)
+
+    d = calculateVectorStatistics(matrix, capital)
+    return dict([(name, np.asarray(d[name], dtype=np.float64)) for name in metricList])
+
+
+#----------------------------------------------------------------------
+def runResample(method, pnl, count, capital, blockSize=1, seed=None,
+                processes=None, batchSize=1000):
+    """
+    运行重抽样
+    method：shuffle（交易顺序重排）或者bootstrap（分块自助法）
+    pnl：逐笔交易盈亏或者每日净盈亏
+    processes：进程数量，为None则使用CPU核数，为1或者只有一个批次时在当前进程中计算
+    返回{指标名: 长度为count的数组}
+    """
+    pnl = np.asarray(pnl, dtype=np.float64)
+    if not len(pnl) or count <= 0:
+        return {}
+
+    if method == 'shuffle':
+        metricList = SHUFFLE_METRICS
+    else:
+        metricList = BOOTSTRAP_METRICS
+
+    if seed is None:
+        seed = np.random.randint(0, 2**31 - 1)
+
+    taskList = []
+    for i, start in enumerate(range(0, count, batchSize)):
+        batchCount = min(batchSize, count - start)
+        taskList.append((method, pnl, batchCount, blockSize, capital, seed + i, metricList))
+
+    if processes == 1 or len(taskList) == 1:
+        resultList = [resampleTask(task) for task in taskList]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            resultList = pool.map(resampleTask, taskList)
+        finally:
+            pool.close()
+            pool.join()
+
+    return dict([(name, np.concatenate([result[name] for result in resultList]))
+                 for name in metricList])
+
+
+#----------------------------------------------------------------------
+def shuffleTrades(tradePnl, capital, count=10000, seed=None, processes=None, batchSize=1000):
+    """交易顺序重排，返回{指标名: 数组}"""
+    return runResample('shuffle', tradePnl, count, capital, 1, seed, processes, batchSize)
+
+
+#----------------------------------------------------------------------
+def bootstrapDaily(dailyPnl, capital, count=10000, blockSize=20, seed=None, processes=None,
+                   batchSize=1000):
+    """每日净盈亏的分块自助法重抽样，blockSize为区块的天数，返回{指标名: 数组}"""
+    return runResample('bootstrap', dailyPnl, count, capital, blockSize, seed, processes, batchSize)
+
+
+#----------------------------------------------------------------------
+def calculatePercentiles(distributionDict, percentiles=None):
+    """计算分布的分位数，返回DataFrame（行为分位数，列为指标名）"""
+    if percentiles is None:
+        percentiles = DEFAULT_PERCENTILES
+
+    data = dict([(name, np.percentile(values, percentiles))
+                 for name, values in distributionDict.items()])
+    return pd.DataFrame(data, index=percentiles, columns=sorted(data.keys()))
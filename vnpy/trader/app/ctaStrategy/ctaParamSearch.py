@@ -0,0 +1,163 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了参数优化的启发式搜索算法，用于参数组合数量过多、无法穷举回测的情况。
+
+回测引擎的runSearchOptimization接受任何提供search(optimizationSetting, evaluate)方法的对象，
+search返回全部数据回测过的[(setting, targetValue)]列表。
+
+所有算法都通过evaluate函数回测参数组合：
+evaluate(settingList, fraction=1.0)，返回[(setting, targetValue)]列表，
+fraction为使用的回测数据比例（从回测开始日期算起），由回测引擎在进程池中并行执行。
+'''
+
+from __future__ import division
+
+import random
+
+
+########################################################################
+class RandomSearch(object):
+    """随机搜索：从全部参数组合中随机抽取一部分回测"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, count, seed=None):
+        """Constructor"""
+        self.random = random.Random(seed)
+        self.count = count
+
+    #----------------------------------------------------------------------
+    def search(self, optimizationSetting, evaluate):
+        """搜索参数"""
+        settingList = optimizationSetting.generateRandomSetting(self.count, self.random)
+        return evaluate(settingList)
+
+
+########################################################################
+class GeneticSearch(object):
+    """
+    遗传算法：每个参数取值的序号作为基因
+    每代保留最优的个体，其余个体通过锦标赛选择、均匀交叉和变异产生
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, population=20, generations=10, mutationRate=0.1,
+                 eliteCount=2, tournamentSize=3, seed=None):
+        """Constructor"""
+        self.random = random.Random(seed)
+        self.population = population            # 每代个体数量
+        self.generations = generations          # 进化代数
+        self.mutationRate = mutationRate        # 每个基因的变异概率
+        self.eliteCount = eliteCount            # 每代直接保留的最优个体数量
+        self.tournamentSize = tournamentSize    # 锦标赛选择时参与比较的个体数量
+
+    #----------------------------------------------------------------------
+    def search(self, optimizationSetting, evaluate):
+        """搜索参数"""
+        sizeList = optimizationSetting.getParamSizeList()
+        gridSize = optimizationSetting.getGridSize()
+
+        # 已经回测过的个体，key为基因，value为(setting, targetValue)
+        resultDict = {}
+
+        # 初始种群
+        population = [self.randomGene(sizeList) for i in range(self.population)]
+
+        for generation in range(self.generations):
+            # 回测新出现的个体（同一代中的重复个体只回测一次）
+            newGeneList = list(set([gene for gene in population if gene not in resultDict]))
+            if newGeneList:
+                settingList = [optimizationSetting.getSettingByIndex(gene) for gene in newGeneList]
+                for gene, result in zip(newGeneList, self.evaluateOrdered(evaluate, settingList)):
+                    resultDict[gene] = result
+
+            # 已经回测了全部参数组合，不需要继续进化
+            if len(resultDict) >= gridSize:
+                break
+
+            # 按优化目标从大到小排序
+            ranked = sorted(set(population), key=lambda gene: resultDict[gene][1], reverse=True)
+
+            # 生成下一代
+            nextPopulation = ranked[:self.eliteCount]
+            while len(nextPopulation) < self.population:
+                parent1 = self.select(ranked, resultDict)
+                parent2 = self.select(ranked, resultDict)
+                child = self.crossover(parent1, parent2)
+                nextPopulation.append(self.mutate(child, sizeList))
+            population = nextPopulation
+
+        return resultDict.values()
+
+    #----------------------------------------------------------------------
+    def evaluateOrdered(self, evaluate, settingList):
+        """回测参数组合，结果按settingList的顺序返回（evaluate返回的结果是无序的）"""
+        resultList = evaluate(settingList)
+        resultDict = dict([(repr(sorted(setting.items())), (setting, targetValue))
+                           for setting, targetValue in resultList])
+        return [resultDict[repr(sorted(setting.items()))] for setting in settingList]
+
+    #----------------------------------------------------------------------
+    def randomGene(self, sizeList):
+        """随机生成基因"""
+        return tuple([self.random.randrange(size) for size in sizeList])
+
+    #----------------------------------------------------------------------
+    def select(self, ranked, resultDict):
+        """锦标赛选择"""
+        candidates = [self.random.choice(ranked) for i in range(self.tournamentSize)]
+        return max(candidates, key=lambda gene: resultDict[gene][1])
+
+    #----------------------------------------------------------------------
+    def crossover(self, parent1, parent2):
+        """均匀交叉"""
+        return tuple([self.random.choice(pair) for pair in zip(parent1, parent2)])
+
+    #----------------------------------------------------------------------
+    def mutate(self, gene, sizeList):
+        """变异"""
+        l = list(gene)
+        for i, size in enumerate(sizeList):
+            if self.random.random() < self.mutationRate:
+                l[i] = self.random.randrange(size)
+        return tuple(l)
+
+
+########################################################################
+class HalvingSearch(object):
+    """
+    逐次减半：随机抽取参数组合，先用较短的回测数据全部回测，
+    每轮只保留最优的1/eta进入下一轮，同时回测数据长度增加eta倍，最后一轮使用全部数据
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, count, eta=3, seed=None):
+        """Constructor"""
+        self.random = random.Random(seed)
+        self.count = count      # 第一轮的参数组合数量
+        self.eta = eta          # 每轮的淘汰比例
+
+    #----------------------------------------------------------------------
+    def search(self, optimizationSetting, evaluate):
+        """搜索参数"""
+        settingList = optimizationSetting.generateRandomSetting(self.count, self.random)
+
+        # 轮数使得最后一轮至少保留1个参数组合
+        rounds = 1
+        n = len(settingList)
+        while n >= self.eta:
+            n //= self.eta
+            rounds += 1
+
+        for i in range(rounds):
+            fraction = self.eta ** (i - rounds + 1)
+            resultList = evaluate(settingList, fraction)
+
+            if i == rounds - 1:
+                return resultList
+
+            resultList.sort(key=lambda result: result[1], reverse=True)
+            keepCount = max(1, len(resultList) // self.eta)
+            settingList = [setting for setting, targetValue in resultList[:keepCount]]
+
+        return []
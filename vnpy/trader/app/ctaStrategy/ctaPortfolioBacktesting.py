@@ -0,0 +1,294 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了多品种组合回测引擎。
+
+1. 每个品种的历史数据分块读取（数据库游标按块返回，或者从历史数据缓存中按块转换），
+   再通过堆进行多路归并，按时间顺序回放，内存占用只和品种数量、块大小有关
+2. 每个策略交易一个品种，使用独立的子回测引擎（即BacktestingEngine）撮合委托，
+   品种的合约大小、价格最小变动、手续费率、滑点分别设置
+3. 所有策略的按日盈亏汇总为组合的按日盈亏，统计指标的计算和单品种回测一致
+'''
+
+from __future__ import division
+
+import heapq
+from collections import OrderedDict
+
+from vnpy.trader.vtGlobal import globalSetting
+from vnpy.trader.vtFunction import LazyModule
+from vnpy.trader.vtObject import VtTickData, VtBarData
+
+from .ctaBacktesting import BacktestingEngine
+from .ctaHistoryCache import HistoryCache
+
+
+pymongo = LazyModule('pymongo')
+pd = LazyModule('pandas')
+
+CHUNK_SIZE = 10000      # 每个品种每次从数据库读取的数据数量
+
+
+#----------------------------------------------------------------------
+def mergeStreams(streamList):
+    """
+    多路归并多个按时间排序的数据字典迭代器
+    返回(品种序号, 数据字典)，时间相同时按品种序号排序
+    """
+    streamList = [iter(stream) for stream in streamList]
+
+    heap = []
+    for i, stream in enumerate(streamList):
+        for d in stream:
+            heap.append((d['datetime'], i, d))
+            break
+    heapq.heapify(heap)
+
+    while heap:
+        dt, i, d = heap[0]
+        yield i, d
+
+        for nextD in streamList[i]:
+            heapq.heapreplace(heap, (nextD['datetime'], i, nextD))
+            break
+        else:
+            heapq.heappop(heap)
+
+
+########################################################################
+class PortfolioBacktestingEngine(BacktestingEngine):
+    """
+    多品种组合回测引擎
+    回测的起止日期、回测模式、起始资金使用本引擎的设置
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        super(PortfolioBacktestingEngine, self).__init__()
+
+        self.chunkSize = CHUNK_SIZE
+
+        # 品种设置字典，key为品种代码，value为设置字典
+        self.symbolDict = OrderedDict()
+
+        # 策略子引擎字典，key为策略名称，value为子引擎
+        self.engineDict = OrderedDict()
+
+        # 品种和订阅该品种的子引擎列表的映射
+        self.symbolEngineDict = {}
+
+        self.streamList = []        # 每个品种的回测数据迭代器
+
+    #----------------------------------------------------------------------
+    def addSymbol(self, symbol, size=1, priceTick=0, rate=0, slippage=0,
+                  dbName='', historyCachePath=''):
+        """
+        添加回测品种
+        dbName：数据库名，为空则使用setDatabase中设置的数据库名
+        historyCachePath：历史数据缓存目录，设置后从缓存而不是数据库读取数据
+        """
+        self.symbolDict[symbol] = {
+            'size': size,
+            'priceTick': priceTick,
+            'rate': rate,
+            'slippage': slippage,
+            'dbName': dbName,
+            'historyCachePath': historyCachePath
+        }
+
+    #----------------------------------------------------------------------
+    def addStrategy(self, strategyClass, setting):
+        """添加策略，setting中的vtSymbol为交易的品种，name为策略名称"""
+        symbol = setting['vtSymbol']
+        if symbol not in self.symbolDict:
+            raise KeyError(u'品种%s尚未添加' %symbol)
+
+        d = self.symbolDict[symbol]
+
+        # 回测起止日期和回测模式在载入数据时才设置到子引擎（见applyEngineSetting），
+        # 添加策略后再修改本引擎的设置同样有效
+        engine = BacktestingEngine()
+        engine.setSize(d['size'])
+        engine.setPriceTick(d['priceTick'])
+        engine.setRate(d['rate'])
+        engine.setSlippage(d['slippage'])
+        engine.setDatabase(d['dbName'] or self.dbName, symbol)
+        engine.output = self.output
+
+        engine.strategy = strategyClass(engine, setting)
+        if not setting.get('name', None):
+            engine.strategy.name = strategyClass.className
+
+        name = engine.strategy.name
+        if name in self.engineDict:
+            raise KeyError(u'策略名称%s重复' %name)
+
+        self.engineDict[name] = engine
+        self.symbolEngineDict.setdefault(symbol, []).append(engine)
+
+        return engine.strategy
+
+    #----------------------------------------------------------------------
+    def applyEngineSetting(self):
+        """把本引擎的回测起止日期和回测模式设置到所有子引擎"""
+        for engine in self.engineDict.values():
+            engine.setBacktestingMode(self.mode)
+            engine.setStartDate(self.startDate, self.initDays)
+            engine.setEndDate(self.endDate)
+
+    #----------------------------------------------------------------------
+    def loadHistoryData(self):
+        """载入所有品种的初始化数据，并创建回测数据的分块迭代器"""
+        self.applyEngineSetting()
+
+        if self.mode == self.BAR_MODE:
+            dataClass = VtBarData
+        else:
+            dataClass = VtTickData
+
+        self.streamList = []
+
+        for symbol, d in self.symbolDict.items():
+            if d['historyCachePath']:
+                initData, stream = self.loadSymbolCache(d['historyCachePath'])
+            else:
+                initData, stream = self.loadSymbolData(d['dbName'] or self.dbName, symbol)
+
+            # 初始化数据推送给该品种的所有策略
+            initList = []
+            for data in initData:
+                obj = dataClass()
+                obj.__dict__ = data
+                initList.append(obj)
+
+            for engine in self.symbolEngineDict.get(symbol, []):
+                engine.initData = initList
+
+            self.streamList.append(stream)
+
+        self.output(u'载入完成，品种数量：%s' %len(self.streamList))
+
+    #----------------------------------------------------------------------
+    def loadSymbolCache(self, historyCachePath):
+        """
+        从历史数据缓存中读取品种的初始化数据列表，以及回测数据的迭代器
+        和BacktestingEngine.loadHistoryCache一样按回测日期截取，和从数据库读取的时间范围一致
+        """
+        cache = HistoryCache(historyCachePath)
+
+        initStart = cache.getIndex(self.dataStartDate)
+        if initStart is None:
+            initStart, start = 0, cache.initCount
+        else:
+            start = cache.getIndex(self.strategyStartDate)
+        end = max(start, cache.getEndIndex(self.dataEndDate))
+
+        return list(cache.iterData(initStart, start)), cache.iterData(start, end)
+
+    #----------------------------------------------------------------------
+    def loadSymbolData(self, dbName, symbol):
+        """从数据库读取品种的初始化数据列表，以及回测数据的游标（按块读取）"""
+        if not self.dbClient:
+            self.dbClient = pymongo.MongoClient(globalSetting['mongoHost'], globalSetting['mongoPort'])
+        collection = self.dbClient[dbName][symbol]
+
+        flt = {'datetime':{'$gte':self.dataStartDate,
+                           '$lt':self.strategyStartDate}}
+        initData = list(collection.find(flt).sort('datetime'))
+
+        if not self.dataEndDate:
+            flt = {'datetime':{'$gte':self.strategyStartDate}}
+        else:
+            flt = {'datetime':{'$gte':self.strategyStartDate,
+                               '$lte':self.dataEndDate}}
+        cursor = collection.find(flt).sort('datetime').batch_size(self.chunkSize)
+
+        return initData, cursor
+
+    #----------------------------------------------------------------------
+    def runBacktesting(self):
+        """运行回测"""
+        self.loadHistoryData()
+
+        self.output(u'开始回测')
+
+        for engine in self.engineDict.values():
+            engine.strategy.inited = True
+            engine.strategy.onInit()
+        self.output(u'策略初始化完成')
+
+        for engine in self.engineDict.values():
+            engine.strategy.trading = True
+            engine.strategy.onStart()
+        self.output(u'策略启动完成')
+
+        self.output(u'开始回放数据')
+
+        if self.mode == self.BAR_MODE:
+            dataClass = VtBarData
+        else:
+            dataClass = VtTickData
+
+        # 每个品种推送数据的函数列表
+        funcList = []
+        for symbol in self.symbolDict.keys():
+            engineList = self.symbolEngineDict.get(symbol, [])
+            if self.mode == self.BAR_MODE:
+                funcList.append([engine.newBar for engine in engineList])
+            else:
+                funcList.append([engine.newTick for engine in engineList])
+
+        for i, d in mergeStreams(self.streamList):
+            data = dataClass()
+            data.__dict__ = d
+            self.dt = data.datetime
+
+            for func in funcList[i]:
+                func(data)
+
+        self.output(u'数据回放结束')
+
+    #----------------------------------------------------------------------
+    def getStrategyEngine(self, name):
+        """获取策略的子引擎，可以用于查看单个策略的成交和回测结果"""
+        return self.engineDict[name]
+
+    #----------------------------------------------------------------------
+    def calculateDailyResult(self):
+        """计算组合按日统计的交易结果（各个策略按日结果的汇总）"""
+        self.output(u'计算组合按日统计结果')
+
+        columnList = ['tradeCount', 'turnover', 'commission', 'slippage',
+                      'tradingPnl', 'positionPnl', 'totalPnl', 'netPnl']
+
+        resultDf = None
+        for engine in self.engineDict.values():
+            if not engine.dailyResultDict:
+                continue
+
+            df = engine.calculateDailyResult()[columnList]
+            if resultDf is None:
+                resultDf = df
+            else:
+                resultDf = resultDf.add(df, fill_value=0)
+
+        # 没有任何策略的按日结果时返回空的DataFrame
+        if resultDf is None:
+            resultDf = pd.DataFrame(columns=columnList)
+            resultDf.index.name = 'date'
+
+        return resultDf
+
+    #----------------------------------------------------------------------
+    def calculateStrategyResult(self):
+        """计算每个策略的逐笔回测结果，返回字典，key为策略名称"""
+        return OrderedDict([(name, engine.calculateBacktestingResult())
+                            for name, engine in self.engineDict.items()])
+
+    #----------------------------------------------------------------------
+    def clearBacktestingResult(self):
+        """清空之前回测的结果"""
+        for engine in self.engineDict.values():
+            engine.clearBacktestingResult()
+            engine.dailyResultDict.clear()
@@ -0,0 +1,222 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了回测结果的硬盘缓存，用于重复的回测（如重新绘图、在优化中增加一个参数取值后再次优化）。
+
+1. 缓存的key为以下内容的哈希值：策略类及其父类所在文件的源代码、回测引擎的源代码、策略参数、
+   回测数据范围和模式、成本参数（滑点、手续费率、合约大小、价格最小变动）
+2. 每个key对应一个JSON文件，保存回测结果中的统计指标字典
+3. 文件数量超过上限时，按最近使用时间删除最旧的文件
+'''
+
+import os
+import sys
+import json
+import hashlib
+import inspect
+from datetime import datetime
+
+from vnpy.trader.vtFunction import getTempPath
+
+
+CACHE_DIR_NAME = 'BacktestResultCache'      # 默认缓存目录名
+
+
+#----------------------------------------------------------------------
+def getSourceHash(cls):
+    """计算类及其父类所在文件源代码的哈希值，无法获取源代码时返回空字符串"""
+    sha = hashlib.sha1()
+
+    for c in inspect.getmro(cls):
+        if c is object:
+            continue
+
+        module = sys.modules.get(c.__module__, None)
+        try:
+            fileName = inspect.getsourcefile(module)
+            with open(fileName, 'rb') as f:
+                sha.update(f.read())
+        except (TypeError, IOError):
+            return ''
+
+    return sha.hexdigest()
+
+
+########################################################################
+class BacktestResultCache(object):
+    """回测结果缓存"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, path='', maxSize=10000):
+        """
+        Constructor
+        path：缓存目录，为空则使用temp目录下的默认目录
+        maxSize：最多缓存的回测结果数量
+        """
+        if not path:
+            path = getTempPath(CACHE_DIR_NAME)
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        self.path = path
+        self.maxSize = maxSize
+
+        self.sourceHashDict = {}        # 类和源代码哈希值的缓存
+
+        self.count = len(self.getFileList())
+        self.hitCount = 0
+        self.missCount = 0
+
+    #----------------------------------------------------------------------
+    def getKey(self, engine, strategyClass, setting, endDate=None):
+        """
+        生成回测的缓存key，无法获取策略源代码时返回None（不使用缓存）
+        endDate：回测结束日期，为None则使用引擎的设置
+        """
+        if strategyClass not in self.sourceHashDict:
+            strategyHash = getSourceHash(strategyClass)
+            engineHash = getSourceHash(engine.__class__)
+            if strategyHash and engineHash:
+                self.sourceHashDict[strategyClass] = strategyHash + engineHash
+            else:
+                self.sourceHashDict[strategyClass] = ''
+
+        sourceHash = self.sourceHashDict[strategyClass]
+        if not sourceHash:
+            return None
+
+        if endDate is None:
+            endDate = engine.endDate
+
+        # 不设置结束日期时数据会随时间增加，当天内的结果才有效
+        if not endDate:
+            endDate = 'today' + datetime.now().strftime('%Y%m%d')
+
+        content = {
+            'source': sourceHash,
+            'className': strategyClass.__name__,
+            'setting': setting,
+            'mode': engine.mode,
+            'startDate': engine.startDate,
+            'initDays': engine.initDays,
+            'endDate': endDate,
+            'dbName': engine.dbName,
+            'symbol': engine.symbol,
+            'slippage': engine.slippage,
+            'rate': engine.rate,
+            'size': engine.size,
+            'priceTick': engine.priceTick
+        }
+
+        # 使用K线内部tick撮合时结果不同，没有设置时保持原有的key不变
+        intrabarSetting = engine.getIntrabarSetting()
+        if intrabarSetting:
+            content['intrabarTick'] = intrabarSetting
+
+        try:
+            s = json.dumps(content, sort_keys=True)
+        except (TypeError, ValueError):
+            return None
+        return hashlib.sha1(s).hexdigest()
+
+    #----------------------------------------------------------------------
+    def getFileName(self, key):
+        """缓存文件路径"""
+        return os.path.join(self.path, key + '.json')
+
+    #----------------------------------------------------------------------
+    def get(self, key):
+        """读取缓存的结果字典，不存在则返回None"""
+        if not key:
+            return None
+
+        fileName = self.getFileName(key)
+        try:
+            with open(fileName) as f:
+                d = json.load(f)
+        except (IOError, ValueError):
+            self.missCount += 1
+            return None
+
+        # 更新文件时间，用于按最近使用时间删除
+        try:
+            os.utime(fileName, None)
+        except OSError:
+            pass
+
+        self.hitCount += 1
+        return d
+
+    #----------------------------------------------------------------------
+    def getTarget(self, key, targetName):
+        """读取缓存的优化目标值，不存在则返回None"""
+        d = self.get(key)
+        if d is None or targetName not in d:
+            return None
+        return d[targetName]
+
+    #----------------------------------------------------------------------
+    def put(self, key, result):
+        """保存结果字典（只保存其中的数值），和已经缓存的结果合并"""
+        if not key:
+            return
+
+        fileName = self.getFileName(key)
+
+        d = {}
+        if os.path.exists(fileName):
+            try:
+                with open(fileName) as f:
+                    d = json.load(f)
+            except (IOError, ValueError):
+                d = {}
+        else:
+            self.count += 1
+
+        for k, v in result.items():
+            if isinstance(v, (int, long, float)):
+                d[k] = float(v)
+
+        # 先写入临时文件再替换，避免中断时留下不完整的文件
+        tempFileName = fileName + '.tmp'
+        with open(tempFileName, 'w') as f:
+            json.dump(d, f)
+        if os.path.exists(fileName):
+            os.remove(fileName)
+        os.rename(tempFileName, fileName)
+
+        if self.count > self.maxSize:
+            self.evict()
+
+    #----------------------------------------------------------------------
+    def getFileList(self):
+        """所有缓存文件名"""
+        return [name for name in os.listdir(self.path) if name.endswith('.json')]
+
+    #----------------------------------------------------------------------
+    def evict(self):
+        """删除最久未使用的结果，一次删除到上限的90%，避免每次保存都要扫描目录"""
+        fileList = []
+        for name in self.getFileList():
+            fileName = os.path.join(self.path, name)
+            try:
+                fileList.append((os.path.getmtime(fileName), fileName))
+            except OSError:
+                pass
+        fileList.sort()
+
+        removeCount = len(fileList) - int(self.maxSize * 0.9)
+        for mtime, fileName in fileList[:max(removeCount, 0)]:
+            try:
+                os.remove(fileName)
+            except OSError:
+                pass
+
+        self.count = len(self.getFileList())
+
+    #----------------------------------------------------------------------
+    def clear(self):
+        """清空缓存"""
+        for name in self.getFileList():
+            os.remove(os.path.join(self.path, name))
+        self.count = 0
@@ -0,0 +1,108 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了CTA策略的调度器，用于把策略的回调函数从事件引擎线程中移出执行。
+
+1. 每个策略固定分配到一个工作线程，同一策略的回调函数按推送顺序依次执行
+2. 不同工作线程之间并行执行，计算量大的策略不会阻塞其他策略和事件引擎
+3. 策略在工作线程中调用的sendOrder等函数仍然通过CtaEngine发出，由引擎负责加锁
+'''
+
+from Queue import Queue, Empty
+from threading import Thread
+
+
+########################################################################
+class StrategyWorker(object):
+    """策略工作线程"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, ctaEngine, name):
+        """Constructor"""
+        self.ctaEngine = ctaEngine
+        self.name = name
+
+        self.queue = Queue()                            # 待执行的回调函数队列
+        self.active = False                             # 工作状态
+        self.thread = Thread(target=self.run, name=name)
+        self.thread.daemon = True
+
+        self.strategyCount = 0                          # 分配到本线程的策略数量
+
+    #----------------------------------------------------------------------
+    def start(self):
+        """启动"""
+        self.active = True
+        self.thread.start()
+
+    #----------------------------------------------------------------------
+    def stop(self):
+        """停止，已经放入队列的回调函数不再执行"""
+        self.active = False
+        self.thread.join()
+
+    #----------------------------------------------------------------------
+    def put(self, strategy, func, params):
+        """放入待执行的回调函数"""
+        self.queue.put((strategy, func, params))
+
+    #----------------------------------------------------------------------
+    def run(self):
+        """线程运行"""
+        while self.active:
+            try:
+                strategy, func, params = self.queue.get(block=True, timeout=1)
+                self.ctaEngine.runStrategyFunc(strategy, func, params)
+            except Empty:
+                pass
+
+
+########################################################################
+class StrategyScheduler(object):
+    """策略调度器"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, ctaEngine, workerCount):
+        """Constructor"""
+        self.ctaEngine = ctaEngine
+
+        self.workerList = [StrategyWorker(ctaEngine, 'CtaWorker%s' %i)
+                           for i in range(workerCount)]
+
+        # 策略和工作线程的映射关系
+        # key为策略名称，value为StrategyWorker对象
+        self.workerDict = {}
+
+    #----------------------------------------------------------------------
+    def start(self):
+        """启动全部工作线程"""
+        for worker in self.workerList:
+            worker.start()
+
+    #----------------------------------------------------------------------
+    def stop(self):
+        """停止全部工作线程"""
+        for worker in self.workerList:
+            worker.stop()
+
+    #----------------------------------------------------------------------
+    def getWorker(self, strategy):
+        """获取策略对应的工作线程，首次调用时分配到策略最少的线程"""
+        worker = self.workerDict.get(strategy.name, None)
+
+        if not worker:
+            worker = min(self.workerList, key=lambda w: w.strategyCount)
+            worker.strategyCount += 1
+            self.workerDict[strategy.name] = worker
+
+        return worker
+
+    #----------------------------------------------------------------------
+    def put(self, strategy, func, params=None):
+        """把策略的回调函数放入对应工作线程的队列"""
+        self.getWorker(strategy).put(strategy, func, params)
+
+    #----------------------------------------------------------------------
+    def getQueueSize(self):
+        """获取每个工作线程中等待执行的回调数量，用于监控策略是否处理不及"""
+        return dict([(worker.name, worker.queue.qsize()) for worker in self.workerList])
@@ -0,0 +1,79 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了回测快照的保存和读取，用于长时间回测的断点恢复。
+
+快照为压缩后的pickle数据，包含格式版本号，版本不一致的快照不会被读取。
+'''
+
+import os
+import zlib
+import types
+import cPickle
+from cStringIO import StringIO
+
+
+SNAPSHOT_VERSION = 2        # 快照格式版本，快照内容变化时需要增加
+
+
+#----------------------------------------------------------------------
+def persistentMethodId(obj):
+    """
+    绑定方法的序列化（策略中的K线合成器等对象经常保存策略的回调函数）
+    只在快照的Pickler中使用，不影响进程中其他地方的pickle
+    """
+    if isinstance(obj, types.MethodType) and obj.im_self is not None:
+        return ('method', obj.im_self, obj.im_func.__name__)
+    return None
+
+
+#----------------------------------------------------------------------
+def persistentLoad(pid):
+    """绑定方法的反序列化"""
+    tag, obj, name = pid
+    if tag != 'method':
+        raise cPickle.UnpicklingError(u'无法识别的持久化编号：%s' %tag)
+    return getattr(obj, name)
+
+
+#----------------------------------------------------------------------
+def saveSnapshot(fileName, state):
+    """保存快照，state为状态字典"""
+    state = dict(state)
+    state['version'] = SNAPSHOT_VERSION
+
+    buf = StringIO()
+    pickler = cPickle.Pickler(buf, cPickle.HIGHEST_PROTOCOL)
+    pickler.inst_persistent_id = persistentMethodId
+    pickler.dump(state)
+    data = zlib.compress(buf.getvalue())
+
+    # 先写入临时文件再替换，避免中断时损坏上一个快照
+    tempFileName = fileName + '.tmp'
+    with open(tempFileName, 'wb') as f:
+        f.write(data)
+    if os.path.exists(fileName):
+        os.remove(fileName)
+    os.rename(tempFileName, fileName)
+
+    return len(data)
+
+
+#----------------------------------------------------------------------
+def loadSnapshot(fileName):
+    """读取快照，文件不存在、损坏或者版本不一致时返回None"""
+    if not os.path.exists(fileName):
+        return None
+
+    try:
+        with open(fileName, 'rb') as f:
+            unpickler = cPickle.Unpickler(StringIO(zlib.decompress(f.read())))
+            unpickler.persistent_load = persistentLoad
+            state = unpickler.load()
+    except Exception:
+        return None
+
+    if not isinstance(state, dict) or state.get('version', None) != SNAPSHOT_VERSION:
+        return None
+
+    return state
@@ -0,0 +1,76 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了tick回测的快速回放：回放时复用同一个tick视图对象，不为每个tick创建新的VtTickData。
+
+1. 从历史数据缓存回放时，数据按块从列式缓存转换为行元组，视图只更新指向的行，
+   字段值在策略访问时才从行元组中读取
+2. 从MongoDB回放时，视图直接使用游标返回的数据字典作为属性字典
+
+由于推送给策略的始终是同一个对象，策略如果需要保存历史tick（如放入列表），
+必须调用tick.copy()获取独立的VtTickData对象（实盘中的VtTickData同样提供copy，代码可以通用）。
+只保存最新tick（如self.lastTick = tick）的策略不需要修改。
+'''
+
+from vnpy.trader.vtObject import VtTickData
+
+
+########################################################################
+class TickView(VtTickData):
+    """基于行元组的复用tick视图，字段属性由createTickViewClass生成"""
+
+    fieldList = []      # 行元组中的字段顺序
+
+    #----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self._row = ()          # 当前指向的行元组（不调用父类构造函数，字段值都从行中读取）
+
+    #----------------------------------------------------------------------
+    def copy(self):
+        """复制为独立的VtTickData对象"""
+        tick = VtTickData.__new__(VtTickData)
+        tick.__dict__ = dict(zip(self.fieldList, self._row))
+        tick.__dict__.update(self.__dict__)
+        del tick.__dict__['_row']
+        return tick
+
+
+#----------------------------------------------------------------------
+def createFieldProperty(index):
+    """生成读写行元组中第index个字段的属性"""
+    def getter(self):
+        return self._row[index]
+
+    def setter(self, value):
+        row = list(self._row)
+        row[index] = value
+        self._row = tuple(row)
+
+    return property(getter, setter)
+
+
+#----------------------------------------------------------------------
+def createTickViewClass(fieldList):
+    """根据行元组的字段列表生成TickView的子类"""
+    d = {'fieldList': list(fieldList)}
+    for index, field in enumerate(fieldList):
+        d[field] = createFieldProperty(index)
+    return type('TickView', (TickView,), d)
+
+
+########################################################################
+class DictTickView(VtTickData):
+    """基于数据字典的复用tick视图，每次推送时替换属性字典"""
+
+    #----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        pass
+
+    #----------------------------------------------------------------------
+    def copy(self):
+        """复制为独立的VtTickData对象"""
+        tick = VtTickData.__new__(VtTickData)
+        tick.__dict__ = self.__dict__.copy()
+        return tick
@@ -0,0 +1,220 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了向量化的信号回测，用于快速筛选大量简单的信号规则（均线交叉、通道突破等）。
+
+和逐K线的事件驱动回测不同，这里不模拟委托撮合，而是直接根据目标仓位计算成交：
+1. 第i根K线收盘后的目标仓位为position[i]（策略在onBar中发出委托）
+2. 在第i+1根K线开盘时按开盘价成交到目标仓位（对应事件驱动回测中限价单在下一根K线撮合）
+3. 按日汇总盈亏，计算方法和DailyResult.calculatePnl一致
+
+仓位数组可以是二维的（K线数量 x 信号数量），此时一次计算所有信号的结果。
+'''
+
+from __future__ import division
+
+import numpy as np
+
+from vnpy.trader.vtFunction import LazyModule
+
+from .ctaHistoryCache import HistoryCache
+
+
+pd = LazyModule('pandas')       # 只在生成按日结果时使用，首次使用时才载入
+
+
+########################################################################
+class BarFrame(object):
+    """列式保存的K线数据"""
+
+    fieldList = ['open', 'high', 'low', 'close', 'volume']
+
+    #----------------------------------------------------------------------
+    def __init__(self, datetime, open, high, low, close, volume=None):
+        """Constructor"""
+        self.datetime = np.asarray(datetime, dtype='datetime64[us]')
+        self.open = np.asarray(open, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.low = np.asarray(low, dtype=np.float64)
+        self.close = np.asarray(close, dtype=np.float64)
+
+        if volume is None:
+            volume = np.zeros(len(self.close))
+        self.volume = np.asarray(volume, dtype=np.float64)
+
+        # 按日分组的位置，首次使用时计算
+        self.dayStartIndex = None
+
+    #----------------------------------------------------------------------
+    @classmethod
+    def fromDataList(cls, dataList):
+        """从数据字典或者VtBarData对象的列表创建"""
+        if dataList and not isinstance(dataList[0], dict):
+            dataList = [data.__dict__ for data in dataList]
+
+        columnDict = {}
+        for field in ['datetime'] + cls.fieldList:
+            columnDict[field] = [d.get(field, 0) for d in dataList]
+
+        return cls(**columnDict)
+
+    #----------------------------------------------------------------------
+    @classmethod
+    def fromHistoryCache(cls, path, endDate=None):
+        """从历史数据缓存中读取回测用的数据（不包括初始化数据）"""
+        cache = HistoryCache(path)
+        start = cache.initCount
+        end = cache.getEndIndex(endDate)
+
+        columnDict = {}
+        for field in ['datetime'] + cls.fieldList:
+            column = cache.columnDict.get(field, None)
+            if column is not None:
+                columnDict[field] = column[start:end]
+
+        return cls(**columnDict)
+
+    #----------------------------------------------------------------------
+    def __len__(self):
+        """K线数量"""
+        return len(self.close)
+
+    #----------------------------------------------------------------------
+    def getDate(self):
+        """每根K线的日期"""
+        return self.datetime.astype('datetime64[D]')
+
+    #----------------------------------------------------------------------
+    def getDayStartIndex(self):
+        """每个交易日第一根K线的位置"""
+        if self.dayStartIndex is None:
+            date = self.getDate()
+            self.dayStartIndex = np.concatenate([[0], np.flatnonzero(date[1:] != date[:-1]) + 1])
+        return self.dayStartIndex
+
+
+#----------------------------------------------------------------------
+def calculateVectorPnl(barFrame, position, size=1, rate=0, slippage=0):
+    """
+    计算按日统计的盈亏
+    position：目标仓位数组，一维（K线数量）或者二维（K线数量 x 信号数量）
+    返回字典，每个值为按日统计的数组（行为交易日，二维时列为信号）
+    """
+    position = np.asarray(position, dtype=np.float64)
+    n = len(barFrame)
+    if position.shape[0] != n:
+        raise ValueError(u'仓位数组长度%s和K线数量%s不一致' %(position.shape[0], n))
+
+    # 每根K线开盘成交后的持仓，即上一根K线的目标仓位
+    holding = np.zeros_like(position)
+    holding[1:] = position[:-1]
+
+    # 每根K线开盘时的成交数量（+/-代表方向）
+    volume = np.zeros_like(position)
+    volume[0] = holding[0]
+    volume[1:] = holding[1:] - holding[:-1]
+
+    # 二维仓位时价格需要按列广播
+    openPrice = barFrame.open
+    if position.ndim == 2:
+        openPrice = openPrice[:, np.newaxis]
+
+    startIndex = barFrame.getDayStartIndex()
+    endIndex = np.append(startIndex[1:], n) - 1
+
+    closePrice = barFrame.close[endIndex]
+    previousClose = np.zeros_like(closePrice)
+    previousClose[1:] = closePrice[:-1]
+
+    closePosition = holding[endIndex]
+    openPosition = np.zeros_like(closePosition)
+    openPosition[1:] = closePosition[:-1]
+
+    # 按日汇总成交
+    absVolume = np.abs(volume)
+    dailyVolume = np.add.reduceat(volume, startIndex, axis=0)
+    dailyCost = np.add.reduceat(volume * openPrice, startIndex, axis=0)
+    dailyTurnover = np.add.reduceat(absVolume * openPrice, startIndex, axis=0) * size
+    dailyTradeCount = np.add.reduceat((volume != 0).astype(np.int64), startIndex, axis=0)
+    dailyAbsVolume = np.add.reduceat(absVolume, startIndex, axis=0)
+
+    if position.ndim == 2:
+        closePriceColumn = closePrice[:, np.newaxis]
+        previousCloseColumn = previousClose[:, np.newaxis]
+    else:
+        closePriceColumn = closePrice
+        previousCloseColumn = previousClose
+
+    positionPnl = openPosition * (closePriceColumn - previousCloseColumn) * size
+    tradingPnl = (dailyVolume * closePriceColumn - dailyCost) * size
+    totalPnl = tradingPnl + positionPnl
+    commission = dailyTurnover * rate
+    slippageCost = dailyAbsVolume * size * slippage
+
+    d = {}
+    d['date'] = barFrame.getDate()[startIndex]
+    d['closePrice'] = closePrice
+    d['previousClose'] = previousClose
+    d['tradeCount'] = dailyTradeCount
+    d['openPosition'] = openPosition
+    d['closePosition'] = closePosition
+    d['tradingPnl'] = tradingPnl
+    d['positionPnl'] = positionPnl
+    d['totalPnl'] = totalPnl
+    d['turnover'] = dailyTurnover
+    d['commission'] = commission
+    d['slippage'] = slippageCost
+    d['netPnl'] = totalPnl - commission - slippageCost
+    return d
+
+
+#----------------------------------------------------------------------
+def calculateVectorResult(barFrame, position, size=1, rate=0, slippage=0):
+    """计算单个信号按日统计的结果，返回和BacktestingEngine.calculateDailyResult格式一致的DataFrame"""
+    d = calculateVectorPnl(barFrame, position, size, rate, slippage)
+
+    date = [dt.date() for dt in d.pop('date').astype('datetime64[us]').tolist()]
+    df = pd.DataFrame(d, index=pd.Index(date, name='date'))
+    return df
+
+
+#----------------------------------------------------------------------
+def calculateVectorStatistics(netPnl, capital):
+    """
+    根据每日净盈亏计算统计指标，计算方法和BacktestingEngine.calculateDailyStatistics一致
+    netPnl为二维数组时（交易日数量 x 信号数量），返回的每个指标为各个信号的数组
+    """
+    netPnl = np.asarray(netPnl, dtype=np.float64)
+    totalDays = netPnl.shape[0]
+
+    balance = np.cumsum(netPnl, axis=0) + capital
+    highlevel = np.maximum.accumulate(balance, axis=0)
+    drawdown = balance - highlevel
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        logBalance = np.log(balance)
+    dailyLogReturn = np.zeros_like(balance)
+    dailyLogReturn[1:] = logBalance[1:] - logBalance[:-1]
+
+    totalNetPnl = netPnl.sum(axis=0)
+    endBalance = balance[-1]
+
+    # 和pandas的mean、std一致：忽略nan，标准差使用样本标准差
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dailyReturn = np.nanmean(dailyLogReturn, axis=0) * 100
+        returnStd = np.nanstd(dailyLogReturn, axis=0, ddof=1) * 100
+        sharpeRatio = np.where(returnStd > 0, dailyReturn / returnStd * np.sqrt(240), 0)
+
+    d = {}
+    d['totalDays'] = totalDays
+    d['profitDays'] = (netPnl > 0).sum(axis=0)
+    d['lossDays'] = (netPnl < 0).sum(axis=0)
+    d['endBalance'] = endBalance
+    d['maxDrawdown'] = drawdown.min(axis=0)
+    d['totalNetPnl'] = totalNetPnl
+    d['dailyNetPnl'] = totalNetPnl / totalDays
+    d['totalReturn'] = (endBalance / capital - 1) * 100
+    d['dailyReturn'] = dailyReturn
+    d['returnStd'] = returnStd
+    d['sharpeRatio'] = sharpeRatio
+    return d
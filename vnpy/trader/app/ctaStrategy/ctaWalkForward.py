@@ -0,0 +1,180 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了滚动优化（Walk-Forward Analysis）。
+
+1. 把回测时间段划分为滚动的样本内、样本外窗口，每次向前滚动一个样本外窗口的长度
+2. 在每个样本内窗口上多进程优化参数，选出优化目标最优的参数
+3. 使用选出的参数回测紧接着的样本外窗口
+4. 把所有样本外窗口的按日结果拼接为一条连续的资金曲线，计算统计指标
+
+历史数据只从数据库读取一次保存为缓存，所有窗口的优化和回测都从同一个缓存中截取数据。
+'''
+
+from __future__ import division
+
+import shutil
+from datetime import timedelta
+
+from vnpy.trader.vtFunction import LazyModule
+
+from .ctaBacktesting import BacktestingEngine, getSettingKey
+from .ctaHistoryCache import HistoryCache
+
+
+pd = LazyModule('pandas')
+
+
+########################################################################
+class WalkForwardEngine(object):
+    """滚动优化引擎"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, engine, inSampleDays, outSampleDays):
+        """
+        Constructor
+        engine：设置好回测模式、起止日期、产品参数、数据库的回测引擎
+        inSampleDays：样本内窗口的天数（自然日）
+        outSampleDays：样本外窗口的天数（自然日），也是每次滚动的天数
+        """
+        self.engine = engine
+        self.inSampleDays = inSampleDays
+        self.outSampleDays = outSampleDays
+
+        self.windowList = []        # 每个窗口的结果字典列表
+
+    #----------------------------------------------------------------------
+    def output(self, content):
+        """输出内容"""
+        self.engine.output(content)
+
+    #----------------------------------------------------------------------
+    def generateWindows(self, endDate):
+        """生成[(样本内开始日期, 样本内结束日期, 样本外结束日期)]列表，日期均包含在窗口内"""
+        windowList = []
+
+        start = self.engine.strategyStartDate.replace(hour=0, minute=0, second=0, microsecond=0)
+        while True:
+            inSampleEnd = start + timedelta(self.inSampleDays - 1)
+            outSampleStart = inSampleEnd + timedelta(1)
+            if outSampleStart > endDate:
+                break
+
+            outSampleEnd = min(outSampleStart + timedelta(self.outSampleDays - 1), endDate)
+            windowList.append((start, inSampleEnd, outSampleEnd))
+
+            start += timedelta(self.outSampleDays)
+
+        return windowList
+
+    #----------------------------------------------------------------------
+    def createWindowEngine(self, startDate, endDate, historyCachePath):
+        """创建回测[startDate, endDate]时间段的引擎，初始化数据使用startDate之前的initDays天"""
+        engine = self.engine
+        initDays = engine.initDays
+
+        windowEngine = BacktestingEngine()
+        windowEngine.setBacktestingMode(engine.mode)
+        windowEngine.setStartDate((startDate - timedelta(initDays)).strftime('%Y%m%d'), initDays)
+        windowEngine.setEndDate(endDate.strftime('%Y%m%d'))
+        windowEngine.setCapital(engine.capital)
+        windowEngine.setSlippage(engine.slippage)
+        windowEngine.setRate(engine.rate)
+        windowEngine.setSize(engine.size)
+        windowEngine.setPriceTick(engine.priceTick)
+        windowEngine.setDatabase(engine.dbName, engine.symbol)
+        windowEngine.setHistoryCache(historyCachePath)
+        windowEngine.output = engine.output
+        return windowEngine
+
+    #----------------------------------------------------------------------
+    def runWalkForward(self, strategyClass, optimizationSetting):
+        """
+        运行滚动优化
+        返回拼接后的样本外按日结果DataFrame和统计结果字典
+        """
+        engine = self.engine
+
+        # 历史数据只读取一次
+        historyCachePath = engine.historyCachePath
+        if not historyCachePath:
+            historyCachePath = engine.createHistoryCache()
+
+        try:
+            endDate = engine.dataEndDate
+            if not endDate:
+                endDate = HistoryCache(historyCachePath).getLastDatetime()
+            endDate = endDate.replace(hour=0, minute=0, second=0, microsecond=0)
+
+            # 用于从优化结果的key找回参数字典
+            settingDict = dict([(getSettingKey(setting), setting)
+                                for setting in optimizationSetting.generateSetting()])
+
+            self.windowList = []
+            dfList = []
+
+            for inSampleStart, inSampleEnd, outSampleEnd in self.generateWindows(endDate):
+                self.output('-' * 30)
+                self.output(u'样本内：%s - %s，样本外：%s - %s' %(inSampleStart.date(), inSampleEnd.date(),
+                                                        (inSampleEnd + timedelta(1)).date(),
+                                                        outSampleEnd.date()))
+
+                # 样本内优化
+                inSampleEngine = self.createWindowEngine(inSampleStart, inSampleEnd, historyCachePath)
+                resultDict = inSampleEngine.calculateParallelOptimization(strategyClass, optimizationSetting)
+                if not resultDict:
+                    continue
+                key = max(resultDict, key=lambda k: resultDict[k][1])
+                settingStr, inSampleTarget = resultDict[key]
+                setting = settingDict[key]
+
+                # 样本外回测
+                outSampleEngine = self.createWindowEngine(inSampleEnd + timedelta(1), outSampleEnd,
+                                                          historyCachePath)
+                outSampleEngine.initStrategy(strategyClass, setting)
+                outSampleEngine.runBacktesting()
+
+                if outSampleEngine.dailyResultDict:
+                    df = outSampleEngine.calculateDailyResult()
+                    dfList.append(df)
+                    outSamplePnl = df['netPnl'].sum()
+                else:
+                    outSamplePnl = 0
+
+                self.windowList.append({'inSampleStart': inSampleStart,
+                                        'inSampleEnd': inSampleEnd,
+                                        'outSampleEnd': outSampleEnd,
+                                        'setting': setting,
+                                        'inSampleTarget': inSampleTarget,
+                                        'outSamplePnl': outSamplePnl})
+
+                self.output(u'选出参数：%s，样本内%s：%s，样本外净盈亏：%s' %(settingStr,
+                                                               optimizationSetting.optimizeTarget,
+                                                               inSampleTarget, outSamplePnl))
+        finally:
+            # 删除本次生成的临时缓存
+            if historyCachePath != engine.historyCachePath:
+                shutil.rmtree(historyCachePath, ignore_errors=True)
+
+        if not dfList:
+            self.output(u'无样本外结果')
+            return None, {}
+
+        # 拼接样本外结果，持仓在每个窗口结束时不会延续到下一个窗口
+        df = pd.concat(dfList)
+        return engine.calculateDailyStatistics(df)
+
+    #----------------------------------------------------------------------
+    def showWalkForwardResult(self, strategyClass, optimizationSetting):
+        """运行滚动优化并输出结果"""
+        df, d = self.runWalkForward(strategyClass, optimizationSetting)
+        if df is None:
+            return
+
+        self.output('-' * 30)
+        for window in self.windowList:
+            self.output(u'%s - %s\t%s\t%s' %(window['inSampleStart'].date(), window['outSampleEnd'].date(),
+                                             window['setting'], window['outSamplePnl']))
+
+        engine = self.engine
+        engine.showDailyResult(df)
@@ -0,0 +1,280 @@
+# encoding: UTF-8
+
+"""
+CTA回测引擎的性能测试
+
+用确定性的随机游走生成K线和tick数据，保存为历史数据缓存（不需要MongoDB），
+分别在K线和tick模式下回测自带的AtrRsi、KingKeltner、DualThrust、EmaDemo策略，统计：
+1. 每秒回放的数据数量
+2. 进程的内存峰值（每个测试在独立的子进程中运行）
+3. 计算回测结果（逐笔和按日）的耗时
+
+测试结果和保存的基准（ctaBacktestingBenchmark.json）比较，性能下降超过容忍比例的会被标出。
+
+运行方法：
+python ctaBacktestingBenchmark.py            运行测试并和基准比较
+python ctaBacktestingBenchmark.py --save     运行测试并保存为新的基准
+"""
+
+from __future__ import division
+
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+import argparse
+import multiprocessing
+from time import time
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:
+    resource = None     # Windows下没有resource模块，不统计内存
+
+# 把vnpy根目录加入搜索路径
+path = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.abspath(os.path.join(path, '..', '..', '..', '..', '..'))
+sys.path.append(rootPath)
+
+from vnpy.trader.app.ctaStrategy.ctaBacktesting import BacktestingEngine
+from vnpy.trader.app.ctaStrategy.ctaHistoryCache import saveHistoryCache, HistoryCache
+
+
+BASELINE_FILE = os.path.join(path, 'ctaBacktestingBenchmark.json')
+
+START_DATE = datetime(2017, 1, 3)
+
+# 日盘交易时段
+TRADING_SESSIONS = [((9, 0), (10, 15)),
+                    ((10, 30), (11, 30)),
+                    ((13, 30), (15, 0))]
+
+# 测试的策略：(模块名, 类名)
+STRATEGY_LIST = [('strategyAtrRsi', 'AtrRsiStrategy'),
+                 ('strategyKingKeltner', 'KkStrategy'),
+                 ('strategyDualThrust', 'DualThrustStrategy'),
+                 ('strategyEmaDemo', 'EmaDemoStrategy')]
+
+
+#----------------------------------------------------------------------
+def iterTradingTime(days, interval):
+    """按交易时段生成时间，interval为秒数"""
+    dt = START_DATE
+    for i in range(days):
+        # 跳过周末
+        while dt.weekday() >= 5:
+            dt += timedelta(days=1)
+
+        for (startHour, startMinute), (endHour, endMinute) in TRADING_SESSIONS:
+            t = dt.replace(hour=startHour, minute=startMinute)
+            end = dt.replace(hour=endHour, minute=endMinute)
+
+            while t < end:
+                yield t
+                t += timedelta(seconds=interval)
+
+        dt += timedelta(days=1)
+
+
+#----------------------------------------------------------------------
+def generateBars(days, seed=0):
+    """生成确定性的模拟1分钟K线数据字典"""
+    rnd = random.Random(seed)
+    price = 3000.0
+
+    dataList = []
+    for t in iterTradingTime(days, 60):
+        openPrice = price
+        highPrice = price
+        lowPrice = price
+        for i in range(4):
+            price += rnd.choice([-1, 0, 0, 1])
+            highPrice = max(highPrice, price)
+            lowPrice = min(lowPrice, price)
+
+        dataList.append({'symbol': 'RB', 'vtSymbol': 'RB', 'exchange': '',
+                         'open': openPrice, 'high': highPrice, 'low': lowPrice, 'close': price,
+                         'volume': rnd.randint(10, 1000), 'openInterest': 0,
+                         'datetime': t, 'date': t.strftime('%Y%m%d'), 'time': t.strftime('%H:%M:%S')})
+    return dataList
+
+
+#----------------------------------------------------------------------
+def generateTicks(days, interval=1, seed=0):
+    """生成确定性的模拟tick数据字典"""
+    rnd = random.Random(seed)
+    price = 3000.0
+    volume = 0
+
+    dataList = []
+    for t in iterTradingTime(days, interval):
+        price += rnd.choice([-1, 0, 0, 1])
+        volume += rnd.randint(1, 20)
+
+        dataList.append({'symbol': 'RB', 'vtSymbol': 'RB', 'exchange': '',
+                         'lastPrice': price, 'volume': volume, 'openInterest': 0,
+                         'bidPrice1': price - 1, 'askPrice1': price + 1,
+                         'bidVolume1': rnd.randint(1, 100), 'askVolume1': rnd.randint(1, 100),
+                         'upperLimit': 0.0, 'lowerLimit': 0.0,
+                         'datetime': t, 'date': t.strftime('%Y%m%d'), 'time': t.strftime('%H:%M:%S')})
+    return dataList
+
+
+#----------------------------------------------------------------------
+def getPeakMemory():
+    """进程的内存峰值（MB）"""
+    if not resource:
+        return 0
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss / 1024 / 1024     # Mac下单位为字节
+    return maxrss / 1024                # Linux下单位为KB
+
+
+#----------------------------------------------------------------------
+def runCase(args):
+    """在子进程中运行一个测试，返回结果字典"""
+    moduleName, className, mode, cachePath, initDays = args
+
+    module = __import__('vnpy.trader.app.ctaStrategy.strategy.' + moduleName, fromlist=[className])
+    strategyClass = getattr(module, className)
+
+    engine = BacktestingEngine()
+    engine.setBacktestingMode(mode)
+    engine.setStartDate(START_DATE.strftime('%Y%m%d'), initDays)
+    engine.setSlippage(1)
+    engine.setRate(1/10000)
+    engine.setSize(10)
+    engine.setPriceTick(1)
+    engine.setHistoryCache(cachePath)
+    engine.output = lambda content: None
+
+    engine.initStrategy(strategyClass, {'vtSymbol': 'RB'})
+
+    # 回放数据（包括读取缓存和策略初始化）
+    start = time()
+    engine.runBacktesting()
+    replayTime = time() - start
+
+    # 计算回测结果
+    start = time()
+    engine.calculateBacktestingResult()
+    if engine.dailyResultDict:
+        engine.calculateDailyResult()
+    resultTime = time() - start
+
+    # 回放的数据量（包括初始化数据）
+    count = HistoryCache(cachePath).count
+
+    return {'name': '%s.%s' %(className, mode),
+            'count': count,
+            'rate': count / replayTime,
+            'memory': getPeakMemory(),
+            'resultTime': resultTime,
+            'trades': len(engine.tradeDict)}
+
+
+#----------------------------------------------------------------------
+def runBenchmark(barDays, tickDays, tickInterval):
+    """运行全部测试，返回结果字典列表"""
+    tempPath = tempfile.mkdtemp(prefix='vnpyBenchmark')
+
+    try:
+        # K线模式前10天数据用于策略初始化，tick模式下策略用tick合成K线，不需要初始化数据
+        barPath = os.path.join(tempPath, 'bar')
+        saveHistoryCache(barPath, [], generateBars(barDays))
+
+        tickPath = os.path.join(tempPath, 'tick')
+        saveHistoryCache(tickPath, [], generateTicks(tickDays, tickInterval))
+
+        caseList = []
+        for moduleName, className in STRATEGY_LIST:
+            caseList.append((moduleName, className, BacktestingEngine.BAR_MODE, barPath, 10))
+            caseList.append((moduleName, className, BacktestingEngine.TICK_MODE, tickPath, 0))
+
+        # 每个测试使用独立的子进程，内存峰值互不影响
+        pool = multiprocessing.Pool(1, maxtasksperchild=1)
+        try:
+            resultList = pool.map(runCase, caseList, 1)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        shutil.rmtree(tempPath, ignore_errors=True)
+
+    return resultList
+
+
+#----------------------------------------------------------------------
+def compareBaseline(resultList, tolerance):
+    """和基准比较，输出结果，返回性能下降的测试数量"""
+    baselineDict = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baselineDict = json.load(f)
+
+    print u'%-28s%10s%14s%12s%12s  %s' %(u'测试', u'数据量', u'每秒数据', u'内存(MB)', u'结果(秒)', u'对比基准')
+
+    regressionCount = 0
+    for result in resultList:
+        baseline = baselineDict.get(result['name'], None)
+
+        noteList = []
+        if baseline:
+            if result['rate'] < baseline['rate'] * (1 - tolerance):
+                noteList.append(u'速度下降%.0f%%' %((1 - result['rate'] / baseline['rate']) * 100))
+            if baseline['memory'] and result['memory'] > baseline['memory'] * (1 + tolerance):
+                noteList.append(u'内存增加%.0f%%' %((result['memory'] / baseline['memory'] - 1) * 100))
+            if result['resultTime'] > baseline['resultTime'] * (1 + tolerance) + 0.01:
+                noteList.append(u'结果计算变慢%.0f%%' %((result['resultTime'] / baseline['resultTime'] - 1) * 100))
+
+            if noteList:
+                regressionCount += 1
+            else:
+                noteList.append(u'正常')
+        else:
+            noteList.append(u'无基准')
+
+        print u'%-28s%10d%14.0f%12.1f%12.3f  %s' %(result['name'], result['count'], result['rate'],
+                                                   result['memory'], result['resultTime'],
+                                                   u'，'.join(noteList))
+
+    return regressionCount
+
+
+#----------------------------------------------------------------------
+def saveBaseline(resultList):
+    """保存结果为新的基准"""
+    baselineDict = {}
+    for result in resultList:
+        baselineDict[result['name']] = {'rate': result['rate'],
+                                        'memory': result['memory'],
+                                        'resultTime': result['resultTime']}
+
+    with open(BASELINE_FILE, 'w') as f:
+        json.dump(baselineDict, f, indent=4, sort_keys=True)
+
+    print u'基准已保存：%s' %BASELINE_FILE
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=u'CTA回测引擎性能测试')
+    parser.add_argument('--barDays', type=int, default=250, help=u'K线数据的交易日数量')
+    parser.add_argument('--tickDays', type=int, default=20, help=u'tick数据的交易日数量')
+    parser.add_argument('--tickInterval', type=int, default=1, help=u'tick间隔秒数')
+    parser.add_argument('--tolerance', type=float, default=0.1, help=u'和基准比较的容忍比例')
+    parser.add_argument('--save', action='store_true', help=u'保存本次结果为新的基准')
+    args = parser.parse_args()
+
+    resultList = runBenchmark(args.barDays, args.tickDays, args.tickInterval)
+    regressionCount = compareBaseline(resultList, args.tolerance)
+
+    if args.save:
+        saveBaseline(resultList)
+    elif regressionCount:
+        print u'性能下降的测试数量：%s' %regressionCount
+        sys.exit(1)
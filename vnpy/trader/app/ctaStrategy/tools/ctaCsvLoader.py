@@ -0,0 +1,54 @@
+# encoding: UTF-8
+
+"""
+CSV历史数据批量导入工具
+
+多个文件并行导入到MongoDB，或者导入到本地的历史数据缓存目录（回测引擎通过setHistoryCache使用），
+代码默认为文件名（不含扩展名），也可以用 文件名:代码 的方式指定。
+
+运行方法：
+python ctaCsvLoader.py --type mc --db VnTrader_1Min_Db IF0000_1min.csv rb0000.csv:RB0000
+python ctaCsvLoader.py --type tdx --cache D:\\cache data\\*.csv
+"""
+
+import os
+import sys
+import glob
+import argparse
+
+
+# 把vnpy根目录加入搜索路径
+path = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.abspath(os.path.join(path, '..', '..', '..', '..', '..'))
+if rootPath not in sys.path:
+    sys.path.insert(0, rootPath)
+
+from vnpy.trader.app.ctaStrategy.ctaBase import MINUTE_DB_NAME
+from vnpy.trader.app.ctaStrategy.ctaBulkLoader import loadCsvFiles, READER_DICT
+
+
+#----------------------------------------------------------------------
+def parseFileList(argList):
+    """解析命令行中的文件参数，返回(文件名, 代码)的列表，支持通配符"""
+    fileList = []
+    for arg in argList:
+        # 冒号后为代码（Windows路径中盘符后的冒号除外）
+        name, sep, symbol = arg.rpartition(':')
+        if not sep or os.sep in symbol or '/' in symbol or len(name) <= 1:
+            name, symbol = arg, ''
+
+        for fileName in sorted(glob.glob(name)) or [name]:
+            fileList.append((fileName, symbol or os.path.splitext(os.path.basename(fileName))[0]))
+    return fileList
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=u'CSV历史数据批量导入')
+    parser.add_argument('file', nargs='+', help=u'CSV文件，可以使用通配符，文件名:代码 指定代码')
+    parser.add_argument('--type', choices=sorted(READER_DICT.keys()), default='mc', help=u'文件格式')
+    parser.add_argument('--db', default=MINUTE_DB_NAME, help=u'写入的数据库名')
+    parser.add_argument('--cache', default='', help=u'设置后写入该目录下的历史数据缓存，不写入数据库')
+    parser.add_argument('--processes', type=int, default=None, help=u'并行的进程数，默认为CPU核心数')
+    args = parser.parse_args()
+
+    loadCsvFiles(parseFileList(args.file), args.type, args.db, args.cache, args.processes)
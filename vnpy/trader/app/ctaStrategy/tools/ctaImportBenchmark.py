@@ -0,0 +1,114 @@
+# encoding: UTF-8
+
+"""
+回测模块的import耗时测试
+
+多进程优化时（特别是Windows下），每个子进程启动时都要重新import回测模块，
+这里在全新的子进程中多次import指定的模块，统计：
+1. import耗时（中位数和最小值）
+2. import后已经载入的重量级模块（绘图、数据库、界面等，应当在首次使用时才载入）
+3. 各个重量级模块单独import的耗时，即延迟载入后每个子进程节省的时间
+
+运行方法：
+python ctaImportBenchmark.py                                 测试回测模块
+python ctaImportBenchmark.py vnpy.trader.app.ctaStrategy.ctaBacktesting --repeat 10
+"""
+
+from __future__ import division
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+
+# 把vnpy根目录加入搜索路径（子进程通过PYTHONPATH继承）
+path = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.abspath(os.path.join(path, '..', '..', '..', '..', '..'))
+
+DEFAULT_MODULE_LIST = ['vnpy.trader.app.ctaStrategy.ctaBacktesting']
+
+# 不应在回测模块import时载入的重量级模块
+HEAVY_MODULE_LIST = ['matplotlib', 'seaborn', 'pandas', 'pymongo', 'qtpy', 'PyQt4', 'PyQt5']
+
+# 在子进程中运行的代码，输出JSON格式的结果
+IMPORT_CODE = '''
+import sys, json
+from time import time
+start = time()
+__import__(%r)
+cost = time() - start
+print(json.dumps({'time': cost, 'loaded': [name for name in %r if name in sys.modules]}))
+'''
+
+
+#----------------------------------------------------------------------
+def measureImport(moduleName, repeat):
+    """在全新的子进程中import模块repeat次，返回(耗时列表, 载入的重量级模块列表, 错误信息)"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([rootPath, env.get('PYTHONPATH', '')])
+    env.pop('PYTHONDONTWRITEBYTECODE', None)     # 使用字节码缓存，和实际运行时一致
+
+    code = IMPORT_CODE %(moduleName, HEAVY_MODULE_LIST)
+
+    timeList = []
+    loaded = []
+    for i in range(repeat):
+        process = subprocess.Popen([sys.executable, '-c', code], env=env,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        if process.returncode:
+            error = stderr.decode('utf-8', 'replace').strip().splitlines()[-1]
+            return [], [], error
+
+        result = json.loads(stdout.decode('utf-8').strip().splitlines()[-1])
+        timeList.append(result['time'])
+        loaded = result['loaded']
+
+    return timeList, loaded, ''
+
+
+#----------------------------------------------------------------------
+def getMedian(valueList):
+    """中位数"""
+    valueList = sorted(valueList)
+    n = len(valueList)
+    if n % 2:
+        return valueList[n // 2]
+    return (valueList[n // 2 - 1] + valueList[n // 2]) / 2
+
+
+#----------------------------------------------------------------------
+def runBenchmark(moduleList, repeat):
+    """运行测试并输出结果"""
+    # 第一次运行生成字节码缓存，不计入结果
+    for moduleName in moduleList:
+        measureImport(moduleName, 1)
+
+    print(u'%-50s%12s%12s  %s' %(u'模块', u'中位数(ms)', u'最小值(ms)', u'已载入的重量级模块'))
+    for moduleName in moduleList:
+        timeList, loaded, error = measureImport(moduleName, repeat)
+        if error:
+            print(u'%-50s%s' %(moduleName, error))
+            continue
+        print(u'%-50s%12.1f%12.1f  %s' %(moduleName, getMedian(timeList) * 1000, min(timeList) * 1000,
+                                         ', '.join(loaded) or u'无'))
+
+    print('-' * 30)
+    print(u'%-50s%12s' %(u'重量级模块单独import', u'中位数(ms)'))
+    for moduleName in HEAVY_MODULE_LIST:
+        timeList, loaded, error = measureImport(moduleName, repeat)
+        if error:
+            print(u'%-50s%12s' %(moduleName, u'未安装'))
+            continue
+        print(u'%-50s%12.1f' %(moduleName, getMedian(timeList) * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=u'回测模块import耗时测试')
+    parser.add_argument('module', nargs='*', default=DEFAULT_MODULE_LIST, help=u'测试的模块名')
+    parser.add_argument('--repeat', type=int, default=5, help=u'每个模块测试的次数')
+    args = parser.parse_args()
+
+    runBenchmark(args.module, args.repeat)
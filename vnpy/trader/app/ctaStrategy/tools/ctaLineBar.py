@@ -7,14 +7,41 @@ from vtConstant import *
 from vnpy.trader.vtObject import VtBarData
 
 from datetime import datetime
+from collections import deque
+from itertools import islice
+from functools import reduce
+from operator import add
+from math import sqrt
 
-import talib as ta
-import numpy
 import copy,csv
 
 
 DEBUGCTALOG = True
 
+# lineBar最多保留的K线数量（8个交易小时的1分钟K线）
+MAX_LINEBAR_LEN = 60 * 8 + 1
+
+# TA-Lib中判断浮点数为0的精度
+TA_EPSILON = 0.00000001
+
+# 部分vtConstant版本中没有定义夜盘品种和K线颜色，这里提供默认值
+try:
+    NIGHT_MARKET_SQ2
+except NameError:
+    NIGHT_MARKET_SQ2 = {'CU': 0, 'AL': 0, 'ZN': 0, 'PB': 0, 'NI': 0, 'SN': 0}      # 上期所，夜盘到1:00
+    NIGHT_MARKET_SQ3 = {'RU': 0, 'RB': 0, 'HC': 0, 'BU': 0}                      # 上期所，夜盘到23:00
+    NIGHT_MARKET_ZZ = {'TA': 0, 'SR': 0, 'CF': 0, 'RM': 0, 'MA': 0, 'ZC': 0,
+                       'FG': 0, 'OI': 0}                                        # 郑商所，夜盘到23:30
+    NIGHT_MARKET_DL = {'J': 0, 'JM': 0, 'I': 0, 'A': 0, 'B': 0, 'M': 0,
+                       'P': 0, 'Y': 0}                                          # 大商所，夜盘到23:30
+
+try:
+    COLOR_RED
+except NameError:
+    COLOR_RED = u'Red'          # 上涨K线
+    COLOR_BLUE = u'Blue'        # 下跌K线
+    COLOR_EQUAL = u'Equal'      # 平盘K线
+
 class CtaLineBar(object):
     """CTA K线"""
     """ 使用方法:
@@ -87,11 +114,20 @@ class CtaLineBar(object):
 
         self.inputRsiLen = EMPTY_INT    # 7    # RSI 相对强弱指数
 
+        self.inputCmiLen = EMPTY_INT    # CMI的计算周期
+
+        self.inputBollLen = EMPTY_INT   # 布林特线的K线周期
+        self.inputBollStdRate = 1.5     # 两倍标准差
+
         self.shortSymbol = EMPTY_STRING # 商品的短代码
         self.minDiff = 1                # 商品的最小价格单位
 
         self.activeDayJump = False      # 隔夜跳空
 
+        # 指标数据队列的长度取决于参数，因此需要先设置参数
+        if setting:
+            self.setParam(setting)
+
         # 当前的Tick
         self.curTick = None
 
@@ -99,33 +135,33 @@ class CtaLineBar(object):
         self.strategy = strategy
 
         # K线保存数据
-        self.bar = None                # K线数据对象
-        self.lineBar = []              # K线缓存数据队列
+        self.bar = None                                 # K线数据对象
+        self.lineBar = deque(maxlen=MAX_LINEBAR_LEN)    # K线缓存数据队列
         self.barFirstTick =False       # K线的第一条Tick数据
 
         # K 线的相关计算结果数据
 
-        self.preHigh = []               # K线的前inputPreLen的的最高
-        self.preLow = []                # K线的前inputPreLen的的最低
+        self.preHigh = deque(maxlen=self.inputPreLen*8+1)   # K线的前inputPreLen的的最高
+        self.preLow = deque(maxlen=self.inputPreLen*8+1)    # K线的前inputPreLen的的最低
 
-        self.lineEma1 = []              # K线的EMA1均线，周期是InputEmaLen1，包含当前bar
+        self.lineEma1 = deque(maxlen=self.inputEma1Len*8+1) # K线的EMA1均线，周期是InputEmaLen1，包含当前bar
         self.lineEma1MtmRate = []       # K线的EMA1均线 的momentum(3) 动能
 
-        self.lineEma2 = []              # K线的EMA2均线，周期是InputEmaLen2，包含当前bar
+        self.lineEma2 = deque(maxlen=self.inputEma2Len*8+1) # K线的EMA2均线，周期是InputEmaLen2，包含当前bar
         self.lineEma2MtmRate = []       # K线的EMA2均线 的momentum(3) 动能
 
         # K线的DMI( Pdi，Mdi，ADX，Adxr) 计算数据
         self.barPdi = EMPTY_FLOAT      # bar内的升动向指标，即做多的比率
         self.barMdi = EMPTY_FLOAT      # bar内的下降动向指标，即做空的比率
 
-        self.linePdi = []             # 升动向指标，即做多的比率
-        self.lineMdi = []             # 下降动向指标，即做空的比率
+        self.linePdi = deque(maxlen=self.inputDmiLen+2)     # 升动向指标，即做多的比率
+        self.lineMdi = deque(maxlen=self.inputDmiLen+2)     # 下降动向指标，即做空的比率
 
-        self.lineDx = []              # 趋向指标列表，最大长度为inputM*2
+        self.lineDx = deque(maxlen=self.inputDmiLen+2)      # 趋向指标列表，最大长度为inputM*2
         self.barAdx = EMPTY_FLOAT     # Bar内计算的平均趋向指标
-        self.lineAdx = []             # 平均趋向指标
+        self.lineAdx = deque(maxlen=self.inputDmiLen+2)     # 平均趋向指标
         self.barAdxr = EMPTY_FLOAT    # 趋向平均值，为当日ADX值与M日前的ADX值的均值
-        self.lineAdxr = []            # 平均趋向变化指标
+        self.lineAdxr = deque(maxlen=self.inputDmiLen+2)    # 平均趋向变化指标
 
         # K线的基于DMI、ADX计算的结果
         self.barAdxTrend = EMPTY_FLOAT        # ADX值持续高于前一周期时，市场行情将维持原趋势
@@ -135,9 +171,9 @@ class CtaLineBar(object):
         self.sellFilterCond = False         # 空过滤器条件,做空趋势的判断，ADXR高于前一天，下降动向> inputMM
 
         # K线的ATR技术数据
-        self.lineAtr1 = []              # K线的ATR1,周期为inputAtr1Len
-        self.lineAtr2 = []              # K线的ATR2,周期为inputAtr2Len
-        self.lineAtr3 = []              # K线的ATR3,周期为inputAtr3Len
+        self.lineAtr1 = deque(maxlen=self.inputAtr1Len+2)   # K线的ATR1,周期为inputAtr1Len
+        self.lineAtr2 = deque(maxlen=self.inputAtr2Len+2)   # K线的ATR2,周期为inputAtr2Len
+        self.lineAtr3 = deque(maxlen=self.inputAtr3Len+2)   # K线的ATR3,周期为inputAtr3Len
 
         self.barAtr1 = EMPTY_FLOAT
         self.barAtr2 = EMPTY_FLOAT
@@ -147,29 +183,30 @@ class CtaLineBar(object):
         self.lineAvgVol = []        # K 线的交易量平均
 
         # K线的RSI计算数据
-        self.lineRsi = []           # 记录K线对应的RSI数值，只保留inputRsiLen*8
+        self.lineRsi = deque(maxlen=self.inputRsiLen*8+1)   # 记录K线对应的RSI数值，只保留inputRsiLen*8
 
         self.lowRsi = 30            # RSI的最低线
         self.highRsi = 70           # RSI的最高线
 
-        self.lineRsiTop = []        # 记录RSI的最高峰，只保留 inputRsiLen个
-        self.lineRsiButtom = []     # 记录RSI的最低谷，只保留 inputRsiLen个
+        self.lineRsiTop = deque(maxlen=self.inputRsiLen+1)      # 记录RSI的最高峰，只保留 inputRsiLen个
+        self.lineRsiButtom = deque(maxlen=self.inputRsiLen+1)   # 记录RSI的最低谷，只保留 inputRsiLen个
         self.lastRsiTopButtom = None # 最近的一个波峰/波谷
 
-         # K线的CMI计算数据
-        self.inputCmiLen = EMPTY_INT
-        self.lineCmi = []           # 记录K线对应的Cmi数值，只保留inputCmiLen*8
+        # K线的CMI计算数据
+        self.lineCmi = deque(maxlen=self.inputCmiLen+1)     # 记录K线对应的Cmi数值，只保留inputCmiLen个
 
         # K线的布林特计算数据
-        self.inputBollLen = EMPTY_INT  # K线周期
-        self.inputBollStdRate = 1.5      # 两倍标准差
-
         self.lineUpperBand = []            # 上轨
         self.lineMiddleBand = []           # 中线
         self.lineLowerBand = []            # 下轨
 
-        if setting:
-            self.setParam(setting)
+        # 增量计算指标用的状态对象（只保存已完成K线的数据）
+        self.emaWindow1 = WindowSum(self.inputEma1Len)              # EMA1的收盘价窗口
+        self.emaWindow2 = WindowSum(self.inputEma2Len)              # EMA2的收盘价窗口
+        self.bollWindow = WindowSum(self.inputBollLen)              # 布林特线的收盘价窗口
+        self.volWindow = WindowSum(self.inputVolLen)                # 平均成交量的成交量窗口
+        self.dmiWindow = DmiWindow(self.inputDmiLen)                # DMI的价差窗口
+        self.rsiWindow = RsiWindow(self.inputRsiLen)                # RSI的涨跌幅窗口
 
     def setParam(self, setting):
         """设置参数"""
@@ -223,6 +260,9 @@ class CtaLineBar(object):
 
     def onBar(self, bar):
         """OnBar事件"""
+        # 新K线推入队列后，前一根K线已经完成，更新增量指标的状态
+        self.__updateFinishedBar()
+
         # 计算相关数据
         self.__recountPreHighLow()
         self.__recountEma()
@@ -237,6 +277,21 @@ class CtaLineBar(object):
         # 回调上层调用者
         self.onBarFunc(bar)
 
+    def __updateFinishedBar(self):
+        """把刚完成的K线（lineBar[-2]）推入各指标的窗口"""
+        if len(self.lineBar) < 2:
+            return
+
+        finishedBar = self.lineBar[-2]
+
+        self.emaWindow1.update(finishedBar.close)
+        self.emaWindow2.update(finishedBar.close)
+        self.bollWindow.update(finishedBar.close)
+        self.volWindow.update(finishedBar.volume)
+        self.rsiWindow.update(finishedBar.close)
+
+        if len(self.lineBar) >= 3:
+            self.dmiWindow.update(finishedBar, self.lineBar[-3])
 
     def __firstTick(self,tick):
         """ K线的第一个Tick数据"""
@@ -275,9 +330,7 @@ class CtaLineBar(object):
             self.onBar(self.bar)
             return
 
-        # 清除8交易小时前的数据，
-        if l1 > 60 * 8:
-            del self.lineBar[0]
+        # lineBar为定长队列，8交易小时前的数据会被自动清除
 
         # 与最后一个BAR的时间比对，判断是否超过5分钟
         lastBar = self.lineBar[-1]
@@ -407,14 +460,8 @@ class CtaLineBar(object):
             if self.lineBar[i].low < preLow or preLow == EMPTY_FLOAT:
                 preLow = self.lineBar[i].low     # 前InputPreLen周期低点
 
-        # 保存
-        if len(self.preHigh) > self.inputPreLen * 8:
-            del self.preHigh[0]
+        # 保存（定长队列，自动移除最早的数据）
         self.preHigh.append(preHigh)
-
-        # 保存
-        if len(self.preLow)> self.inputPreLen * 8:
-            del self.preLow[0]
         self.preLow.append(preLow)
 
     #----------------------------------------------------------------------
@@ -422,8 +469,6 @@ class CtaLineBar(object):
 
     def __recountEma(self):
         """计算K线的EMA1 和EMA2"""
-        l = len(self.lineBar)
-
         # 1、lineBar满足长度才执行计算
         if len(self.lineBar) < max(7, self.inputEma1Len, self.inputEma2Len)+2:
             self.debugCtaLog(u'数据未充分,当前Bar数据数量：{0}，计算EMA需要：{1}'.
@@ -432,39 +477,15 @@ class CtaLineBar(object):
 
         # 计算第一条EMA均线
         if self.inputEma1Len > 0:
-
-            if self.inputEma1Len > l:
-                ema1Len = l
-            else:
-                ema1Len = self.inputEma1Len
-
             # 3、获取前InputN周期(不包含当前周期）的自适应均线
-            listClose=[x.close for x in self.lineBar[-ema1Len - 1:-1]]
-
-            barEma1 = ta.EMA(numpy.array(listClose, dtype=float), ema1Len)[-1]
-
-            barEma1 = round(float(barEma1), 3)
-
-            if len(self.lineEma1) > self.inputEma1Len*8:
-                del self.lineEma1[0]
+            # 输入数据长度等于周期时，TA-Lib的EMA结果即为窗口均值
+            barEma1 = round(self.emaWindow1.mean(), 3)
             self.lineEma1.append(barEma1)
 
         # 计算第二条EMA均线
         if self.inputEma2Len > 0:
-
-            if self.inputEma2Len > l:
-                ema2Len = l
-            else:
-                ema2Len = self.inputEma2Len
-
             # 3、获取前InputN周期(不包含当前周期）的自适应均线
-            listClose=[x.close for x in self.lineBar[-ema2Len - 1:-1]]
-            barEma2 = ta.EMA(numpy.array(listClose, dtype=float), ema2Len)[-1]
-
-            barEma2 = round(float(barEma2), 3)
-
-            if len(self.lineEma2) > self.inputEma1Len*8:
-                del self.lineEma2[0]
+            barEma2 = round(self.emaWindow2.mean(), 3)
             self.lineEma2.append(barEma2)
 
 
@@ -479,38 +500,42 @@ class CtaLineBar(object):
             self.debugCtaLog(u'数据未充分,当前Bar数据数量：{0}，计算DMI需要：{1}'.format(len(self.lineBar), self.inputDmiLen+1))
             return
 
+        # 2、根据当前High，Low，(不包含当前周期）计算TR1，PDM，MDM
+        if self.dmiWindow.isFull():
+            # 价差窗口已满，直接使用增量维护的窗口求和
+            barTr1, barPdm, barMdm = self.dmiWindow.sums()
+        else:
+            # 预热阶段，沿用逐根K线重新计算的方式
+            barTr1 = EMPTY_FLOAT      # 获取InputP周期内的价差最大值之和
+            barPdm = EMPTY_FLOAT      # InputP周期内的做多价差之和
+            barMdm = EMPTY_FLOAT      # InputP周期内的做空价差之和
 
-        # 2、根据当前High，Low，(不包含当前周期）重新计算TR1，PDM，MDM和ATR
-        barTr1 = EMPTY_FLOAT      # 获取InputP周期内的价差最大值之和
-        barPdm = EMPTY_FLOAT      # InputP周期内的做多价差之和
-        barMdm = EMPTY_FLOAT      # InputP周期内的做空价差之和
-
-        for i in range(len(self.lineBar)-2, len(self.lineBar)-2-self.inputDmiLen, -1):  # 周期 inputDmiLen
-            # 3.1、计算TR1
+            for i in range(len(self.lineBar)-2, len(self.lineBar)-2-self.inputDmiLen, -1):  # 周期 inputDmiLen
+                # 3.1、计算TR1
 
-            # 当前周期最高与最低的价差
-            high_low_spread = self.lineBar[i].high - self.lineBar[i].low
-            # 当前周期最高与昨收价的价差
-            high_preclose_spread = abs(self.lineBar[i].high - self.lineBar[i - 1].close)
-            # 当前周期最低与昨收价的价差
-            low_preclose_spread = abs(self.lineBar[i].low - self.lineBar[i - 1].close)
+                # 当前周期最高与最低的价差
+                high_low_spread = self.lineBar[i].high - self.lineBar[i].low
+                # 当前周期最高与昨收价的价差
+                high_preclose_spread = abs(self.lineBar[i].high - self.lineBar[i - 1].close)
+                # 当前周期最低与昨收价的价差
+                low_preclose_spread = abs(self.lineBar[i].low - self.lineBar[i - 1].close)
 
-            # 最大价差
-            max_spread = max(high_low_spread, high_preclose_spread, low_preclose_spread)
-            barTr1 = barTr1 + float(max_spread)
+                # 最大价差
+                max_spread = max(high_low_spread, high_preclose_spread, low_preclose_spread)
+                barTr1 = barTr1 + float(max_spread)
 
-            # 今高与昨高的价差
-            high_prehigh_spread = self.lineBar[i].high - self.lineBar[i - 1].high
-            # 昨低与今低的价差
-            low_prelow_spread = self.lineBar[i - 1].low - self.lineBar[i].low
+                # 今高与昨高的价差
+                high_prehigh_spread = self.lineBar[i].high - self.lineBar[i - 1].high
+                # 昨低与今低的价差
+                low_prelow_spread = self.lineBar[i - 1].low - self.lineBar[i].low
 
-            # 3.2、计算周期内的做多价差之和
-            if high_prehigh_spread > 0 and high_prehigh_spread > low_prelow_spread:
-                barPdm = barPdm + high_prehigh_spread
+                # 3.2、计算周期内的做多价差之和
+                if high_prehigh_spread > 0 and high_prehigh_spread > low_prelow_spread:
+                    barPdm = barPdm + high_prehigh_spread
 
-            # 3.3、计算周期内的做空价差之和
-            if low_prelow_spread > 0 and low_prelow_spread > high_prehigh_spread:
-                barMdm = barMdm + low_prelow_spread
+                # 3.3、计算周期内的做空价差之和
+                if low_prelow_spread > 0 and low_prelow_spread > high_prehigh_spread:
+                    barMdm = barMdm + low_prelow_spread
 
         # 6、计算上升动向指标，即做多的比率
         if barTr1 == 0:
@@ -518,9 +543,6 @@ class CtaLineBar(object):
         else:
             self.barPdi = barPdm * 100 / barTr1
 
-        if len(self.linePdi) > self.inputDmiLen+1:
-            del self.linePdi[0]
-
         self.linePdi.append(self.barPdi)
 
         # 7、计算下降动向指标，即做空的比率
@@ -535,26 +557,17 @@ class CtaLineBar(object):
         else:
             dx = 100 * abs(self.barMdi - self.barPdi) / (self.barMdi + self.barPdi)
 
-        if len(self.lineMdi) > self.inputDmiLen+1:
-            del self.lineMdi[0]
-
         self.lineMdi.append(self.barMdi)
 
-        if len(self.lineDx) > self.inputDmiLen+1:
-            del self.lineDx[0]
-
         self.lineDx.append(dx)
 
         # 平均趋向指标，MA计算
         if len(self.lineDx) < self.inputDmiLen+1:
             self.barAdx = dx
         else:
-            self.barAdx = ta.EMA(numpy.array(self.lineDx, dtype=float), self.inputDmiLen)[-1]
+            self.barAdx = emaLast(self.lineDx, self.inputDmiLen)
 
         # 保存Adx值
-        if len(self.lineAdx) > self.inputDmiLen+1:
-            del self.lineAdx[0]
-
         self.lineAdx.append(self.barAdx)
 
         # 趋向平均值，为当日ADX值与1周期前的ADX值的均值
@@ -564,8 +577,6 @@ class CtaLineBar(object):
             self.barAdxr = (self.lineAdx[-1] + self.lineAdx[-2]) / 2
 
         # 保存Adxr值
-        if len(self.lineAdxr) > self.inputDmiLen+1:
-            del self.lineAdxr[0]
         self.lineAdxr.append(self.barAdxr)
 
         # 7、计算A，ADX值持续高于前一周期时，市场行情将维持原趋势
@@ -669,8 +680,6 @@ class CtaLineBar(object):
             else:
                 self.barAtr1 = round((self.lineAtr1[-1]*(self.inputAtr1Len -1) + barTr1) / self.inputAtr1Len, 3)
 
-            if len(self.lineAtr1) > self. inputAtr1Len+1 :
-                del self.lineAtr1[0]
             self.lineAtr1.append(self.barAtr1)
 
         if self.inputAtr2Len > 0:
@@ -679,8 +688,6 @@ class CtaLineBar(object):
             else:
                 self.barAtr2 = round((self.lineAtr2[-1]*(self.inputAtr2Len -1) + barTr2) / self.inputAtr2Len, 3)
 
-            if len(self.lineAtr2) > self. inputAtr2Len+1:
-                del self.lineAtr2[0]
             self.lineAtr2.append(self.barAtr2)
 
         if self.inputAtr3Len > 0:
@@ -689,9 +696,6 @@ class CtaLineBar(object):
             else:
                 self.barAtr3 = round((self.lineAtr3[-1]*(self.inputAtr3Len -1) + barTr3) / self.inputAtr3Len, 3)
 
-            if len(self.lineAtr3) > self. inputAtr3Len+1:
-                del self.lineAtr3[0]
-
             self.lineAtr3.append(self.barAtr3)
 
     #----------------------------------------------------------------------
@@ -707,9 +711,8 @@ class CtaLineBar(object):
                              format(len(self.lineBar), self.inputVolLen+1))
             return
 
-        listVol = [x.volume for x in self.lineBar[-self.inputVolLen-1: -1]]
-
-        sumVol = ta.SUM(numpy.array(listVol, dtype=float), timeperiod=self.inputVolLen)[-1]
+        # 前inputVolLen周期(不包含当前周期）的成交量之和
+        sumVol = self.volWindow.sum()
 
         avgVol = round(sumVol/self.inputVolLen, 0)
 
@@ -728,14 +731,10 @@ class CtaLineBar(object):
             return
 
         # 3、inputRsiLen(包含当前周期）的相对强弱
-        listClose=[x.close for x in self.lineBar[-self.inputRsiLen - 2:]]
-        barRsi = ta.RSI(numpy.array(listClose, dtype=float), self.inputRsiLen)[-1]
-        barRsi = round(float(barRsi), 3)
+        barRsi = self.rsiWindow.rsi(self.lineBar[-1].close)
+        barRsi = round(barRsi, 3)
 
         l = len(self.lineRsi)
-        if l > self.inputRsiLen*8:
-            del self.lineRsi[0]
-
         self.lineRsi.append(barRsi)
 
         if l > 3:
@@ -747,10 +746,6 @@ class CtaLineBar(object):
                 t["RSI"] = self.lineRsi[-2]
                 t["Close"] = self.lineBar[-2].close
 
-
-                if len(self.lineRsiTop) > self.inputRsiLen:
-                    del self.lineRsiTop[0]
-
                 self.lineRsiTop.append( t )
                 self.lastRsiTopButtom = self.lineRsiTop[-1]
 
@@ -762,8 +757,6 @@ class CtaLineBar(object):
                 b["RSI"] = self.lineRsi[-2]
                 b["Close"] = self.lineBar[-2].close
 
-                if len(self.lineRsiButtom) > self.inputRsiLen:
-                    del self.lineRsiButtom[0]
                 self.lineRsiButtom.append(b)
                 self.lastRsiTopButtom = self.lineRsiButtom[-1]
 
@@ -787,7 +780,7 @@ class CtaLineBar(object):
                              format(len(self.lineBar), self.inputCmiLen))
             return
 
-        listClose =[x.close for x in self.lineBar[-self.inputCmiLen:]]
+        listClose =[x.close for x in islice(reversed(self.lineBar), self.inputCmiLen)]
         hhv = max(listClose)
         llv = min(listClose)
 
@@ -798,14 +791,11 @@ class CtaLineBar(object):
 
         cmi = round(cmi, 2)
 
-        if len(self.lineCmi) > self.inputCmiLen:
-            del self.lineCmi[0]
-
         self.lineCmi.append(cmi)
 
     def __recountBoll(self):
         """布林特线"""
-        if self.inputBollLen < EMPTY_INT: return
+        if self.inputBollLen <= EMPTY_INT: return
 
         l = len(self.lineBar)
 
@@ -814,21 +804,12 @@ class CtaLineBar(object):
                              format(len(self.lineBar), min(7, self.inputBollLen)+1))
             return
 
-        if l < self.inputBollLen+2:
-            bollLen = l-1
-        else:
-            bollLen = self.inputBollLen
-
-        # 不包含当前最新的Bar
-        listClose=[x.close for x in self.lineBar[-bollLen - 1:-1]]
-        #
-        upper, middle, lower = ta.BBANDS(numpy.array(listClose, dtype=float),
-                                         timeperiod=bollLen, nbdevup=self.inputBollStdRate,
-                                         nbdevdn=self.inputBollStdRate, matype=0)
+        # 不包含当前最新的Bar，数据不足inputBollLen时窗口中为全部已完成的K线
+        upper, middle, lower = self.bollWindow.bands(self.inputBollStdRate)
 
-        self.lineUpperBand.append(upper[-1])
-        self.lineMiddleBand.append(middle[-1])
-        self.lineLowerBand.append(lower[-1])
+        self.lineUpperBand.append(upper)
+        self.lineMiddleBand.append(middle)
+        self.lineLowerBand.append(lower)
 
 
     # ----------------------------------------------------------------------
@@ -839,4 +820,176 @@ class CtaLineBar(object):
     def debugCtaLog(self,content):
         """记录CTA日志"""
         if DEBUGCTALOG:
-            self.strategy.writeCtaLog(u'['+self.name+u'-DEBUG]'+content)
\ No newline at end of file
+            self.strategy.writeCtaLog(u'['+self.name+u'-DEBUG]'+content)
+
+#----------------------------------------------------------------------
+def emaLast(values, period):
+    """计算序列最后一个EMA数值，算法与TA-Lib的EMA一致（以前period个数据的均值为初值）"""
+    values = [float(v) for v in values]
+    k = 2.0 / (period + 1)
+
+    ema = reduce(add, values[:period], 0.0) / period
+    for value in values[period:]:
+        ema = (value - ema) * k + ema
+
+    return ema
+
+
+########################################################################
+class WindowSum(object):
+    """
+    定长窗口的增量数据
+    数据保存在定长deque中，新数据推入时自动移除最早的数据；
+    求和时按时间顺序累加，与TA-Lib的累加顺序相同，保证计算结果完全一致
+
+    注意：求和的复杂度是O(周期)而不是O(1)，这是有意的取舍。
+    维护滚动和（加新值、减旧值）虽然是常数时间，但浮点误差会逐根累积，
+    结果与TA-Lib出现末位差异，进而影响round后的指标值和策略信号；
+    而指标周期通常只有几十，逐根重新累加的开销远小于K线推送的其他处理。
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, size):
+        """Constructor"""
+        self.size = max(size, 0)
+        self.values = deque(maxlen=self.size)
+
+    #----------------------------------------------------------------------
+    def update(self, value):
+        """推入新数据"""
+        self.values.append(float(value))
+
+    #----------------------------------------------------------------------
+    def isFull(self):
+        """窗口是否已满"""
+        return self.size > 0 and len(self.values) == self.size
+
+    #----------------------------------------------------------------------
+    def sum(self):
+        """窗口内数据之和（按时间顺序重新累加，O(周期)，原因见类说明）"""
+        return reduce(add, self.values, 0.0)
+
+    #----------------------------------------------------------------------
+    def mean(self):
+        """窗口内数据的均值"""
+        return self.sum() / len(self.values)
+
+    #----------------------------------------------------------------------
+    def bands(self, nbDev):
+        """布林特线的上轨、中线、下轨，算法与TA-Lib的BBANDS(matype=0)一致（两次遍历计算标准差）"""
+        n = len(self.values)
+        middle = self.sum() / n
+
+        variance = reduce(add, [(v-middle)*(v-middle) for v in self.values], 0.0) / n
+        if variance > 0:
+            std = sqrt(variance)
+        else:
+            std = 0.0
+
+        dev = std * nbDev
+        return middle + dev, middle, middle - dev
+
+
+########################################################################
+class DmiWindow(object):
+    """DMI计算用的定长价差窗口，每根完成的K线只计算一次价差"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, size):
+        """Constructor"""
+        self.size = max(size, 0)
+
+        self.trList = deque(maxlen=self.size)       # 每根K线的最大价差
+        self.pdmList = deque(maxlen=self.size)      # 每根K线的做多价差
+        self.mdmList = deque(maxlen=self.size)      # 每根K线的做空价差
+
+    #----------------------------------------------------------------------
+    def update(self, bar, preBar):
+        """推入新完成的K线，preBar为其前一根K线"""
+        # 最大价差
+        high_low_spread = bar.high - bar.low
+        high_preclose_spread = abs(bar.high - preBar.close)
+        low_preclose_spread = abs(bar.low - preBar.close)
+        self.trList.append(float(max(high_low_spread, high_preclose_spread, low_preclose_spread)))
+
+        # 今高与昨高的价差、昨低与今低的价差
+        high_prehigh_spread = bar.high - preBar.high
+        low_prelow_spread = preBar.low - bar.low
+
+        if high_prehigh_spread > 0 and high_prehigh_spread > low_prelow_spread:
+            self.pdmList.append(high_prehigh_spread)
+        else:
+            self.pdmList.append(EMPTY_FLOAT)
+
+        if low_prelow_spread > 0 and low_prelow_spread > high_prehigh_spread:
+            self.mdmList.append(low_prelow_spread)
+        else:
+            self.mdmList.append(EMPTY_FLOAT)
+
+    #----------------------------------------------------------------------
+    def isFull(self):
+        """窗口是否已满"""
+        return self.size > 0 and len(self.trList) == self.size
+
+    #----------------------------------------------------------------------
+    def sums(self):
+        """窗口内TR、PDM、MDM之和（从最新的K线开始累加）"""
+        return (reduce(add, reversed(self.trList), EMPTY_FLOAT),
+                reduce(add, reversed(self.pdmList), EMPTY_FLOAT),
+                reduce(add, reversed(self.mdmList), EMPTY_FLOAT))
+
+
+########################################################################
+class RsiWindow(object):
+    """RSI计算用的定长涨跌幅窗口，算法与TA-Lib的RSI一致"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, period):
+        """Constructor"""
+        self.period = max(period, 0)
+
+        self.gainList = deque(maxlen=self.period)     # 已完成K线收盘价的上涨幅度
+        self.lossList = deque(maxlen=self.period)     # 已完成K线收盘价的下跌幅度
+        self.lastClose = None                         # 最近一根已完成K线的收盘价
+
+    #----------------------------------------------------------------------
+    def update(self, close):
+        """推入新完成K线的收盘价"""
+        close = float(close)
+
+        if self.lastClose is not None:
+            gain, loss = self.splitDiff(close - self.lastClose)
+            self.gainList.append(gain)
+            self.lossList.append(loss)
+
+        self.lastClose = close
+
+    #----------------------------------------------------------------------
+    def splitDiff(self, diff):
+        """把涨跌幅拆分为上涨和下跌部分"""
+        if diff < 0:
+            return EMPTY_FLOAT, -diff
+        else:
+            return diff, EMPTY_FLOAT
+
+    #----------------------------------------------------------------------
+    def rsi(self, close):
+        """
+        计算包含当前K线收盘价close在内的RSI
+        对应TA-Lib对最近period+2个收盘价计算RSI的最后一个数值
+        """
+        period = self.period
+
+        # 已完成K线的period个涨跌幅的均值作为初始平均值
+        avgGain = reduce(add, self.gainList, 0.0) / period
+        avgLoss = reduce(add, self.lossList, 0.0) / period
+
+        # 用当前K线的涨跌幅做平滑
+        gain, loss = self.splitDiff(float(close) - self.lastClose)
+        avgGain = (avgGain * (period-1) + gain) / period
+        avgLoss = (avgLoss * (period-1) + loss) / period
+
+        total = avgGain + avgLoss
+        if -TA_EPSILON < total < TA_EPSILON:
+            return 0.0
+        return 100.0 * (avgGain / total)
@@ -0,0 +1,147 @@
+# encoding: UTF-8
+
+"""
+CtaLineBar指标计算的性能测试
+
+用确定性的随机游走生成一年的tick数据（默认250个交易日，日盘三个交易时段，每秒一个tick），
+同时推入多个周期的CtaLineBar（打开全部指标），统计每秒能处理的tick数量。
+
+运行方法：
+python ctaLineBarBenchmark.py [交易日数量] [tick间隔秒数]
+"""
+
+import os
+import sys
+import random
+from time import time
+from datetime import datetime, timedelta
+
+# 把vnpy根目录和vnpy/trader目录加入搜索路径（ctaLineBar中直接导入了vtConstant）
+path = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.abspath(os.path.join(path, '..', '..', '..', '..', '..'))
+sys.path.append(rootPath)
+sys.path.append(os.path.join(rootPath, 'vnpy', 'trader'))
+
+from vnpy.trader.vtObject import VtTickData
+from ctaLineBar import CtaLineBar
+
+
+# 日盘交易时段
+TRADING_SESSIONS = [((9, 0), (10, 15)),
+                    ((10, 30), (11, 30)),
+                    ((13, 30), (15, 0))]
+
+
+########################################################################
+class BenchmarkStrategy(object):
+    """只用于接收K线和日志的模拟策略"""
+
+    #----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.barCount = 0
+        self.logCount = 0
+
+    #----------------------------------------------------------------------
+    def onBar(self, bar):
+        """K线完成"""
+        self.barCount += 1
+
+    #----------------------------------------------------------------------
+    def writeCtaLog(self, content):
+        """丢弃日志，只计数"""
+        self.logCount += 1
+
+
+#----------------------------------------------------------------------
+def generateTicks(days, interval=1, seed=0):
+    """生成确定性的模拟tick数据"""
+    rnd = random.Random(seed)
+    price = 3000.0
+    volume = 0
+
+    dt = datetime(2017, 1, 3)
+    for i in range(days):
+        # 跳过周末
+        while dt.weekday() >= 5:
+            dt += timedelta(days=1)
+
+        for (startHour, startMinute), (endHour, endMinute) in TRADING_SESSIONS:
+            t = dt.replace(hour=startHour, minute=startMinute)
+            end = dt.replace(hour=endHour, minute=endMinute)
+
+            while t < end:
+                price += rnd.choice([-1, 0, 0, 1])
+                volume += rnd.randint(1, 20)
+
+                tick = VtTickData()
+                tick.symbol = 'RB'
+                tick.vtSymbol = 'RB'
+                tick.lastPrice = price
+                tick.volume = volume
+                tick.datetime = t
+                tick.date = t.strftime('%Y%m%d')
+                tick.time = t.strftime('%H:%M:%S')
+                yield tick
+
+                t += timedelta(seconds=interval)
+
+        dt += timedelta(days=1)
+
+
+#----------------------------------------------------------------------
+def createLineBar(strategy, name, interval):
+    """创建打开全部指标的K线"""
+    setting = {}
+    setting['name'] = name
+    setting['barTimeInterval'] = interval
+    setting['inputPreLen'] = 5
+    setting['inputEma1Len'] = 7
+    setting['inputEma2Len'] = 21
+    setting['inputDmiLen'] = 14
+    setting['inputDmiMax'] = 30
+    setting['inputAtr1Len'] = 10
+    setting['inputAtr2Len'] = 26
+    setting['inputAtr3Len'] = 50
+    setting['inputVolLen'] = 14
+    setting['inputRsiLen'] = 7
+    setting['inputCmiLen'] = 10
+    setting['inputBollLen'] = 20
+    setting['inputBollStdRate'] = 2
+    setting['minDiff'] = 1
+    setting['shortSymbol'] = 'RB'
+
+    return CtaLineBar(strategy, strategy.onBar, setting)
+
+
+#----------------------------------------------------------------------
+def runBenchmark(days=250, interval=1):
+    """运行测试"""
+    strategy = BenchmarkStrategy()
+    lineBars = [createLineBar(strategy, u'M1', 60),
+                createLineBar(strategy, u'M5', 300),
+                createLineBar(strategy, u'M30', 1800)]
+
+    # 先生成数据，避免把数据生成的耗时计入
+    ticks = list(generateTicks(days, interval))
+
+    start = time()
+    for tick in ticks:
+        for lineBar in lineBars:
+            lineBar.onTick(tick)
+    cost = time() - start
+
+    print u'tick数量：%s，K线数量：%s，耗时：%.2f秒，每秒处理tick：%.0f' % (len(ticks), strategy.barCount,
+                                                                  cost, len(ticks)/cost)
+
+
+if __name__ == '__main__':
+    days = 250
+    interval = 1
+
+    if len(sys.argv) > 1:
+        days = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        interval = int(sys.argv[2])
+
+    runBenchmark(days, interval)
@@ -0,0 +1,253 @@
+# encoding: UTF-8
+
+"""
+回测引擎限价单、停止单撮合的一致性检查
+
+回测引擎的活动委托按价格索引（PriceIndexedOrderDict），撮合时只处理价格满足条件的委托。
+本脚本用一个在多个价位上不断挂单、撤单的网格策略，在K线和tick模式下分别运行：
+1. 当前的回测引擎
+2. 参考引擎：每次撮合都按发单顺序遍历全部活动委托（即原先的items()线性撮合）
+检查两者的成交列表和策略收到的回调序列完全一致，并输出两者的耗时。
+
+运行方法：
+python ctaOrderMatchingCheck.py
+python ctaOrderMatchingCheck.py --barDays 40 --tickDays 2
+"""
+
+from __future__ import division
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import argparse
+from time import time
+
+# 把vnpy根目录加入搜索路径
+path = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.abspath(os.path.join(path, '..', '..', '..', '..', '..'))
+sys.path.append(rootPath)
+
+from vnpy.trader.app.ctaStrategy.ctaBacktesting import BacktestingEngine, PriceIndexedOrderDict
+from vnpy.trader.app.ctaStrategy.ctaHistoryCache import saveHistoryCache
+from vnpy.trader.app.ctaStrategy.ctaTemplate import CtaTemplate
+
+from ctaBacktestingBenchmark import generateBars, generateTicks, START_DATE
+
+
+########################################################################
+class LinearOrderDict(PriceIndexedOrderDict):
+    """不使用价格索引的活动委托字典，撮合时返回全部委托，由撮合函数逐个判断价格"""
+
+    #----------------------------------------------------------------------
+    def getKeysByPrice(self, direction, low=None, high=None):
+        """忽略价格范围，返回该方向上的全部委托编号"""
+        return [key for price, seq, key in self.indexDict[direction]]
+
+
+########################################################################
+class LinearMatchingEngine(BacktestingEngine):
+    """参考引擎：每次撮合遍历全部活动委托"""
+
+    #----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        super(LinearMatchingEngine, self).__init__()
+
+        self.workingLimitOrderDict = LinearOrderDict(True)
+        self.workingStopOrderDict = LinearOrderDict()
+
+
+########################################################################
+class GridCheckStrategy(CtaTemplate):
+    """在当前价格上下多个价位随机挂限价单、停止单并随机撤单的网格策略，记录收到的全部回调"""
+    className = 'GridCheckStrategy'
+    author = u'用Python的交易员'
+
+    levels = 20             # 挂单的价位数量
+    orderRate = 0.2         # 每个价位的挂单概率
+    seed = 7                # 随机数种子
+
+    paramList = ['name',
+                 'className',
+                 'author',
+                 'vtSymbol',
+                 'levels',
+                 'orderRate',
+                 'seed']
+
+    varList = ['inited',
+               'trading',
+               'pos']
+
+    #----------------------------------------------------------------------
+    def __init__(self, ctaEngine, setting):
+        """Constructor"""
+        super(GridCheckStrategy, self).__init__(ctaEngine, setting)
+
+        self.rnd = random.Random(self.seed)
+        self.orderIDList = []       # 发出的限价单编号
+        self.stopOrderIDList = []   # 发出的停止单编号
+        self.eventList = []         # 收到的回调
+
+    #----------------------------------------------------------------------
+    def onInit(self):
+        """初始化策略"""
+        self.putEvent()
+
+    #----------------------------------------------------------------------
+    def onStart(self):
+        """启动策略"""
+        self.putEvent()
+
+    #----------------------------------------------------------------------
+    def onStop(self):
+        """停止策略"""
+        self.putEvent()
+
+    #----------------------------------------------------------------------
+    def onTick(self, tick):
+        """收到行情TICK推送"""
+        self.trade(tick.lastPrice)
+
+    #----------------------------------------------------------------------
+    def onBar(self, bar):
+        """收到Bar推送"""
+        self.trade(bar.close)
+
+    #----------------------------------------------------------------------
+    def onOrder(self, order):
+        """收到委托变化推送"""
+        self.eventList.append(('order', order.orderID, order.status, order.tradedVolume))
+
+    #----------------------------------------------------------------------
+    def onTrade(self, trade):
+        """收到成交推送"""
+        self.eventList.append(('trade', trade.tradeID, trade.orderID, trade.price, trade.volume))
+
+        # 成交后在更低的价位追加买单，覆盖回调中发单的情况
+        if self.rnd.random() < 0.3:
+            self.orderIDList.append(self.buy(trade.price - 3, 1))
+
+    #----------------------------------------------------------------------
+    def onStopOrder(self, so):
+        """收到停止单推送"""
+        self.eventList.append(('stop', so.stopOrderID, so.status))
+
+    #----------------------------------------------------------------------
+    def trade(self, price):
+        """随机撤单，并在当前价格上下挂限价单和停止单"""
+        for i in range(self.rnd.randint(0, 3)):
+            if self.orderIDList and self.rnd.random() < 0.5:
+                self.cancelOrder(self.rnd.choice(self.orderIDList))
+
+        for level in range(1, self.levels + 1):
+            if self.rnd.random() < self.orderRate:
+                func = self.rnd.choice([self.buy, self.sell, self.short, self.cover])
+                if func in (self.buy, self.cover):
+                    orderPrice = price - level
+                else:
+                    orderPrice = price + level
+                self.orderIDList.append(func(orderPrice, 1))
+
+        if self.rnd.random() < 0.3:
+            func = self.rnd.choice([self.buy, self.sell, self.short, self.cover])
+            self.stopOrderIDList.append(func(price + self.rnd.randint(-10, 10), 1, stop=True))
+
+        if self.stopOrderIDList and self.rnd.random() < 0.2:
+            self.cancelOrder(self.rnd.choice(self.stopOrderIDList))
+
+
+#----------------------------------------------------------------------
+def runEngine(engineClass, mode, cachePath):
+    """运行回测，返回(成交列表, 回调列表, 耗时, 剩余活动限价单数量)"""
+    engine = engineClass()
+    engine.setBacktestingMode(mode)
+    engine.setStartDate(START_DATE.strftime('%Y%m%d'), 0)
+    engine.setSlippage(1)
+    engine.setRate(1/10000)
+    engine.setSize(10)
+    engine.setPriceTick(1)
+    engine.setHistoryCache(cachePath)
+    engine.output = lambda content: None
+
+    engine.initStrategy(GridCheckStrategy, {'vtSymbol': 'RB'})
+
+    start = time()
+    engine.runBacktesting()
+    cost = time() - start
+
+    tradeList = [(trade.tradeID, trade.orderID, trade.direction, trade.offset,
+                  trade.price, trade.volume, trade.dt)
+                 for trade in engine.tradeDict.values()]
+    return tradeList, engine.strategy.eventList, cost, len(engine.workingLimitOrderDict)
+
+
+#----------------------------------------------------------------------
+def checkMode(mode, cachePath):
+    """比较当前引擎和参考引擎的结果，返回是否一致"""
+    tradeList, eventList, cost, workingCount = runEngine(BacktestingEngine, mode, cachePath)
+    refTradeList, refEventList, refCost, refWorkingCount = runEngine(LinearMatchingEngine, mode, cachePath)
+
+    print u'%s模式：成交%s笔，回调%s次，结束时活动限价单%s个，价格索引%.2f秒，线性遍历%.2f秒' %(
+        mode, len(tradeList), len(eventList), workingCount, cost, refCost)
+
+    if tradeList == refTradeList and eventList == refEventList and workingCount == refWorkingCount:
+        return True
+
+    # 输出第一处不一致的位置
+    for name, result, refResult in [(u'成交', tradeList, refTradeList),
+                                    (u'回调', eventList, refEventList)]:
+        for i, (data, refData) in enumerate(zip(result, refResult)):
+            if data != refData:
+                print u'%s第%s条不一致：%s，参考：%s' %(name, i, data, refData)
+                break
+        else:
+            if len(result) != len(refResult):
+                print u'%s数量不一致：%s，参考：%s' %(name, len(result), len(refResult))
+
+    return False
+
+
+#----------------------------------------------------------------------
+def generateCheckTicks(days, interval, seed=0):
+    """生成tick数据，少量tick的买一或卖一价为0（模拟涨跌停），覆盖无法成交的情况"""
+    rnd = random.Random(seed)
+
+    tickList = generateTicks(days, interval, seed)
+    for d in tickList:
+        n = rnd.random()
+        if n < 0.01:
+            d['askPrice1'] = 0
+        elif n < 0.02:
+            d['bidPrice1'] = 0
+    return tickList
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=u'回测引擎委托撮合的一致性检查')
+    parser.add_argument('--barDays', type=int, default=20, help=u'K线数据的交易日数量')
+    parser.add_argument('--tickDays', type=int, default=1, help=u'tick数据的交易日数量')
+    parser.add_argument('--tickInterval', type=int, default=2, help=u'tick间隔秒数')
+    args = parser.parse_args()
+
+    tempPath = tempfile.mkdtemp(prefix='vnpyMatchingCheck')
+
+    try:
+        barPath = os.path.join(tempPath, 'bar')
+        saveHistoryCache(barPath, [], generateBars(args.barDays))
+
+        tickPath = os.path.join(tempPath, 'tick')
+        saveHistoryCache(tickPath, [], generateCheckTicks(args.tickDays, args.tickInterval))
+
+        resultList = [checkMode(BacktestingEngine.BAR_MODE, barPath),
+                      checkMode(BacktestingEngine.TICK_MODE, tickPath)]
+    finally:
+        shutil.rmtree(tempPath, ignore_errors=True)
+
+    if all(resultList):
+        print u'撮合结果一致'
+    else:
+        print u'撮合结果不一致'
+        sys.exit(1)
@@ -9,8 +9,11 @@ same as CTA engine. Real trading code can be directly used for backtesting.
 
 from __future__ import division
 
+from datetime import timedelta
+
 from vnpy.trader.vtObject import VtTickData, VtBarData
 from ctaBacktesting import *
+from ctaInfoFeeder import InfoBarFeeder, inferInterval
 
 class BacktestEngineMultiTF(BacktestingEngine):
 
@@ -18,10 +21,9 @@ class BacktestEngineMultiTF(BacktestingEngine):
         """Constructor"""
         super(BacktestEngineMultiTF, self).__init__()
 
-        self.info_symbols   = []        # List, 输入辅助品种的2值tuple, 左边为数据库名, 右边为collection名
-        self.InfoCursor     = {}        # Dict, 放置回测用辅助品种数据库
-        self.initInfoCursor = {}        # Dict, 放置初始化用辅助品种数据库
-        self.infobar        = {}        # Dict, 放置辅助品种最新一个K线数据
+        self.info_symbols   = []        # List, 输入辅助品种的tuple: (数据库名, collection名[, K线周期分钟数])
+        self.infoFeeder     = InfoBarFeeder()   # 辅助品种数据按时间对齐推送
+        self.barInterval    = None      # timedelta, 执行品种的K线周期, 为None则根据数据推断
         self.MultiOn        = False     # Boolean, 判断是否传入了辅助品种
 
     # ----------------------------------------------------------------------
@@ -39,6 +41,10 @@ class BacktestEngineMultiTF(BacktestingEngine):
             if len(self.info_symbols) > 0:
                 self.MultiOn = True
 
+        # Bar interval of executed symbol in minutes, inferred from data if not set
+        if "bar_interval" in kwargs:
+            self.barInterval = timedelta(minutes=kwargs["bar_interval"])
+
     # ----------------------------------------------------------------------
     def loadInitData(self, collection, **kwargs):
         """Load initializing data"""
@@ -49,14 +55,7 @@ class BacktestEngineMultiTF(BacktestingEngine):
         # $lt means "less than"
         flt = {'datetime': {'$gte': self.dataStartDate,
                             '$lt': self.strategyStartDate}}
-        self.initCursor = collection.find(flt)
-
-        # 初始化辅助品种数据
-        # Initializing information data
-        if "inf" in kwargs:
-            for name in kwargs["inf"]:
-                DB = kwargs["inf"][name]
-                self.initInfoCursor[name] = DB.find(flt)
+        self.initCursor = collection.find(flt).sort('datetime')
 
         # 将数据从查询指针中读取出，并生成列表
         # Read data from cursor, generate a list
@@ -73,13 +72,6 @@ class BacktestEngineMultiTF(BacktestingEngine):
         self.dbClient = pymongo.MongoClient(globalSetting['mongoHost'], globalSetting['mongoPort'])
         collection = self.dbClient[self.dbName][self.symbol]
 
-        # Load historical data of information symbols, construct a dictionary of Database
-        # Values of dictionary are mongo.Client.
-        info_collection = {}
-        if self.MultiOn is True:
-            for DBname, symbol in self.info_symbols:
-                info_collection[DBname + " " + symbol] = self.dbClient[DBname][symbol]
-
         self.output("Start loading historical data")
 
         # 首先根据回测模式，确认要使用的数据类
@@ -92,7 +84,7 @@ class BacktestEngineMultiTF(BacktestingEngine):
             self.func = self.newTick
 
         # Load initializing data
-        self.loadInitData(collection, inf=info_collection)
+        self.loadInitData(collection)
 
         # 载入回测数据
         # Load backtest data (exclude initializing data)
@@ -102,16 +94,48 @@ class BacktestEngineMultiTF(BacktestingEngine):
         else:
             flt = {'datetime': {'$gte': self.strategyStartDate,
                                 '$lte': self.dataEndDate}}
-        self.dbCursor = collection.find(flt)
+        self.dbCursor = collection.find(flt).sort('datetime')
+
+        # 执行品种的K线周期, 用于计算K线收盘时间
+        # Bar interval of executed symbol, used to get the close time of bars
+        if self.barInterval is None:
+            if self.mode == self.BAR_MODE:
+                sample = collection.find(flt, {'datetime': True}).sort('datetime').limit(1000)
+                self.barInterval = inferInterval([d['datetime'] for d in sample])
+            else:
+                self.barInterval = timedelta(0)
 
-        if self.MultiOn is True:
-            for db in info_collection:
-                self.InfoCursor[db] = info_collection[db].find(flt)
-            self.output(
-                "Data loading completed, data volumn: %s" % (self.initCursor.count() + self.dbCursor.count() + \
-                                                             sum([i.count() for i in self.InfoCursor.values()])))
-        else:
-            self.output("Data loading completed, data volumn: %s" % (self.initCursor.count() + self.dbCursor.count()))
+        # 辅助品种数据覆盖初始化和回测的全部时间段, 按时间排序后载入
+        # Load sorted information data covering both initializing and backtesting periods
+        self.loadInfoData()
+
+        self.output("Data loading completed, data volumn: %s" % (self.initCursor.count() + self.dbCursor.count() +
+                                                                 self.infoFeeder.getDataCount()))
+
+    # ----------------------------------------------------------------------
+    def loadInfoData(self):
+        """载入辅助品种数据"""
+        """Load information data"""
+        self.infoFeeder = InfoBarFeeder()
+        if self.MultiOn is not True:
+            return
+
+        flt = {'datetime': {'$gte': self.dataStartDate}}
+        if self.dataEndDate:
+            flt['datetime']['$lte'] = self.dataEndDate
+
+        for info in self.info_symbols:
+            DBname, symbol = info[0], info[1]
+
+            interval = None
+            if len(info) > 2:
+                interval = timedelta(minutes=info[2])
+
+            dataList = list(self.dbClient[DBname][symbol].find(flt, {'_id': False}).sort('datetime'))
+            if not dataList:
+                raise ValueError("Data of information symbol %s %s is empty!" % (DBname, symbol))
+
+            self.infoFeeder.addSeries(DBname + " " + symbol, dataList, interval)
 
     # ----------------------------------------------------------------------
     def runBacktesting(self):
@@ -144,37 +168,17 @@ class BacktestEngineMultiTF(BacktestingEngine):
         self.output("No more historical data")
 
     # ----------------------------------------------------------------------
-    def checkInformationData(self):
-        """Update information symbols' data"""
-
-        # If infobar is empty, which means it is the first time calling this method
-        if self.infobar == {}:
-            for info_symbol in self.InfoCursor:
-                try:
-                    self.infobar[info_symbol] = next(self.InfoCursor[info_symbol])
-                except StopIteration:
-                    print "Data of information symbols is empty! Input must be a list, not str."
-                    raise
-
-        temp = {}
-        for info_symbol in self.infobar:
-
-            data = self.infobar[info_symbol]
-
-            # Update data only when Time Stamp is matched
-            if (data is not None) and (data['datetime'] <= self.dt):
-
-                try:
-                    temp[info_symbol] = VtBarData()
-                    temp[info_symbol].__dict__ = data
-                    self.infobar[info_symbol] = next(self.InfoCursor[info_symbol])
-                except StopIteration:
-                    self.infobar[info_symbol] = None
-                    self.output("No more data in information database.")
-            else:
-                temp[info_symbol] = None
-
-        return temp
+    def checkInformationData(self, dt=None):
+        """
+        获取执行品种K线收盘时新收盘的辅助品种K线字典, 没有新K线的品种为None
+        dt为执行品种K线的时间, 为None则使用最新数据的时间（初始化时策略传入初始化数据的时间）
+        Return newly closed information bars at the close of the executed bar,
+        None for symbols without a new bar.
+        """
+        if dt is None:
+            dt = self.dt
+
+        return self.infoFeeder.getInfoBars(dt + self.barInterval)
 
     # ----------------------------------------------------------------------
     def newBar(self, bar):
@@ -0,0 +1,185 @@
+# encoding: UTF-8
+
+'''
+辅助品种（其他时间框架、其他合约）K线数据的时间对齐
+Time alignment of information bars (other time frames or other symbols).
+
+1. 每个辅助品种的数据按时间排序后保存为平行的列表（收盘时间、数据字典）
+2. 执行品种每根K线收盘时，只推送收盘时间不晚于该时间的最新一根辅助K线（即已经完成的K线，避免未来函数）
+3. 时间单调增加时只需要检查游标的下一个位置，均摊O(1)；跳跃或者回退时使用二分查找重新定位
+
+回测引擎批量载入数据，实盘中可以逐根追加数据，两者使用相同的对齐逻辑。
+The backtesting engine loads bars in bulk, live trading appends bars one by one,
+both share the same alignment logic.
+'''
+
+from bisect import bisect_right, insort
+from collections import OrderedDict
+from datetime import timedelta
+
+from vnpy.trader.vtObject import VtBarData
+
+
+#----------------------------------------------------------------------
+def inferInterval(datetimeList, sampleSize=1000):
+    """根据前sampleSize个时间的最小正间隔推断K线周期，无法推断时返回0"""
+    sample = sorted(datetimeList[:sampleSize])
+    deltaList = [b - a for a, b in zip(sample[:-1], sample[1:]) if b > a]
+    if not deltaList:
+        return timedelta(0)
+    return min(deltaList)
+
+
+########################################################################
+class InfoBarSeries(object):
+    """单个辅助品种的K线序列"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, name, interval=None):
+        """
+        Constructor
+        name：辅助品种名称
+        interval：K线周期（timedelta），K线时间加上周期为收盘时间，为None则根据数据推断
+        """
+        self.name = name
+        self.interval = interval
+
+        self.closeTimeList = []     # 按时间排序的收盘时间
+        self.dataList = []          # 和收盘时间对应的数据字典
+
+        self.cursor = 0             # 已经收盘的K线数量
+        self.pushedCursor = 0       # 上次推送时已经收盘的K线数量
+        self.lastDt = None          # 上次对齐的时间
+
+    #----------------------------------------------------------------------
+    def loadData(self, dataList):
+        """批量载入数据字典（无需排序）"""
+        dataList = sorted(dataList, key=lambda d: d['datetime'])
+
+        if self.interval is None:
+            self.interval = inferInterval([d['datetime'] for d in dataList])
+
+        self.dataList = dataList
+        self.closeTimeList = [d['datetime'] + self.interval for d in dataList]
+        self.reset()
+
+    #----------------------------------------------------------------------
+    def appendData(self, d):
+        """追加一根K线的数据字典（实盘中使用），时间乱序时插入到对应位置"""
+        if self.interval is None:
+            self.interval = timedelta(0)
+
+        closeTime = d['datetime'] + self.interval
+        i = bisect_right(self.closeTimeList, closeTime)
+        self.closeTimeList.insert(i, closeTime)
+        self.dataList.insert(i, d)
+
+        # 插入到已经收盘的位置之前时，游标同时后移
+        if i < self.cursor:
+            self.cursor += 1
+            self.pushedCursor += 1
+
+    #----------------------------------------------------------------------
+    def reset(self):
+        """重置游标（重新回放数据时使用）"""
+        self.cursor = 0
+        self.pushedCursor = 0
+        self.lastDt = None
+
+    #----------------------------------------------------------------------
+    def align(self, dt):
+        """移动游标到dt时已经收盘的位置"""
+        closeTimeList = self.closeTimeList
+
+        if self.lastDt is not None and dt < self.lastDt:
+            # 时间回退，重新定位
+            self.cursor = bisect_right(closeTimeList, dt)
+            self.pushedCursor = min(self.pushedCursor, self.cursor)
+        elif self.cursor < len(closeTimeList) and closeTimeList[self.cursor] <= dt:
+            # 大部分情况下最多前进一根K线，只有跳跃时才需要二分查找
+            if self.cursor + 1 >= len(closeTimeList) or closeTimeList[self.cursor + 1] > dt:
+                self.cursor += 1
+            else:
+                self.cursor = bisect_right(closeTimeList, dt, self.cursor)
+
+        self.lastDt = dt
+
+    #----------------------------------------------------------------------
+    def getLatestBar(self, dt=None):
+        """获取最新一根已经收盘的K线，没有则返回None"""
+        if dt is not None:
+            self.align(dt)
+
+        if not self.cursor:
+            return None
+        return self.createBar(self.cursor - 1)
+
+    #----------------------------------------------------------------------
+    def getNewBar(self, dt):
+        """对齐到dt，若上次推送后有新收盘的K线则返回其中最新的一根，否则返回None"""
+        self.align(dt)
+
+        if self.cursor <= self.pushedCursor:
+            return None
+
+        self.pushedCursor = self.cursor
+        return self.createBar(self.cursor - 1)
+
+    #----------------------------------------------------------------------
+    def createBar(self, i):
+        """创建第i根K线的数据对象"""
+        bar = VtBarData()
+        bar.__dict__ = self.dataList[i]
+        return bar
+
+
+########################################################################
+class InfoBarFeeder(object):
+    """多个辅助品种的K线推送"""
+
+    #----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.seriesDict = OrderedDict()
+
+    #----------------------------------------------------------------------
+    def addSeries(self, name, dataList=None, interval=None):
+        """添加辅助品种，dataList为批量载入的数据字典列表（回测使用）"""
+        series = InfoBarSeries(name, interval)
+        if dataList is not None:
+            series.loadData(dataList)
+        self.seriesDict[name] = series
+        return series
+
+    #----------------------------------------------------------------------
+    def appendData(self, name, d):
+        """追加辅助品种的一根K线数据字典（实盘使用）"""
+        if name not in self.seriesDict:
+            self.addSeries(name)
+        self.seriesDict[name].appendData(d)
+
+    #----------------------------------------------------------------------
+    def getInfoBars(self, dt):
+        """
+        获取dt时刻各个辅助品种新收盘的K线字典，key为辅助品种名称，
+        value为上次调用后新收盘的最新一根K线，没有新K线时为None
+        """
+        return OrderedDict([(name, series.getNewBar(dt))
+                            for name, series in self.seriesDict.items()])
+
+    #----------------------------------------------------------------------
+    def getLatestBars(self, dt=None):
+        """获取各个辅助品种最新一根已经收盘的K线字典"""
+        return OrderedDict([(name, series.getLatestBar(dt))
+                            for name, series in self.seriesDict.items()])
+
+    #----------------------------------------------------------------------
+    def reset(self):
+        """重置所有辅助品种的游标"""
+        for series in self.seriesDict.values():
+            series.reset()
+
+    #----------------------------------------------------------------------
+    def getDataCount(self):
+        """全部辅助品种的数据数量"""
+        return sum([len(series.dataList) for series in self.seriesDict.values()])
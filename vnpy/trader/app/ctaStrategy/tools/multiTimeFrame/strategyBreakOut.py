@@ -34,7 +34,6 @@ class BreakOut(CtaTemplate):
 
         # 设置辅助品种数据字典
         self.infoArray = {}
-        self.initInfobar = {}
         self.infoBar = {}
 
         # 缓存数据量
@@ -103,43 +102,11 @@ class BreakOut(CtaTemplate):
     # ----------------------------------------------------------------------
     def checkInfoBar(self, bar):
         """在初始化时, 检查辅助品种数据的推送(初始化结束后, 回测时不会调用)"""
+        """Check information bars while initializing (not called during backtesting)"""
 
-        initInfoCursorDict = self.ctaEngine.initInfoCursor
-
-        # 如果"initInfobar"字典为空, 初始化字典, 插入第一个数据
-        # If dictionary "initInfobar" is empty, insert first data record
-        if self.initInfobar == {}:
-            for info_symbol in initInfoCursorDict:
-                try:
-                    self.initInfobar[info_symbol] = next(initInfoCursorDict[info_symbol])
-                except StopIteration:
-                    print "Data of information symbols is empty! Input is a list, not str."
-                    raise
-
-        # 若有某一品种的 TimeStamp 和执行报价的 TimeStamp 匹配, 则将"initInfobar"中的数据推送,
-        # 然后更新该品种的数据
-        # If any symbol's TimeStamp is matched with execution symbol's TimeStamp, return data
-        # in "initInfobar", and update new data.
-        temp = {}
-        for info_symbol in self.initInfobar:
-
-            data = self.initInfobar[info_symbol]
-
-            # Update data only when Time Stamp is matched
-
-            if (data is not None) and (data['datetime'] <= bar.datetime):
-
-                try:
-                    temp[info_symbol] = CtaBarData()
-                    temp[info_symbol].__dict__ = data
-                    self.initInfobar[info_symbol] = next(initInfoCursorDict[info_symbol])
-                except StopIteration:
-                    self.initInfobar[info_symbol] = None
-                    self.ctaEngine.output("No more data for initializing %s." % (info_symbol,))
-            else:
-                temp[info_symbol] = None
-
-        return temp
+        # 由回测引擎按时间对齐, 只推送在执行品种K线收盘时已经收盘的辅助品种K线
+        # Aligned by the engine, only information bars closed before the executed bar are returned
+        return self.ctaEngine.checkInformationData(bar.datetime)
 
     # ----------------------------------------------------------------------
     def updateInfoArray(self, infobar):
@@ -17,6 +17,7 @@ from vnpy.api.ctp import MdApi, TdApi, defineDict
 from vnpy.trader.vtGateway import *
 from vnpy.trader.vtFunction import getJsonPath, getTempPath
 from vnpy.trader.vtConstant import GATEWAYTYPE_FUTURES
+from vnpy.trader.vtLatency import latencyTracer, STAGE_GATEWAY, STAGE_ORDER_SEND
 from .language import text
 
 
@@ -329,6 +330,7 @@ class CtpMdApi(MdApi):
         """行情推送"""
         # 创建对象
         tick = VtTickData()
+        latencyTracer.stampTick(tick, STAGE_GATEWAY)
         tick.gatewayName = self.gatewayName
         
         tick.symbol = data['InstrumentID']
@@ -1412,6 +1414,7 @@ class CtpTdApi(TdApi):
             req['VolumeCondition'] = defineDict['THOST_FTDC_VC_CV']        
         
         self.reqOrderInsert(req, self.reqID)
+        latencyTracer.stampOrder(STAGE_ORDER_SEND)
         
         # 返回订单号（字符串），便于某些算法进行动态管理
         vtOrderID = '.'.join([self.gatewayName, str(self.orderRef)])
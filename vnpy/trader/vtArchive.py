@@ -0,0 +1,136 @@
+# encoding: UTF-8
+
+"""
+有限长度的归档容器，用于保存长时间运行时不断增长的已结束数据（如已完成的委托、成交编号）
+
+超出保留数量时按最后插入或者更新的顺序移除最早的数据，被移除的数据可以选择写入到硬盘上的历史文件中，
+因此内存占用只取决于保留数量，而和程序运行时间无关。
+
+为了避免达到上限后每次插入都写一次历史文件，超出时一次移除到保留数量的EVICT_RATIO，
+即大约每插入10%的保留数量才写一次文件。
+"""
+
+import csv
+from collections import OrderedDict
+
+
+EVICT_RATIO = 0.9       # 超出保留数量时，移除后剩余的数据比例
+
+
+########################################################################
+class ArchiveDict(object):
+    """有限长度的归档字典"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, maxSize, historyPath='', formatter=None):
+        """
+        maxSize：内存中保留的最大数据数量
+        historyPath：被移除数据写入的CSV文件路径，为空则直接丢弃
+        formatter：把(key, value)转化为CSV一行数据（列表）的函数
+        """
+        self.maxSize = maxSize
+        self.historyPath = historyPath
+        self.formatter = formatter
+
+        self.dataDict = OrderedDict()
+        self.evictedCount = 0           # 累计移除的数据数量
+
+    #----------------------------------------------------------------------
+    def __setitem__(self, key, value):
+        """插入或者更新数据，超出保留数量时移除最早的数据"""
+        # 更新时移到最后，按最后更新的时间移除（如委托状态不断更新的活动委托不会被先移除）
+        self.dataDict.pop(key, None)
+        self.dataDict[key] = value
+
+        if len(self.dataDict) > self.maxSize:
+            self.evict()
+
+    #----------------------------------------------------------------------
+    def __getitem__(self, key):
+        """获取数据"""
+        return self.dataDict[key]
+
+    #----------------------------------------------------------------------
+    def __contains__(self, key):
+        """检查数据是否存在"""
+        return key in self.dataDict
+
+    #----------------------------------------------------------------------
+    def __len__(self):
+        """数据数量"""
+        return len(self.dataDict)
+
+    #----------------------------------------------------------------------
+    def get(self, key, default=None):
+        """获取数据，不存在则返回default"""
+        return self.dataDict.get(key, default)
+
+    #----------------------------------------------------------------------
+    def pop(self, key, default=None):
+        """移除并返回数据"""
+        return self.dataDict.pop(key, default)
+
+    #----------------------------------------------------------------------
+    def keys(self):
+        """全部key（列表）"""
+        return self.dataDict.keys()
+
+    #----------------------------------------------------------------------
+    def values(self):
+        """全部value（列表）"""
+        return self.dataDict.values()
+
+    #----------------------------------------------------------------------
+    def items(self):
+        """全部(key, value)（列表）"""
+        return self.dataDict.items()
+
+    #----------------------------------------------------------------------
+    def clear(self):
+        """清空数据（不写入历史文件）"""
+        self.dataDict.clear()
+
+    #----------------------------------------------------------------------
+    def evict(self):
+        """超出保留数量时批量移除最早的数据（剩余保留数量的EVICT_RATIO），写入历史文件"""
+        if len(self.dataDict) <= self.maxSize:
+            return
+
+        # 至少保留最新插入的数据
+        targetSize = max(int(self.maxSize * EVICT_RATIO), min(self.maxSize, 1))
+
+        evictedList = []
+        while len(self.dataDict) > targetSize:
+            evictedList.append(self.dataDict.popitem(last=False))
+
+        self.evictedCount += len(evictedList)
+
+        if self.historyPath and self.formatter:
+            with open(self.historyPath, 'ab') as f:
+                writer = csv.writer(f)
+                for key, value in evictedList:
+                    row = [unicode(x).encode('UTF-8') for x in self.formatter(key, value)]
+                    writer.writerow(row)
+
+    #----------------------------------------------------------------------
+    def setMaxSize(self, maxSize):
+        """修改保留数量"""
+        self.maxSize = maxSize
+        self.evict()
+
+    #----------------------------------------------------------------------
+    def getStats(self):
+        """获取内存使用统计"""
+        return {'size': len(self.dataDict),
+                'maxSize': self.maxSize,
+                'evicted': self.evictedCount}
+
+
+########################################################################
+class ArchiveSet(ArchiveDict):
+    """有限长度的归档集合（只保存key，用于过滤重复推送等）"""
+
+    #----------------------------------------------------------------------
+    def add(self, key):
+        """添加数据"""
+        self[key] = None
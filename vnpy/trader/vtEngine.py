@@ -14,6 +14,7 @@ from vnpy.trader.vtEvent import *
 from vnpy.trader.vtGateway import *
 from vnpy.trader.language import text
 from vnpy.trader.vtFunction import getTempPath
+from vnpy.trader.vtArchive import ArchiveDict
 
 
 ########################################################################
@@ -285,6 +286,9 @@ class DataEngine(object):
     """数据引擎"""
     contractFileName = 'ContractData.vt'
     contractFilePath = getTempPath(contractFileName)
+    
+    orderRetention = 10000                          # 内存中保留的委托数量
+    orderHistoryFileName = 'OrderHistory.csv'       # 超出保留数量的委托写入的文件
 
     #----------------------------------------------------------------------
     def __init__(self, eventEngine):
@@ -294,8 +298,10 @@ class DataEngine(object):
         # 保存合约详细信息的字典
         self.contractDict = {}
         
-        # 保存委托数据的字典
-        self.orderDict = {}
+        # 保存委托数据的字典，只保留最近的委托，更早的委托写入硬盘
+        self.orderDict = ArchiveDict(self.orderRetention, 
+                                     getTempPath(self.orderHistoryFileName),
+                                     self.formatOrder)
         
         # 保存活动委托数据的字典（即可撤销）
         self.workingOrderDict = {}
@@ -360,10 +366,24 @@ class DataEngine(object):
     #----------------------------------------------------------------------
     def getOrder(self, vtOrderID):
         """查询委托"""
-        try:
-            return self.orderDict[vtOrderID]
-        except KeyError:
-            return None
+        # 活动委托一定可以查到，已结束的委托只能查到保留范围内的
+        order = self.workingOrderDict.get(vtOrderID, None)
+        if order:
+            return order
+        return self.orderDict.get(vtOrderID, None)
+    
+    #----------------------------------------------------------------------
+    def formatOrder(self, vtOrderID, order):
+        """把委托转化为历史文件中的一行数据"""
+        return [vtOrderID, order.vtSymbol, order.direction, order.offset,
+                order.price, order.totalVolume, order.tradedVolume, order.status,
+                order.orderTime, order.cancelTime]
+    
+    #----------------------------------------------------------------------
+    def getMemoryStats(self):
+        """获取委托相关数据的内存使用统计"""
+        return {'orderDict': self.orderDict.getStats(),
+                'workingOrderDict': {'size': len(self.workingOrderDict)}}
     
     #----------------------------------------------------------------------
     def getAllWorkingOrders(self):
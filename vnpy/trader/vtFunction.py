@@ -7,6 +7,7 @@
 import os
 import decimal
 import json
+import importlib
 from datetime import datetime
 
 
@@ -37,19 +38,21 @@ def todayDate():
     return datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)    
 
 
-# 图标路径
-iconPathDict = {}
-
-path = os.path.abspath(os.path.dirname(__file__))
-for root, subdirs, files in os.walk(path):
-    for fileName in files:
-        if '.ico' in fileName:
-            iconPathDict[fileName] = os.path.join(root, fileName)
+# 图标路径，首次使用时才遍历目录（回测进程等不需要图标的场合不必付出启动开销）
+iconPathDict = None
 
 #----------------------------------------------------------------------
 def loadIconPath(iconName):
     """加载程序图标路径"""   
     global iconPathDict
+    if iconPathDict is None:
+        iconPathDict = {}
+        path = os.path.abspath(os.path.dirname(__file__))
+        for root, subdirs, files in os.walk(path):
+            for fileName in files:
+                if '.ico' in fileName:
+                    iconPathDict[fileName] = os.path.join(root, fileName)
+    
     return iconPathDict.get(iconName, '')    
     
 
@@ -89,3 +92,50 @@ def getJsonPath(name, moduleFile):
     
     
     
+
+
+########################################################################
+class LazyModule(object):
+    """
+    延迟载入的模块，首次访问其属性时才真正import
+    用于绘图、数据库等只在部分功能中用到的重量级模块，减少程序和多进程子进程的启动时间
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, name, onLoad=None):
+        """
+        Constructor
+        name：模块名，如matplotlib.pyplot
+        onLoad：模块载入后调用的函数（参数为模块），用于载入后的设置
+        """
+        self.__dict__['_name'] = name
+        self.__dict__['_onLoad'] = onLoad
+        self.__dict__['_module'] = None
+    
+    #----------------------------------------------------------------------
+    def _load(self):
+        """载入模块"""
+        if self._module is None:
+            module = importlib.import_module(self._name)
+            self.__dict__['_module'] = module
+            
+            if self._onLoad:
+                self._onLoad(module)
+        return self._module
+    
+    #----------------------------------------------------------------------
+    def __getattr__(self, name):
+        """访问属性时载入模块"""
+        return getattr(self._load(), name)
+    
+    #----------------------------------------------------------------------
+    def __setattr__(self, name, value):
+        """设置属性"""
+        setattr(self._load(), name, value)
+    
+    #----------------------------------------------------------------------
+    def __repr__(self):
+        """字符串表示"""
+        if self._module is None:
+            return '<LazyModule %s (not loaded)>' %self._name
+        return repr(self._module)
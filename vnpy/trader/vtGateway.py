@@ -7,6 +7,7 @@ from vnpy.event import *
 from vnpy.trader.vtEvent import *
 from vnpy.trader.vtConstant import *
 from vnpy.trader.vtObject import *
+from vnpy.trader.vtLatency import latencyTracer, STAGE_ENQUEUE
 
 
 ########################################################################
@@ -22,6 +23,8 @@ class VtGateway(object):
     #----------------------------------------------------------------------
     def onTick(self, tick):
         """市场行情推送"""
+        latencyTracer.stampTick(tick, STAGE_ENQUEUE)
+        
         # 通用事件
         event1 = Event(type_=EVENT_TICK)
         event1.dict_['data'] = tick
@@ -0,0 +1,259 @@
+# encoding: UTF-8
+
+"""
+行情到委托的内部延时追踪
+
+在tick数据经过的各个环节记录单调时钟的时间戳：
+1. 接口收到行情
+2. 事件放入队列
+3. 事件引擎分发到CTA引擎
+4. 策略回调函数开始和结束
+5. 创建委托请求
+6. 接口发出委托
+
+策略回调结束时，把相邻环节之间的耗时按策略汇总到直方图中，可以随时输出查看。
+追踪功能默认关闭，通过VT_setting.json中的latencyTrace打开，关闭时各环节只有一次布尔检查的开销。
+"""
+
+import os
+import sys
+import ctypes
+import ctypes.util
+from threading import Lock, local
+from weakref import WeakKeyDictionary
+from collections import OrderedDict
+
+from vnpy.trader.vtGlobal import globalSetting
+
+
+CLOCK_MONOTONIC = 1     # Linux下clock_gettime的单调时钟编号
+
+
+########################################################################
+class Timespec(ctypes.Structure):
+    """clock_gettime使用的时间结构体"""
+    _fields_ = [('tv_sec', ctypes.c_long),
+                ('tv_nsec', ctypes.c_long)]
+
+
+#----------------------------------------------------------------------
+def loadLinuxMonotonic():
+    """通过ctypes调用Linux的clock_gettime(CLOCK_MONOTONIC)，不可用时返回None"""
+    if not sys.platform.startswith('linux'):
+        return None
+    
+    try:
+        libName = ctypes.util.find_library('rt') or ctypes.util.find_library('c')
+        clockGettime = ctypes.CDLL(libName, use_errno=True).clock_gettime
+    except (OSError, AttributeError, TypeError):
+        return None
+    
+    clockGettime.argtypes = [ctypes.c_int, ctypes.POINTER(Timespec)]
+    
+    def monotonic():
+        """单调时钟的秒数"""
+        t = Timespec()
+        if clockGettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return t.tv_sec + t.tv_nsec * 1e-9
+    
+    return monotonic
+
+
+# 单调时钟（不受NTP等系统时间调整的影响）：
+# Python 3使用perf_counter，Python 2优先使用monotonic包，其次在Linux下通过ctypes调用clock_gettime，
+# 都不可用时才使用timeit的计时函数（Windows下为time.clock，本身即为单调时钟）
+try:
+    from time import perf_counter as monotonicTime
+except ImportError:
+    try:
+        from monotonic import monotonic as monotonicTime
+    except (ImportError, RuntimeError):
+        monotonicTime = loadLinuxMonotonic()
+        if monotonicTime is None:
+            from timeit import default_timer as monotonicTime
+
+
+# 追踪的环节
+STAGE_GATEWAY = 'gateway'               # 接口收到行情
+STAGE_ENQUEUE = 'enqueue'               # 事件放入队列
+STAGE_DISPATCH = 'dispatch'             # 事件引擎分发
+STAGE_STRATEGY_ENTER = 'strategyEnter'  # 策略回调开始
+STAGE_STRATEGY_EXIT = 'strategyExit'    # 策略回调结束
+STAGE_ORDER_REQ = 'orderReq'            # 创建委托请求
+STAGE_ORDER_SEND = 'orderSend'          # 接口发出委托
+
+# 直方图的分桶上限（微秒）
+BUCKET_LIST = [10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000]
+
+
+########################################################################
+class LatencyHistogram(object):
+    """延时直方图"""
+
+    #----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bucketList = [0] * (len(BUCKET_LIST) + 1)   # 最后一个桶保存超出上限的数据
+
+    #----------------------------------------------------------------------
+    def add(self, latency):
+        """添加一个延时数据（微秒）"""
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+        for i, bound in enumerate(BUCKET_LIST):
+            if latency <= bound:
+                self.bucketList[i] += 1
+                return
+        self.bucketList[-1] += 1
+
+    #----------------------------------------------------------------------
+    def getPercentile(self, percent):
+        """估算百分位数（返回所在分桶的上限）"""
+        if not self.count:
+            return 0
+
+        target = self.count * percent / 100.0
+        n = 0
+        for i, bucketCount in enumerate(self.bucketList):
+            n += bucketCount
+            if n >= target:
+                if i < len(BUCKET_LIST):
+                    return BUCKET_LIST[i]
+                return self.max
+        return self.max
+
+    #----------------------------------------------------------------------
+    def getMean(self):
+        """平均值"""
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+
+########################################################################
+class LatencyTracer(object):
+    """延时追踪器"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, active=False):
+        """Constructor"""
+        self.active = active
+
+        # tick对象和时间戳列表的映射，tick对象释放后自动移除
+        self.tickStampDict = WeakKeyDictionary()
+
+        # 每个线程中正在执行的策略回调的时间戳列表
+        self.context = local()
+
+        # 延时直方图字典
+        # key为策略名称，value为OrderedDict(key为(开始环节, 结束环节), value为LatencyHistogram)
+        self.histDict = {}
+
+        self.lock = Lock()
+
+    #----------------------------------------------------------------------
+    def stampTick(self, tick, stage):
+        """记录tick所经过环节的时间戳"""
+        if not self.active:
+            return
+
+        t = monotonicTime()
+        with self.lock:
+            stampList = self.tickStampDict.get(tick, None)
+            if stampList is None:
+                stampList = []
+                self.tickStampDict[tick] = stampList
+            stampList.append((stage, t))
+
+    #----------------------------------------------------------------------
+    def enterStrategy(self, data):
+        """策略回调开始，data为推送给策略的数据，只追踪tick触发的回调，返回是否开始追踪"""
+        if not self.active:
+            return False
+
+        if data is None:
+            return False
+
+        t = monotonicTime()
+        with self.lock:
+            stampList = self.tickStampDict.get(data, None)
+
+        if stampList is None:
+            return False
+
+        self.context.stampList = stampList + [(STAGE_STRATEGY_ENTER, t)]
+        return True
+
+    #----------------------------------------------------------------------
+    def stampOrder(self, stage):
+        """记录当前线程中策略回调发出委托的时间戳"""
+        if not self.active:
+            return
+
+        stampList = getattr(self.context, 'stampList', None)
+        if stampList is not None:
+            stampList.append((stage, monotonicTime()))
+
+    #----------------------------------------------------------------------
+    def exitStrategy(self, strategyName):
+        """策略回调结束，汇总时间戳到直方图"""
+        stampList = getattr(self.context, 'stampList', None)
+        if stampList is None:
+            return
+
+        stampList.append((STAGE_STRATEGY_EXIT, monotonicTime()))
+        self.context.stampList = None
+
+        with self.lock:
+            d = self.histDict.setdefault(strategyName, OrderedDict())
+
+            # 相邻环节之间的耗时
+            for (stage1, t1), (stage2, t2) in zip(stampList[:-1], stampList[1:]):
+                self.addLatency(d, (stage1, stage2), t2 - t1)
+
+            # 从收到行情到发出第一个委托的总耗时
+            for stage, t in stampList:
+                if stage == STAGE_ORDER_SEND:
+                    self.addLatency(d, (stampList[0][0], STAGE_ORDER_SEND), t - stampList[0][1])
+                    break
+
+    #----------------------------------------------------------------------
+    def addLatency(self, d, key, seconds):
+        """添加延时数据到直方图"""
+        hist = d.get(key, None)
+        if not hist:
+            hist = LatencyHistogram()
+            d[key] = hist
+        hist.add(seconds * 1000000)
+
+    #----------------------------------------------------------------------
+    def dump(self):
+        """输出所有策略的延时统计（微秒）"""
+        lines = [u'策略\t环节\t次数\t平均\tP50\tP99\t最大']
+
+        with self.lock:
+            for strategyName in sorted(self.histDict.keys()):
+                for (stage1, stage2), hist in self.histDict[strategyName].items():
+                    lines.append(u'%s\t%s->%s\t%s\t%.1f\t%s\t%s\t%.1f' %(strategyName, stage1, stage2,
+                                                                      hist.count, hist.getMean(),
+                                                                      hist.getPercentile(50),
+                                                                      hist.getPercentile(99),
+                                                                      hist.max))
+        return '\n'.join(lines)
+
+    #----------------------------------------------------------------------
+    def clear(self):
+        """清空统计数据"""
+        with self.lock:
+            self.histDict.clear()
+
+
+# 全局唯一的追踪器
+latencyTracer = LatencyTracer(globalSetting.get('latencyTrace', False))
@@ -16,6 +16,13 @@ class VtBaseData(object):
         self.gatewayName = EMPTY_STRING         # Gateway名称        
         self.rawData = None                     # 原始数据
 
+    #----------------------------------------------------------------------
+    def copy(self):
+        """复制数据对象（回测复用tick对象时，需要保存tick的策略调用）"""
+        data = self.__class__.__new__(self.__class__)
+        data.__dict__ = self.__dict__.copy()
+        return data
+
  
 ########################################################################
 class VtTickData(VtBaseData):